@@ -0,0 +1,94 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from app.auth.principal_cache import principal_cache
+from app.auth.revocation import revocation_list
+from app.services.broadcast_service import broadcast_service
+from app.services.command_service import command_dispatcher
+from app.services.db_pool import async_pool_monitor, sync_pool_monitor
+from app.services.device_cache import device_cache
+from app.services.heartbeat_buffer import heartbeat_buffer
+from app.services.liveness import liveness_tracker
+from app.services.mqtt_ingest import device_ingestor
+from app.services.password_hasher import password_hasher
+from app.services.provisioning_service import check_provisioning_token
+from app.services.replica_router import replica_router
+from app.services.telemetry_service import telemetry_writer
+from app.ws.manager import manager
+
+def require_provisioning_token(x_provisioning_token: Optional[str] = Header(None)):
+    """Metrics reveal fleet size and internal state; operators send the X-Provisioning-Token header"""
+    if not check_provisioning_token(x_provisioning_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid provisioning token"
+        )
+
+router = APIRouter(dependencies=[Depends(require_provisioning_token)])
+
+@router.get("/admin/metrics/heartbeats")
+def heartbeat_metrics():
+    """Heartbeat write-behind buffer metrics (batch size, flush latency, merged/dropped counts)"""
+    return heartbeat_buffer.stats()
+
+@router.get("/admin/metrics/mqtt-ingest")
+def mqtt_ingest_metrics():
+    """MQTT ingestion pipeline metrics (queue depth, drops, batch size and latency)"""
+    return device_ingestor.stats()
+
+@router.get("/admin/metrics/liveness")
+def liveness_metrics():
+    """Liveness tracker metrics (tracked devices, expirations, offline marks, sweep latency)"""
+    return liveness_tracker.stats()
+
+@router.get("/admin/metrics/telemetry")
+def telemetry_metrics():
+    """Telemetry writer metrics (buffered samples, rows and rollups written, partitions dropped)"""
+    return telemetry_writer.stats()
+
+@router.get("/admin/metrics/principal-cache")
+def principal_cache_metrics():
+    """Authenticated-principal cache metrics; hits are user lookups that skipped the database"""
+    return principal_cache.stats()
+
+@router.get("/admin/metrics/device-cache")
+def device_cache_metrics():
+    """Device read-through cache metrics; pk_lookups_saved counts device SELECTs that were skipped"""
+    return device_cache.stats()
+
+@router.get("/admin/metrics/password-hasher")
+def password_hasher_metrics():
+    """Password hashing pool metrics (queue depth, rejections, hash/verify latency)"""
+    return password_hasher.stats()
+
+@router.get("/admin/metrics/revocation")
+def revocation_metrics():
+    """Token revocation set metrics (size, rejected tokens, refreshes)"""
+    return revocation_list.stats()
+
+@router.get("/admin/metrics/websockets")
+def websocket_metrics():
+    """Live device event push metrics (connected users and sockets, delivered events, send errors)"""
+    return manager.stats()
+
+@router.get("/admin/metrics/commands")
+def command_metrics():
+    """Device command dispatch metrics (pending, acked, timeouts, round-trip latency per command type)"""
+    return command_dispatcher.stats()
+
+@router.get("/admin/metrics/broadcasts")
+def broadcast_metrics():
+    """Broadcast command metrics (queued and tracked broadcasts, messages published, acks)"""
+    return broadcast_service.stats()
+
+@router.get("/admin/metrics/db-pool")
+def db_pool_metrics():
+    """Connection pool metrics (in-use/idle gauges, saturation, checkout wait, timeouts)"""
+    return {
+        "sync": sync_pool_monitor.stats(),
+        "async": async_pool_monitor.stats(),
+    }
+
+@router.get("/admin/metrics/replicas")
+def replica_metrics():
+    """Read replica health, lag and routing counters (replica, sticky and fallback reads)"""
+    return replica_router.stats()
@@ -2,10 +2,16 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import timedelta
+from datetime import datetime, timedelta
 from app.services.get_db import get_db
-from app.services.user_service import get_user_by_email, create_user, verify_password
-from app.auth.auth import create_access_token, get_current_active_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.services.user_service import get_user_by_email, create_user, verify_password_and_update
+from app.services.password_hasher import HasherBusyError
+from app.auth.auth import (
+    create_access_token, decode_token, get_current_active_user, oauth2_scheme, user_token_claims,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+)
+from app.auth.revocation import revocation_list
+from app.services.serialization import user_serializer
 from app import schemas
 import logging
 
@@ -38,6 +44,12 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         
     except HTTPException:
         raise
+    except HasherBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error creating user: {str(e)}")
         raise HTTPException(
@@ -60,7 +72,7 @@ def login_with_email(
     try:
         user = get_user_by_email(db, email=login_data.email)
         
-        if not user or not verify_password(login_data.password, user.password_hash):
+        if not user or not verify_password_and_update(db, user, login_data.password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
@@ -69,7 +81,7 @@ def login_with_email(
         
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data=user_token_claims(user), expires_delta=access_token_expires
         )
         
         return schemas.Token(
@@ -81,6 +93,12 @@ def login_with_email(
         
     except HTTPException:
         raise
+    except HasherBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error during login: {str(e)}")
         raise HTTPException(
@@ -103,7 +121,7 @@ def login_for_access_token(
     try:
         user = get_user_by_email(db, email=login_data.email)
         
-        if not user or not verify_password(login_data.password, user.password_hash):
+        if not user or not verify_password_and_update(db, user, login_data.password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
@@ -112,7 +130,7 @@ def login_for_access_token(
         
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data=user_token_claims(user), expires_delta=access_token_expires
         )
         
         return schemas.Token(
@@ -124,6 +142,12 @@ def login_for_access_token(
         
     except HTTPException:
         raise
+    except HasherBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error during login: {str(e)}")
         raise HTTPException(
@@ -137,6 +161,50 @@ def login_for_access_token(
             detail="An unexpected error occurred"
         )
 
+@router.post("/auth/logout")
+def logout(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """
+    Revoke the current access token.
+    
+    Requires authentication via Bearer token.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = decode_token(token, credentials_exception)
+        jti = payload.get("jti")
+        if jti is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Token cannot be revoked, it expires on its own"
+            )
+        
+        revocation_list.revoke(
+            db,
+            jti=jti,
+            expires_at=datetime.utcfromtimestamp(payload["exp"]),
+            user_id=payload.get("uid"),
+        )
+        return {"message": "Logged out"}
+        
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"Database error during logout: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error during logout: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
 @router.get("/auth/me", response_model=schemas.User)
 def read_users_me(current_user: schemas.User = Depends(get_current_active_user)):
     """
@@ -144,7 +212,7 @@ def read_users_me(current_user: schemas.User = Depends(get_current_active_user))
     
     Requires authentication via Bearer token.
     """
-    return current_user
+    return user_serializer.response(current_user)
 
 @router.put("/auth/me", response_model=schemas.User)
 def update_user_profile(
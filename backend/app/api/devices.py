@@ -1,15 +1,28 @@
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-from pydantic import BaseModel
-from datetime import datetime
-from typing import List, Optional
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
 from app import models, schemas
-from app.services.get_db import get_db
-from app.services import device_service
+from app.database import ASYNC_DB
+from app.services.get_db import get_db, get_read_db, get_async_db
+from app.services import device_service, telemetry_service
+from app.services.downsampling import lttb, min_max_buckets
+from app.services.heartbeat_buffer import UnknownDeviceError, heartbeat_buffer
+from app.services.command_service import COMMAND_MAX_WAIT_MS, DispatcherBusyError, command_dispatcher
+from app.services.broadcast_service import BroadcastBusyError, broadcast_service
+from app.services.provisioning_service import DeviceProvisioner, RecordParser, check_provisioning_token
+from app.services.pagination import InvalidCursorError, decode_cursor, page_size, paginate, set_next_cursor
+from app.services.serialization import FastJSONResponse, device_serializer
+from app.services.etag import etag_matches, make_etag, not_modified, set_etag
 from app.auth.auth import get_current_active_user
+from app.ws.manager import manager, status_event
 import logging
+import traceback
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -27,7 +40,20 @@ class DeviceRegistration(BaseModel):
 class DeviceActivation(BaseModel):
     activation_key: str
 
-@router.post("/device/register")
+# Command sent to many devices; every given filter must match
+class BroadcastRequest(BaseModel):
+    type: str = Field(..., min_length=1)
+    payload: Optional[Any] = None
+    firmware_version: Optional[str] = None
+    statuses: Optional[List[models.DeviceStatus]] = None
+    device_ids: Optional[List[str]] = None
+    # Messages per second, capped by BROADCAST_MAX_RATE
+    rate: Optional[float] = Field(None, gt=0)
+
+# Fleet-wide broadcast from operators; without owner_id every owner is targeted
+class FleetBroadcastRequest(BroadcastRequest):
+    owner_id: Optional[int] = None
+
 def register_device(registration: DeviceRegistration, db: Session = Depends(get_db)):
     """
     Register a device from hardware. This is called by the device itself.
@@ -35,59 +61,155 @@ def register_device(registration: DeviceRegistration, db: Session = Depends(get_
     This endpoint is public (no authentication required).
     """
     try:
-        # Check if device already exists
-        existing_device = device_service.get_device(db, device_id=registration.device_id)
-        if existing_device:
-            # Update last seen and status to working
-            existing_device.last_seen = datetime.utcnow()
-            existing_device.status = models.DeviceStatus.WORKING if existing_device.owner_id else models.DeviceStatus.DEPLOYED
-            existing_device.firmware_version = registration.firmware_version
-            existing_device.hardware_version = registration.hardware_version
-            db.commit()
-            return {
-                "message": "Device updated", 
-                "device_id": registration.device_id, 
-                "status": existing_device.status.value
-            }
-        
-        # Check if activation key already exists
-        existing_key = db.query(models.Device).filter(models.Device.activation_key == registration.activation_key).first()
-        if existing_key:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, 
-                detail="Activation key already exists"
-            )
-        
-        # Create new device
-        new_device = models.Device(
-            id=registration.device_id,
+        # Insert, or refresh an existing registration, in one statement
+        inserted, device_status = device_service.register_device(
+            db,
+            device_id=registration.device_id,
             activation_key=registration.activation_key,
-            status=models.DeviceStatus.DEPLOYED,
             firmware_version=registration.firmware_version,
             hardware_version=registration.hardware_version,
-            last_seen=datetime.utcnow()
         )
-        
-        db.add(new_device)
         db.commit()
-        db.refresh(new_device)
+        heartbeat_buffer.forget_unknown(registration.device_id)
+        if not inserted:
+            manager.publish_threadsafe([(registration.device_id, status_event(device_status))])
+        return _registration_response(registration.device_id, inserted, device_status)
+        
+    except IntegrityError:
+        # A new device id with an activation key another device already has
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Activation key already exists"
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Database error registering device {registration.device_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error registering device {registration.device_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+async def register_device_async(registration: DeviceRegistration, db: AsyncSession = Depends(get_async_db)):
+    """
+    Register a device from hardware (async database mode).
+    Same behaviour as register_device, without occupying a threadpool worker.
+    """
+    try:
+        inserted, device_status = await device_service.register_device_async(
+            db,
+            device_id=registration.device_id,
+            activation_key=registration.activation_key,
+            firmware_version=registration.firmware_version,
+            hardware_version=registration.hardware_version,
+        )
+        await db.commit()
+        heartbeat_buffer.forget_unknown(registration.device_id)
+        if not inserted:
+            manager.publish_threadsafe([(registration.device_id, status_event(device_status))])
+        return _registration_response(registration.device_id, inserted, device_status)
         
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Activation key already exists"
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Database error registering device {registration.device_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error registering device {registration.device_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+def _registration_response(device_id: str, inserted: bool, device_status: str) -> dict:
+    if inserted:
         return {
             "message": "Device registered successfully", 
-            "device_id": registration.device_id, 
+            "device_id": device_id, 
             "status": "deployed"
         }
+    return {
+        "message": "Device updated", 
+        "device_id": device_id, 
+        "status": device_status
+    }
+
+router.post("/device/register")(register_device_async if ASYNC_DB else register_device)
+
+async def _iter_lines(request: Request):
+    """Yield the request body line by line as it arrives"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig")
+    if pending:
+        yield pending.decode("utf-8-sig")
+
+@router.post("/device/provision")
+async def provision_devices(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    x_provisioning_token: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Bulk-register a factory batch of devices from a CSV (with a header row) or
+    NDJSON body with device_id, activation_key and optionally firmware_version,
+    hardware_version and name. Existing devices are left untouched and listed
+    in the report. Requires the X-Provisioning-Token header.
+    """
+    if not check_provisioning_token(x_provisioning_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid provisioning token"
+        )
+    
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    parser = RecordParser(format)
+    provisioner = DeviceProvisioner(db)
+    line_no = 0
+    try:
+        async for line in _iter_lines(request):
+            line_no += 1
+            record, error = parser.feed(line)
+            provisioner.add(line_no, record, error)
+            if provisioner.full:
+                await run_in_threadpool(provisioner.flush)
+        report = await run_in_threadpool(provisioner.finish)
+        logger.info(
+            f"Provisioned {report.inserted} of {report.received} devices "
+            f"({report.conflicts} conflicts, {report.invalid} invalid)"
+        )
+        return report.as_dict()
         
-    except HTTPException:
-        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except SQLAlchemyError as e:
-        logger.error(f"Database error registering device {registration.device_id}: {str(e)}")
+        logger.error(f"Database error provisioning devices at line {line_no}: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Database error occurred"
+            detail=f"Database error occurred, batches before line {line_no} were committed"
         )
     except Exception as e:
-        logger.error(f"Unexpected error registering device {registration.device_id}: {str(e)}")
+        logger.error(f"Unexpected error provisioning devices: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred"
@@ -104,36 +226,29 @@ def activate_device(
     Requires authentication.
     """
     try:
-        # Find device by activation key
-        device = db.query(models.Device).filter(models.Device.activation_key == activation.activation_key).first()
+        # Claim the device only if it has no owner, in one statement
+        result = device_service.activate_device_by_key(db, activation.activation_key, current_user.id)
         
-        if not device:
+        if result is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="Invalid activation key"
             )
         
-        # Check if device is already activated
-        if device.owner_id:
+        if result.activated_id is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
                 detail="Device already activated"
             )
         
-        # Activate device
-        device.owner_id = current_user.id
-        device.status = models.DeviceStatus.WORKING
-        device.name = f"Device {device.id[:8]}"  # Default name
-        device.last_seen = datetime.utcnow()
-        
         db.commit()
-        db.refresh(device)
+        manager.publish_threadsafe([(result.activated_id, status_event(result.status, owner_id=current_user.id))])
         
         return {
             "message": "Device activated successfully",
-            "device_id": device.id,
-            "device_name": device.name,
-            "status": device.status.value
+            "device_id": result.activated_id,
+            "device_name": result.name,
+            "status": result.status
         }
         
     except HTTPException:
@@ -151,43 +266,45 @@ def activate_device(
             detail="An unexpected error occurred"
         )
 
-@router.get("/devices/", response_model=List[schemas.Device])
+def _device_page_etag(user_id: int, limit: int, rows) -> str:
+    # rows are the limit + 1 fetched rows, so the next page's existence counts too
+    return make_etag("devices", user_id, limit, [(row.id, row.version) for row in rows])
+
 def list_user_devices(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
     current_user: schemas.User = Depends(get_current_active_user), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
-    List all devices owned by the current user.
+    List devices owned by the current user, ordered by id.
+    Pass the X-Next-Cursor response header back as cursor to get the next page.
     Requires authentication.
     """
     try:
-        logger.info(f"Getting devices for user {current_user.id}")
-        devices = db.query(models.Device).filter(models.Device.owner_id == current_user.id).all()
-        logger.info(f"Found {len(devices)} devices")
-        
-        # Convert each device to dict and handle enum manually
-        result = []
-        for device in devices:
-            device_dict = {
-                "id": device.id,
-                "name": device.name,
-                "activation_key": device.activation_key,
-                "owner_id": device.owner_id,
-                "status": device.status.value if device.status else "DEPLOYED",  # Convert enum to string
-                "is_active": device.is_active or False,
-                "created_at": device.created_at,
-                "activated_at": device.activated_at,
-                "last_seen": device.last_seen,
-                "firmware_version": device.firmware_version,
-                "hardware_version": device.hardware_version,
-                "ip_address": device.ip_address,
-                "signal_strength": device.signal_strength,
-                "battery_level": device.battery_level
-            }
-            result.append(device_dict)
+        limit = page_size(limit)
+        after_id = decode_cursor("devices", cursor, str)
+
+        # Answer an unchanged poll from the index without loading the rows
+        versions = device_service.get_user_device_versions_page(db, user_id=current_user.id, limit=limit, after_id=after_id)
+        etag = _device_page_etag(current_user.id, limit, versions)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        devices = device_service.get_user_devices_page(db, user_id=current_user.id, limit=limit, after_id=after_id)
+        etag = _device_page_etag(current_user.id, limit, devices)
+        devices, next_cursor = paginate(devices, limit, "devices", key=lambda device: device.id)
         
-        return result
+        response = device_serializer.response_many(devices)
+        set_next_cursor(request, response, next_cursor)
+        return set_etag(response, etag)
         
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error listing devices for user {current_user.id}: {str(e)}")
         raise HTTPException(
@@ -197,22 +314,80 @@ def list_user_devices(
     except Exception as e:
         logger.error(f"Unexpected error listing devices for user {current_user.id}: {str(e)}")
         logger.error(f"Error type: {type(e)}")
-        import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+async def list_user_devices_async(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: schemas.User = Depends(get_current_active_user), 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    List devices owned by the current user, ordered by id (async database mode).
+    Pass the X-Next-Cursor response header back as cursor to get the next page.
+    Requires authentication.
+    """
+    try:
+        limit = page_size(limit)
+        after_id = decode_cursor("devices", cursor, str)
+
+        versions = await device_service.get_user_device_versions_page_async(
+            db, user_id=current_user.id, limit=limit, after_id=after_id
+        )
+        etag = _device_page_etag(current_user.id, limit, versions)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        devices = await device_service.get_user_devices_page_async(
+            db, user_id=current_user.id, limit=limit, after_id=after_id
+        )
+        etag = _device_page_etag(current_user.id, limit, devices)
+        devices, next_cursor = paginate(devices, limit, "devices", key=lambda device: device.id)
+        response = device_serializer.response_many(devices)
+        set_next_cursor(request, response, next_cursor)
+        return set_etag(response, etag)
+        
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Database error listing devices for user {current_user.id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error listing devices for user {current_user.id}: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+router.get("/devices/", response_model=List[schemas.Device])(
+    list_user_devices_async if ASYNC_DB else list_user_devices
+)
+
 @router.get("/devices/{device_id}", response_model=schemas.Device)
 def read_device(
     device_id: str, 
+    request: Request,
     current_user: schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get device details by ID (requires authentication)"""
+    """
+    Get device details by ID (requires authentication).
+    Honors If-None-Match with a 304 when the device has not changed.
+    """
     try:
-        db_device = device_service.get_device(db, device_id=device_id)
+        db_device = device_service.get_owned_device(db, device_id=device_id, user_id=current_user.id)
         if db_device is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
@@ -225,8 +400,12 @@ def read_device(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You don't have access to this device"
             )
+
+        etag = make_etag("device", device_id, db_device.version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
             
-        return db_device
+        return set_etag(device_serializer.response(db_device), etag)
         
     except HTTPException:
         raise
@@ -243,20 +422,116 @@ def read_device(
             detail="An unexpected error occurred"
         )
 
+def _naive_utc(value: datetime) -> datetime:
+    # Telemetry timestamps are naive UTC; convert offset-aware query params
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@router.get("/devices/{device_id}/telemetry")
+def read_device_telemetry(
+    device_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    metric: str = Query("battery_level", pattern="^(battery_level|signal_strength)$"),
+    max_points: int = Query(500, ge=10, le=5000),
+    method: str = Query("lttb", pattern="^(lttb|minmax)$"),
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get a downsampled telemetry series for a device (requires authentication).
+    The raw, 1m, 1h or 1d resolution is chosen from the time range so that at
+    most max_points points are returned, using LTTB or min/max-per-bucket.
+    Defaults to the last 24 hours.
+    """
+    try:
+        device = device_service.get_owned_device(db, device_id=device_id, user_id=current_user.id)
+        if device is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, 
+                detail="Device not found"
+            )
+        if device.owner_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have access to this device"
+            )
+        
+        now = datetime.utcnow()
+        end = (_naive_utc(end) if end else now)
+        start = (_naive_utc(start) if start else end - timedelta(days=1))
+        if start >= end:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="start must be before end"
+            )
+        
+        resolution = telemetry_service.choose_resolution(start, end, max_points, now=now)
+        rows = telemetry_service.query_series(db, device_id, metric, resolution, start, end)
+        series = [
+            ((t - datetime(1970, 1, 1)).total_seconds(), float(avg), float(low), float(high))
+            for t, avg, low, high in rows
+        ]
+        points = lttb(series, max_points) if method == "lttb" else min_max_buckets(series, max_points)
+        
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        logger.error(f"Database error reading telemetry for device {device_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+    
+    body = {
+        "device_id": device_id,
+        "metric": metric,
+        "resolution": resolution,
+        "method": method,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "source_points": len(series),
+        "points": [
+            {
+                "t": datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None).isoformat(),
+                "avg": round(avg, 2),
+                "min": low,
+                "max": high,
+            }
+            for t, avg, low, high in points
+        ],
+    }
+    
+    # Ranges that ended before the current bucket will not change any more
+    step = 60 if resolution in ("raw", "1m") else telemetry_service.ROLLUP_TABLES[resolution].bucket_seconds
+    settled = end <= now - timedelta(seconds=step)
+    headers = {
+        "Cache-Control": f"private, max-age={86400 if settled else min(step, 300)}",
+        "Vary": "Authorization",
+    }
+    return FastJSONResponse(body, headers=headers)
+
 @router.post("/devices/{device_id}/trigger")
 def trigger_device_action(
     device_id: str, 
     action: dict, 
+    response: Response,
+    wait_ms: int = Query(0, ge=0, le=COMMAND_MAX_WAIT_MS),
     current_user: schemas.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """
     Trigger an action on a device (alarm, speak, led)
     Requires authentication and device ownership.
+    The command is published over MQTT with a command_id the device acks.
+    With wait_ms the request waits up to that long for the ack; without it,
+    or if the ack is late, 202 is returned and the result can be polled at
+    GET /devices/{device_id}/commands/{command_id} or received on /ws.
     """
     try:
-        device = device_service.get_device(db, device_id=device_id)
-        if not device:
+        device = device_service.get_owned_device(db, device_id=device_id, user_id=current_user.id)
+        if device is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="Device not found"
@@ -269,17 +544,38 @@ def trigger_device_action(
                 detail="You don't have access to this device"
             )
         
-        # TODO: Add MQTT publishing logic here
-        # mqtt_client.publish(f"peluprice/devices/{device_id}/commands", json.dumps(action))
+        command_type = action.get("type")
+        if not isinstance(command_type, str) or not command_type:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Action type is required"
+            )
+        
+        command = command_dispatcher.dispatch(device_id, current_user.id, command_type, action.get("payload"))
+        if command.status == "undeliverable":
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Command could not be sent to the device"
+            )
+        command_dispatcher.wait(command, wait_ms / 1000)
+        if command.status == "pending":
+            response.status_code = status.HTTP_202_ACCEPTED
         
         return {
-            "message": f"Action {action.get('type', 'unknown')} triggered for device {device_id}",
+            "message": f"Action {command_type} triggered for device {device_id}",
             "device_id": device_id,
-            "action": action
+            "action": action,
+            **command.as_dict(),
         }
         
     except HTTPException:
         raise
+    except DispatcherBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"},
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error triggering action on device {device_id}: {str(e)}")
         raise HTTPException(
@@ -293,28 +589,158 @@ def trigger_device_action(
             detail="An unexpected error occurred"
         )
 
+@router.get("/devices/{device_id}/commands/{command_id}")
+def read_device_command(
+    device_id: str,
+    command_id: str,
+    current_user: schemas.User = Depends(get_current_active_user),
+):
+    """Get the status of a command sent with the trigger endpoint (requires authentication)"""
+    command = command_dispatcher.get(command_id)
+    if command is None or command.device_id != device_id or command.owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Command not found"
+        )
+    return command.as_dict()
+
+def _submit_broadcast(db: Session, broadcast: BroadcastRequest, owner_id: Optional[int]) -> dict:
+    try:
+        job = broadcast_service.submit(
+            db,
+            broadcast.type,
+            broadcast.payload,
+            owner_id=owner_id,
+            firmware_version=broadcast.firmware_version,
+            statuses=broadcast.statuses,
+            device_ids=broadcast.device_ids,
+            rate=broadcast.rate,
+        )
+        return job.as_dict()
+    except BroadcastBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "30"},
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Database error selecting broadcast targets: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error occurred"
+        )
+
+def _get_broadcast(broadcast_id: str, owner_id: Optional[int] = None):
+    """A broadcast by id; with owner_id only that owner's broadcasts are visible"""
+    job = broadcast_service.get(broadcast_id)
+    if job is None or (owner_id is not None and job.owner_id != owner_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Broadcast not found"
+        )
+    return job
+
+def _check_fleet_token(token: Optional[str]):
+    if not check_provisioning_token(token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid provisioning token"
+        )
+
+@router.post("/devices/broadcast", status_code=status.HTTP_202_ACCEPTED)
+def broadcast_to_my_devices(
+    broadcast: BroadcastRequest,
+    current_user: schemas.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Send a command to every device of the current user matching the filters
+    (firmware version, statuses, device ids). The command is published in
+    paced batches; poll GET /devices/broadcasts/{broadcast_id} for progress
+    and per-device delivery counts.
+    """
+    return _submit_broadcast(db, broadcast, current_user.id)
+
+@router.get("/devices/broadcasts/{broadcast_id}")
+def read_my_broadcast(
+    broadcast_id: str,
+    devices: bool = Query(False, description="Include the delivery state of every device until the broadcast finishes"),
+    current_user: schemas.User = Depends(get_current_active_user),
+):
+    """Get the progress of a broadcast (requires authentication)"""
+    return _get_broadcast(broadcast_id, current_user.id).as_dict(include_devices=devices)
+
+@router.delete("/devices/broadcasts/{broadcast_id}")
+def cancel_my_broadcast(
+    broadcast_id: str,
+    current_user: schemas.User = Depends(get_current_active_user),
+):
+    """Stop publishing a broadcast; devices already sent to keep their state"""
+    job = _get_broadcast(broadcast_id, current_user.id)
+    broadcast_service.cancel(job)
+    return job.as_dict()
+
+@router.post("/device/broadcast", status_code=status.HTTP_202_ACCEPTED)
+def broadcast_to_fleet(
+    broadcast: FleetBroadcastRequest,
+    x_provisioning_token: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Send a command to every device in the fleet matching the filters
+    (owner, firmware version, statuses, device ids). Requires the
+    X-Provisioning-Token header.
+    """
+    _check_fleet_token(x_provisioning_token)
+    return _submit_broadcast(db, broadcast, broadcast.owner_id)
+
+@router.get("/device/broadcasts/{broadcast_id}")
+def read_fleet_broadcast(
+    broadcast_id: str,
+    devices: bool = Query(False, description="Include the delivery state of every device until the broadcast finishes"),
+    x_provisioning_token: Optional[str] = Header(None),
+):
+    """Get the progress of any broadcast. Requires the X-Provisioning-Token header."""
+    _check_fleet_token(x_provisioning_token)
+    return _get_broadcast(broadcast_id).as_dict(include_devices=devices)
+
+@router.delete("/device/broadcasts/{broadcast_id}")
+def cancel_fleet_broadcast(
+    broadcast_id: str,
+    x_provisioning_token: Optional[str] = Header(None),
+):
+    """Stop publishing any broadcast. Requires the X-Provisioning-Token header."""
+    _check_fleet_token(x_provisioning_token)
+    job = _get_broadcast(broadcast_id)
+    broadcast_service.cancel(job)
+    return job.as_dict()
+
 @router.put("/devices/{device_id}/heartbeat")
-def device_heartbeat(device_id: str, data: dict, db: Session = Depends(get_db)):
+async def device_heartbeat(device_id: str, data: dict):
     """
-    Update device heartbeat and status information
+    Update device heartbeat and status information.
+    The heartbeat is buffered and written to the database in bulk shortly after,
+    so this returns without waiting for the database. Heartbeats for unknown
+    device ids are dropped when written; repeats are answered with 404.
     """
-    device = device_service.get_device(db, device_id=device_id)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Update device status
-    device.last_seen = datetime.utcnow()
-    device.status = models.DeviceStatus.WORKING
-    device.is_active = True
-    
-    # Update optional fields
-    if 'ip_address' in data:
-        device.ip_address = data['ip_address']
-    if 'signal_strength' in data:
-        device.signal_strength = data['signal_strength']
-    if 'battery_level' in data:
-        device.battery_level = data['battery_level']
-    
-    db.commit()
+    seen_at = datetime.utcnow()
+    try:
+        accepted = heartbeat_buffer.add(device_id, data, seen_at=seen_at)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except UnknownDeviceError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Device not found"
+        )
+    if not accepted:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Heartbeat buffer full, please retry later",
+            headers={"Retry-After": "5"},
+        )
     
-    return {"message": "Heartbeat updated", "last_seen": device.last_seen}
+    return {"message": "Heartbeat accepted", "last_seen": seen_at}
@@ -1,12 +1,15 @@
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from app import models, schemas
-from app.services.get_db import get_db
+from app.services.get_db import get_db, get_read_db
 from app.services import user_service
+from app.services.pagination import InvalidCursorError, decode_cursor, page_size, paginate, set_next_cursor
+from app.services.serialization import user_serializer
+from app.services.password_hasher import HasherBusyError
 from app.auth.auth import get_current_active_user
-from typing import List
+from typing import List, Optional
 import logging
 
 # Set up logging
@@ -52,6 +55,12 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         
     except HTTPException:
         raise
+    except HasherBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error creating user: {str(e)}")
         raise HTTPException(
@@ -67,15 +76,29 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 @router.get("/users/", response_model=List[schemas.User])
 def list_users(
-    skip: int = 0, 
-    limit: int = 100, 
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
     current_user: schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get list of users (protected endpoint - requires authentication)"""
+    """
+    Get list of users ordered by id (protected endpoint - requires authentication).
+    
+    Pass the X-Next-Cursor response header back as cursor to get the next page.
+    """
     try:
-        users = db.query(models.User).offset(skip).limit(limit).all()
-        return users
+        limit = page_size(limit)
+        users = user_service.get_users_page(db, limit=limit, after_id=decode_cursor("users", cursor, int))
+        users, next_cursor = paginate(users, limit, "users", key=lambda user: user.id)
+        response = user_serializer.response_many(users)
+        set_next_cursor(request, response, next_cursor)
+        return response
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except SQLAlchemyError as e:
         logger.error(f"Database error listing users: {str(e)}")
         raise HTTPException(
@@ -93,7 +116,7 @@ def list_users(
 def read_user(
     user_id: int, 
     current_user: schemas.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get user by ID (protected endpoint - requires authentication)"""
     try:
@@ -109,7 +132,7 @@ def read_user(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="User not found"
             )
-        return db_user
+        return user_serializer.response(db_user)
         
     except HTTPException:
         raise
@@ -1,59 +1,145 @@
 
 import os
+import uuid
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from app import schemas
-from app.services.get_db import get_db
-from app.services.user_service import get_user_by_email
+from app.auth.principal_cache import cache_principal, get_cached_principal
+from app.auth.revocation import revocation_list
+from app.database import ASYNC_DB, SessionLocal
+from app.services.get_db import get_read_db, get_async_db
+from app.services.user_service import get_user_by_email, get_user_by_email_async
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Get configuration from environment variables
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-jwt-secret-key-change-this-in-production")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "30"))
+# stateful: load the user for every request (through the principal cache)
+# claims: build the user from the token claims without touching the database
+AUTH_MODE = os.getenv("AUTH_MODE", "stateful").lower()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"api/{os.getenv('API_VERSION', 'v1')}/auth/token")
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     """Create a JWT access token"""
     to_encode = data.copy()
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
+    # Token id, used to revoke this token on logout
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str, credentials_exception):
-    """Verify and decode JWT token"""
+def user_token_claims(user) -> dict:
+    """Claims identifying a user, enough to rebuild the principal in claims mode"""
+    return {
+        "sub": user.email,
+        "uid": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "phone_number": user.phone_number,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+    }
+
+def decode_token(token: str, credentials_exception) -> dict:
+    """Decode a JWT token and reject it if it has been revoked"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
-        return token_data
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    jti = payload.get("jti")
+    if jti is not None and revocation_list.is_revoked(jti):
+        raise credentials_exception
+    return payload
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get current authenticated user from JWT token"""
-    credentials_exception = HTTPException(
+def verify_token(token: str, credentials_exception):
+    """Verify and decode JWT token"""
+    payload = decode_token(token, credentials_exception)
+    exp = payload.get("exp")
+    expires_at = datetime.utcfromtimestamp(exp) if exp is not None else None
+    token_data = schemas.TokenData(email=payload["sub"], expires_at=expires_at, jti=payload.get("jti"))
+    return token_data
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    """Get current authenticated user from JWT token, served from the principal cache when possible"""
+    credentials_exception = _credentials_exception()
     
     token_data = verify_token(token, credentials_exception)
+    principal = get_cached_principal(token_data.email)
+    if principal is not None:
+        return principal
+    
     user = get_user_by_email(db, email=token_data.email)
+    if user is None and "replica" in db.info:
+        # Registered moments ago and not replicated yet
+        with SessionLocal() as primary:
+            user = get_user_by_email(primary, email=token_data.email)
+    if user is None:
+        raise credentials_exception
+    return cache_principal(token_data.email, user, token_data.expires_at)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """Get current authenticated user from JWT token (async database mode)"""
+    credentials_exception = _credentials_exception()
+    
+    token_data = verify_token(token, credentials_exception)
+    principal = get_cached_principal(token_data.email)
+    if principal is not None:
+        return principal
+    
+    user = await get_user_by_email_async(db, email=token_data.email)
     if user is None:
         raise credentials_exception
-    return user
+    return cache_principal(token_data.email, user, token_data.expires_at)
+
+def get_current_user_from_claims(token: str = Depends(oauth2_scheme)):
+    """
+    Get current authenticated user from the token claims alone (claims auth mode).
+    Profile changes show up once the user logs in again and gets a new token.
+    """
+    credentials_exception = _credentials_exception()
+
+    payload = decode_token(token, credentials_exception)
+    if payload.get("uid") is None:
+        # Issued before claims were added to tokens
+        raise credentials_exception
+    try:
+        return schemas.User(
+            id=payload["uid"],
+            email=payload["sub"],
+            first_name=payload.get("first_name") or "",
+            last_name=payload.get("last_name") or "",
+            phone_number=payload.get("phone_number") or "",
+            created_at=payload.get("created_at"),
+        )
+    except ValueError:
+        raise credentials_exception
+
+if AUTH_MODE == "claims":
+    _current_user_dependency = get_current_user_from_claims
+elif ASYNC_DB:
+    _current_user_dependency = get_current_user_async
+else:
+    _current_user_dependency = get_current_user
 
-def get_current_active_user(current_user = Depends(get_current_user)):
+def get_current_active_user(current_user = Depends(_current_user_dependency)):
     """Get current active user (can add additional checks here)"""
     # Add any additional user validation here
     return current_user
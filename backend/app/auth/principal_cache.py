@@ -0,0 +1,30 @@
+import os
+from datetime import datetime
+from typing import Optional
+from app import schemas
+from app.services.cache import LRUTTLCache
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))  # seconds
+
+# Authenticated users keyed by token subject (email). Entries never outlive the
+# token they were loaded for and are invalidated by user_service.update_user;
+# other workers may serve a changed profile for up to PRINCIPAL_CACHE_TTL.
+principal_cache = LRUTTLCache(max_size=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+def get_cached_principal(subject: str) -> Optional[schemas.User]:
+    """Return the cached user for a token subject, if any"""
+    return principal_cache.get(subject)
+
+def cache_principal(subject: str, user, expires_at: Optional[datetime]) -> schemas.User:
+    """Cache a user loaded for a token, capped at the token expiry"""
+    principal = schemas.User.model_validate(user)
+    ttl = None
+    if expires_at is not None:
+        ttl = (expires_at - datetime.utcnow()).total_seconds()
+    principal_cache.set(subject, principal, ttl=ttl)
+    return principal
+
+def invalidate_principal(subject: str):
+    """Drop a cached user, e.g. after the profile changed"""
+    principal_cache.invalidate(subject)
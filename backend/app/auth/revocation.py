@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models.revoked_token import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", "5.0"))  # seconds
+# Re-read rows revoked this long before the newest one seen, so inserts that
+# committed late are not skipped by the cursor
+REVOCATION_REFRESH_LOOKBACK = float(os.getenv("REVOCATION_REFRESH_LOOKBACK", "30"))  # seconds
+REVOCATION_PURGE_INTERVAL = float(os.getenv("REVOCATION_PURGE_INTERVAL", "3600"))  # seconds
+
+class RevocationList:
+    """
+    In-memory set of revoked token ids (jti), mirrored from the revoked_tokens
+    table. A background thread reads only the rows revoked since its last
+    refresh, so checking a token never touches the database. Entries are
+    dropped once the token has expired, which keeps the set as small as the
+    number of logouts within one token lifetime.
+
+    A logout is visible immediately in the worker that handled it and within
+    REVOCATION_REFRESH_INTERVAL in every other worker.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        refresh_interval: float = REVOCATION_REFRESH_INTERVAL,
+        lookback: float = REVOCATION_REFRESH_LOOKBACK,
+        purge_interval: float = REVOCATION_PURGE_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.lookback = timedelta(seconds=lookback)
+        self.purge_interval = purge_interval
+
+        self._revoked: Dict[str, datetime] = {}
+        self._cursor: Optional[datetime] = None  # newest revoked_at seen
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.checks = 0
+        self.rejected = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.loaded = 0
+        self.pruned = 0
+        self.purged = 0
+        self.last_refresh: Optional[datetime] = None
+
+    def is_revoked(self, jti: str) -> bool:
+        """Check a token id against the in-memory set"""
+        self.checks += 1
+        with self._lock:
+            revoked = jti in self._revoked
+        if revoked:
+            self.rejected += 1
+        return revoked
+
+    def revoke(self, db: Session, jti: str, expires_at: datetime, user_id: Optional[int] = None):
+        """Persist a revocation and apply it to this worker immediately"""
+        stmt = pg_insert(RevokedToken).values(jti=jti, user_id=user_id, expires_at=expires_at)
+        db.execute(stmt.on_conflict_do_nothing(index_elements=["jti"]))
+        db.commit()
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def refresh(self):
+        """Load revocations added since the previous refresh and prune expired ones"""
+        now = datetime.utcnow()
+        query = select(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at).where(
+            RevokedToken.expires_at > now
+        )
+        if self._cursor is not None:
+            query = query.where(RevokedToken.revoked_at >= self._cursor - self.lookback)
+
+        db = self.session_factory()
+        try:
+            rows = db.execute(query).all()
+            if time.monotonic() - self._last_purge >= self.purge_interval:
+                self._purge(db, now)
+        finally:
+            db.close()
+
+        with self._lock:
+            for jti, expires_at, revoked_at in rows:
+                if jti not in self._revoked:
+                    self._revoked[jti] = expires_at
+                    self.loaded += 1
+                if self._cursor is None or revoked_at > self._cursor:
+                    self._cursor = revoked_at
+            expired = [jti for jti, expires_at in self._revoked.items() if expires_at <= now]
+            for jti in expired:
+                del self._revoked[jti]
+            self.pruned += len(expired)
+            if self._cursor is None:
+                # Empty table: start from now so the next refresh stays incremental
+                self._cursor = now
+
+        self.refreshes += 1
+        self.last_refresh = now
+
+    def _purge(self, db: Session, now: datetime):
+        """Delete rows for tokens that have expired anyway"""
+        try:
+            result = db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            db.commit()
+            self.purged += result.rowcount or 0
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to purge expired token revocations: {e}")
+        self._last_purge = time.monotonic()
+
+    def start(self):
+        """Load current revocations, then keep refreshing in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.error(f"Initial token revocation load failed: {e}")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="revocation-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self.refresh_interval * 2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Token revocation refresh failed: {e}")
+
+    def stats(self) -> dict:
+        """Return revocation set size and check counters"""
+        with self._lock:
+            size = len(self._revoked)
+        return {
+            "revoked": size,
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "loaded": self.loaded,
+            "pruned": self.pruned,
+            "purged": self.purged,
+            "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None,
+        }
+
+# Global revocation list instance
+revocation_list = RevocationList()
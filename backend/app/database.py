@@ -3,11 +3,76 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from app.services.db_pool import async_pool_monitor, instrumented_pool_class, sync_pool_monitor
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://peluprice:peluprice123@db:5432/peluprice")
 
+# "sync" (psycopg2, threadpool routes) or "async" (asyncpg, async hot routes)
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync").lower()
+ASYNC_DB = DATABASE_MODE == "async"
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1),
+)
+
+# Pool sizing, per engine and per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+# Behind PgBouncer in transaction mode: no pre-ping round trip and no
+# server-side prepared statements, which do not survive connection reuse
+DB_PGBOUNCER_MODE = os.getenv("DB_PGBOUNCER_MODE", "false").lower() == "true"
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": not DB_PGBOUNCER_MODE,
+}
+
 # Create engine with lazy connection - don't connect until first use
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args={"connect_timeout": 10})
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=instrumented_pool_class(QueuePool, sync_pool_monitor),
+    connect_args={"connect_timeout": 10},
+    **POOL_OPTIONS,
+)
+sync_pool_monitor.bind(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Optional read replicas (comma separated) for read-only routes, see replica_router
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+replica_engines = [
+    create_engine(url, connect_args={"connect_timeout": 5}, **POOL_OPTIONS)
+    for url in DATABASE_REPLICA_URLS
+]
+
+# The sync engine is always available for background workers and the
+# routes that have not been ported; the async engine only exists in async mode
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB:
+    from uuid import uuid4
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    async_connect_args = {"timeout": 10}
+    if DB_PGBOUNCER_MODE:
+        async_connect_args.update({
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        })
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=instrumented_pool_class(AsyncAdaptedQueuePool, async_pool_monitor),
+        connect_args=async_connect_args,
+        **POOL_OPTIONS,
+    )
+    async_pool_monitor.bind(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
@@ -1,3 +1,5 @@
 from ..database import Base
 from .user import User
-from .device import Device, DeviceStatus
\ No newline at end of file
+from .device import Device, DeviceStatus
+from .telemetry import DeviceTelemetry, DeviceTelemetry1m, DeviceTelemetry1h, DeviceTelemetry1d
+from .revoked_token import RevokedToken
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum as SQLAlchemyEnum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum as SQLAlchemyEnum, Boolean, Index, text
 from sqlalchemy.orm import relationship
 from ..database import Base
 from datetime import datetime
@@ -33,6 +33,17 @@ class Device(Base):
     ip_address = Column(String, nullable=True)
     signal_strength = Column(Integer, nullable=True)
     battery_level = Column(Integer, nullable=True)
+
+    # Bumped by every write, so (id, version) identifies a device's state for ETags
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     
     # Relationships
     owner = relationship("User", back_populates="devices")
+
+    __table_args__ = (
+        # Owner listing, paged by id. version is included so a page's ETag
+        # can be computed with an index-only scan.
+        Index("ix_devices_owner_id_id_version", "owner_id", "id", postgresql_include=["version"]),
+        # Liveness tracker rebuild and offline sweeps only look at active devices
+        Index("ix_devices_active_last_seen", "last_seen", postgresql_where=text("is_active")),
+    )
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, text
+from ..database import Base
+
+class RevokedToken(Base):
+    """Revoked access tokens by jti, kept until the token would have expired anyway"""
+    __tablename__ = "revoked_tokens"
+
+    id = Column(BigInteger, primary_key=True)
+    jti = Column(String, unique=True, nullable=False)
+    user_id = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    # Database clock, used as the incremental refresh cursor
+    revoked_at = Column(DateTime, nullable=False, index=True, server_default=text("(now() at time zone 'utc')"))
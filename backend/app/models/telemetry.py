@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, text
+from ..database import Base
+
+class DeviceTelemetry(Base):
+    """Raw heartbeat samples, append-only, range partitioned by day on recorded_at"""
+    __tablename__ = "device_telemetry"
+
+    device_id = Column(String, primary_key=True)
+    recorded_at = Column(DateTime, primary_key=True)
+    signal_strength = Column(Integer, nullable=True)
+    battery_level = Column(Integer, nullable=True)
+    ip_address = Column(String, nullable=True)
+
+    __table_args__ = {"postgresql_partition_by": "RANGE (recorded_at)"}
+
+class TelemetryRollupMixin:
+    """Per-device aggregates for one time bucket, updated incrementally"""
+    device_id = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    samples = Column(Integer, nullable=False, server_default=text("0"))
+
+    battery_count = Column(Integer, nullable=False, server_default=text("0"))
+    battery_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    battery_min = Column(Integer, nullable=True)
+    battery_max = Column(Integer, nullable=True)
+
+    signal_count = Column(Integer, nullable=False, server_default=text("0"))
+    signal_sum = Column(BigInteger, nullable=False, server_default=text("0"))
+    signal_min = Column(Integer, nullable=True)
+    signal_max = Column(Integer, nullable=True)
+
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket_start)"}
+
+class DeviceTelemetry1m(TelemetryRollupMixin, Base):
+    """1-minute rollups, partitioned by day"""
+    __tablename__ = "device_telemetry_1m"
+
+class DeviceTelemetry1h(TelemetryRollupMixin, Base):
+    """1-hour rollups, partitioned by month"""
+    __tablename__ = "device_telemetry_1h"
+
+class DeviceTelemetry1d(TelemetryRollupMixin, Base):
+    """1-day rollups, partitioned by year"""
+    __tablename__ = "device_telemetry_1d"
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr
+from datetime import datetime
 from typing import Optional
 from .user import User
 
@@ -14,3 +15,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    jti: Optional[str] = None
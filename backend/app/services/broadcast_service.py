@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from app.services import device_service
+from app.services.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Default and maximum publish rate of a broadcast, in messages per second
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "200"))
+BROADCAST_MAX_RATE = float(os.getenv("BROADCAST_MAX_RATE", "1000"))
+# Messages published back to back before pacing kicks in
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "50"))
+BROADCAST_QOS = int(os.getenv("BROADCAST_QOS", "1"))
+# How long after the last publish acks are still counted
+BROADCAST_ACK_TIMEOUT = float(os.getenv("BROADCAST_ACK_TIMEOUT", "30"))  # seconds
+# Broadcasts waiting to be published before new ones are rejected with 503
+BROADCAST_MAX_QUEUED = int(os.getenv("BROADCAST_MAX_QUEUED", "16"))
+# How long finished broadcasts can still be polled
+BROADCAST_JOB_TTL = float(os.getenv("BROADCAST_JOB_TTL", "3600"))  # seconds
+# Broadcasts kept in memory; the oldest finished ones are forgotten first
+BROADCAST_MAX_JOBS = int(os.getenv("BROADCAST_MAX_JOBS", "256"))
+# on: fleet-wide and per-firmware broadcasts are published once on a group
+# topic; only enable once the fleet runs firmware that subscribes to them
+BROADCAST_GROUP_TOPICS = os.getenv("BROADCAST_GROUP_TOPICS", "off").lower() == "on"
+
+GROUP_TOPIC_ALL = "peluprice/broadcast/all/commands"
+GROUP_TOPIC_FIRMWARE = "peluprice/broadcast/firmware/{version}/commands"
+
+# Broadcast command ids carry this prefix so acks can be routed without a lookup
+COMMAND_ID_PREFIX = "bc-"
+
+# Per-device delivery states
+DEVICE_STATES = ("queued", "published", "undeliverable", "acked", "failed", "timeout")
+
+class BroadcastBusyError(Exception):
+    """Raised when too many broadcasts are waiting to be published or tracked"""
+
+class BroadcastJob:
+    """One command sent to a set of devices and its per-device delivery state"""
+
+    def __init__(self, device_ids: List[str], command_type: str, payload, target: dict,
+                 owner_id: Optional[int], rate: float, group_topic: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.command_id = COMMAND_ID_PREFIX + self.id
+        self.type = command_type
+        self.payload = payload
+        self.target = target
+        # None for fleet-wide broadcasts
+        self.owner_id = owner_id
+        self.rate = rate
+        self.group_topic = group_topic
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.last_publish: Optional[float] = None
+        self.finished_mono: Optional[float] = None
+        # queued -> publishing -> waiting_acks -> completed, or cancelled
+        self.status = "queued"
+        # Per-device state, dropped once the broadcast finishes; counts stay
+        self.devices: Optional[Dict[str, str]] = dict.fromkeys(device_ids, "queued")
+        self.total = len(self.devices)
+        self.counts: Dict[str, int] = dict.fromkeys(DEVICE_STATES, 0)
+        self.counts["queued"] = self.total
+        self.messages_published = 0
+        self.cancelled = threading.Event()
+
+    def set_state(self, device_id: str, state: str):
+        previous = self.devices.get(device_id)
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.devices[device_id] = state
+        self.counts[state] += 1
+
+    def as_dict(self, include_devices: bool = False) -> dict:
+        result = {
+            "broadcast_id": self.id,
+            "command_id": self.command_id,
+            "type": self.type,
+            "target": self.target,
+            "mode": "group" if self.group_topic else "per_device",
+            "rate": self.rate,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "total": self.total,
+            "messages_published": self.messages_published,
+            "devices_by_state": dict(self.counts),
+        }
+        if include_devices and self.devices is not None:
+            result["devices"] = dict(self.devices)
+        return result
+
+class BroadcastService:
+    """
+    Sends one command to many devices without flooding the broker.
+
+    The command is serialized once and published in batches of batch_size,
+    paced by a token bucket to the job's rate. Broadcasts run one at a time
+    on a worker thread in submission order; acks are matched by the shared
+    command_id and tracked per device until ack_timeout after the last
+    publish; after that only the per-state counts are kept. With group
+    topics enabled, fleet-wide and per-firmware broadcasts are a single
+    publish on a topic those devices subscribe to. At most max_jobs
+    broadcasts live in memory of the process that accepted them.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+        qos: int = BROADCAST_QOS,
+        ack_timeout: float = BROADCAST_ACK_TIMEOUT,
+        max_queued: int = BROADCAST_MAX_QUEUED,
+        job_ttl: float = BROADCAST_JOB_TTL,
+        max_jobs: int = BROADCAST_MAX_JOBS,
+        group_topics: bool = BROADCAST_GROUP_TOPICS,
+        publish: Optional[Callable[[str, bytes, int], bool]] = None,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.qos = qos
+        self.ack_timeout = ack_timeout
+        self.job_ttl = job_ttl
+        self.max_jobs = max(1, max_jobs)
+        self.group_topics = group_topics
+        self._publish = publish
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._jobs: Dict[str, BroadcastJob] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.messages_published = 0
+        self.publish_errors = 0
+        self.acks = 0
+        self.late_acks = 0
+        self.unknown_acks = 0
+        self.evicted = 0
+
+    def _publisher(self) -> Callable[[str, bytes, int], bool]:
+        if self._publish is None:
+            from app.services.mqtt_service import mqtt_service
+
+            self._publish = mqtt_service.publish_raw
+        return self._publish
+
+    def group_topic_for(self, owner_id: Optional[int], firmware_version: Optional[str],
+                        statuses, device_ids) -> Optional[str]:
+        """Group topic reaching exactly the targeted devices, if there is one"""
+        if not self.group_topics or owner_id is not None or statuses or device_ids is not None:
+            return None
+        if firmware_version is not None:
+            return GROUP_TOPIC_FIRMWARE.format(version=firmware_version)
+        return GROUP_TOPIC_ALL
+
+    def submit(self, db, command_type: str, payload=None, owner_id: Optional[int] = None,
+               firmware_version: Optional[str] = None, statuses=None, device_ids=None,
+               rate: Optional[float] = None) -> BroadcastJob:
+        """
+        Resolve the target devices and queue a broadcast. owner_id=None
+        targets the whole fleet; the other filters narrow it down.
+        """
+        targets = device_service.get_target_device_ids(
+            db, owner_id=owner_id, firmware_version=firmware_version, statuses=statuses, device_ids=device_ids
+        )
+        target = {
+            "owner_id": owner_id,
+            "firmware_version": firmware_version,
+            "statuses": [getattr(value, "value", value) for value in statuses] if statuses else None,
+            "device_ids": len(device_ids) if device_ids is not None else None,
+        }
+        job = BroadcastJob(
+            targets, command_type, payload, target, owner_id,
+            rate=min(rate or BROADCAST_RATE, BROADCAST_MAX_RATE),
+            group_topic=self.group_topic_for(owner_id, firmware_version, statuses, device_ids),
+        )
+        # Tracked before it is queued, so the worker and acks always find it
+        with self._lock:
+            if len(self._jobs) >= self.max_jobs and not self._evict():
+                self.rejected += 1
+                raise BroadcastBusyError("Too many broadcasts are in progress")
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self.rejected += 1
+            raise BroadcastBusyError("Too many broadcasts are waiting to be sent")
+        self.submitted += 1
+        logger.info(f"Broadcast {job.id} of {command_type} queued for {len(targets)} devices")
+        return job
+
+    def _evict(self) -> bool:
+        # Called with the lock held: forget the oldest finished broadcast
+        finished = [job for job in self._jobs.values() if job.finished_mono is not None]
+        if not finished:
+            return False
+        oldest = min(finished, key=lambda job: job.finished_mono)
+        del self._jobs[oldest.id]
+        self.evicted += 1
+        return True
+
+    def get(self, job_id: str) -> Optional[BroadcastJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job: BroadcastJob) -> bool:
+        """Stop publishing a broadcast; devices already sent to keep their state"""
+        with self._lock:
+            if job.status not in ("queued", "publishing"):
+                return False
+            job.cancelled.set()
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+        return True
+
+    def handle_ack(self, device_id: str, raw: bytes) -> bool:
+        """Apply a device ack if it answers a broadcast. Called on the MQTT network thread."""
+        if COMMAND_ID_PREFIX.encode() not in raw:
+            return False
+        try:
+            ack = json.loads(raw)
+            command_id = ack["command_id"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        if not isinstance(command_id, str) or not command_id.startswith(COMMAND_ID_PREFIX):
+            return False
+
+        job = self._jobs.get(command_id[len(COMMAND_ID_PREFIX):])
+        if job is None:
+            # Sent by another worker, or expired
+            self.unknown_acks += 1
+            return True
+        ok = str(ack.get("status", "ok")).lower() in ("ok", "done", "success")
+        with self._lock:
+            if job.devices is None:
+                # Finished: per-device state is gone, the counts are final
+                self.late_acks += 1
+                return True
+            # A group publish may reach devices the target query did not list,
+            # and an ack may arrive before its publish was recorded
+            if job.devices.get(device_id) in (None, "queued", "published"):
+                job.set_state(device_id, "acked" if ok else "failed")
+                self.acks += 1
+        return True
+
+    def start(self):
+        """Start the broadcast worker thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="broadcast-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker; a broadcast being published is left unfinished"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                job = None
+            try:
+                if job is not None and not job.cancelled.is_set():
+                    self.run_job(job)
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Broadcast worker failed: {e}")
+
+    def run_job(self, job: BroadcastJob):
+        """Publish a broadcast, pacing batches to the job's rate"""
+        with self._lock:
+            if job.cancelled.is_set():
+                return
+            job.status = "publishing"
+            job.started_at = datetime.utcnow()
+
+        message = dumps({
+            "command_id": job.command_id,
+            "type": job.type,
+            "payload": job.payload,
+            "timestamp": job.started_at.isoformat(),
+            "source": "backend",
+        })
+        publish = self._publisher()
+
+        if job.group_topic:
+            ok = self._send(publish, job.group_topic, message)
+            job.messages_published = int(ok)
+            with self._lock:
+                for device_id, state in list(job.devices.items()):
+                    if state == "queued":
+                        job.set_state(device_id, "published" if ok else "undeliverable")
+        else:
+            # Token bucket holding one batch: each batch spends len(batch) / rate seconds
+            device_ids = list(job.devices)
+            next_at = time.monotonic()
+            for start in range(0, len(device_ids), self.batch_size):
+                delay = next_at - time.monotonic()
+                if delay > 0 and (self._stopping.wait(delay) or job.cancelled.is_set()):
+                    break
+                if job.cancelled.is_set():
+                    break
+                batch = device_ids[start:start + self.batch_size]
+                next_at = max(next_at, time.monotonic()) + len(batch) / job.rate
+                results = [(device_id, self._send(publish, f"peluprice/devices/{device_id}/commands", message))
+                           for device_id in batch]
+                with self._lock:
+                    for device_id, ok in results:
+                        # The ack can beat us here
+                        if job.devices[device_id] == "queued":
+                            job.set_state(device_id, "published" if ok else "undeliverable")
+                job.messages_published = start + len(batch)
+
+        job.last_publish = time.monotonic()
+        with self._lock:
+            if job.cancelled.is_set():
+                self._finish(job, "cancelled")
+            else:
+                job.status = "waiting_acks"
+        logger.info(f"Broadcast {job.id} published to {job.counts['published'] + job.counts['acked']} devices")
+
+    def _send(self, publish, topic: str, message: bytes) -> bool:
+        try:
+            ok = publish(topic, message, self.qos)
+        except Exception as e:
+            logger.warning(f"Failed to publish broadcast message on {topic}: {e}")
+            ok = False
+        if ok:
+            self.messages_published += 1
+        else:
+            self.publish_errors += 1
+        return ok
+
+    def _finish(self, job: BroadcastJob, status: str):
+        # Called with the lock held
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.finished_mono = time.monotonic()
+        job.devices = None
+        if status == "cancelled":
+            self.cancelled += 1
+        else:
+            self.completed += 1
+
+    def sweep(self):
+        """Complete broadcasts whose acks are in or overdue and forget old finished ones"""
+        now = time.monotonic()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.status == "waiting_acks":
+                    if job.counts["published"] == 0 or now - job.last_publish >= self.ack_timeout:
+                        for device_id, state in job.devices.items():
+                            if state == "published":
+                                job.set_state(device_id, "timeout")
+                        self._finish(job, "completed")
+                elif job.finished_mono is not None and now - job.finished_mono >= self.job_ttl:
+                    del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        """Return broadcast counters and the state of tracked broadcasts"""
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "queued": self._queue.qsize(),
+            "tracked": statuses,
+            "group_topics": self.group_topics,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "messages_published": self.messages_published,
+            "publish_errors": self.publish_errors,
+            "acks": self.acks,
+            "late_acks": self.late_acks,
+            "unknown_acks": self.unknown_acks,
+            "evicted": self.evicted,
+        }
+
+# Global broadcast service instance
+broadcast_service = BroadcastService()
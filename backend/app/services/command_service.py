@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+from app.services.metrics import Histogram
+from app.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+COMMAND_ACK_TIMEOUT = float(os.getenv("COMMAND_ACK_TIMEOUT", "10"))  # seconds
+COMMAND_MAX_PENDING = int(os.getenv("COMMAND_MAX_PENDING", "10000"))
+# How long finished commands can still be polled
+COMMAND_RESULT_TTL = float(os.getenv("COMMAND_RESULT_TTL", "300"))  # seconds
+# Upper bound for wait_ms on POST /devices/{device_id}/trigger
+COMMAND_MAX_WAIT_MS = int(os.getenv("COMMAND_MAX_WAIT_MS", "10000"))
+
+# Round trip from publish to ack; devices run commands (e.g. a 4s alarm) before acking
+RTT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Commands the firmware understands; latency of anything else is reported as "other"
+COMMAND_TYPES = ("alarm", "led", "speak", "status")
+
+# Ack status values sent by devices on peluprice/devices/{device_id}/ack
+ACK_OK = ("ok", "done", "success")
+
+class DispatcherBusyError(Exception):
+    """Raised when too many commands are waiting for an ack"""
+
+class CommandRecord:
+    """A command sent to a device and what became of it"""
+
+    def __init__(self, device_id: str, owner_id: int, command_type: str, payload):
+        self.command_id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.owner_id = owner_id
+        self.type = command_type
+        self.payload = payload
+        self.created_at = datetime.utcnow()
+        self.sent_at = time.monotonic()
+        # pending -> acked | failed | timeout, or undeliverable if never published
+        self.status = "pending"
+        self.result: Optional[dict] = None
+        self.rtt: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def as_dict(self) -> dict:
+        return {
+            "command_id": self.command_id,
+            "device_id": self.device_id,
+            "type": self.type,
+            "status": self.status,
+            "created_at": self.created_at,
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "result": self.result,
+        }
+
+class CommandDispatcher:
+    """
+    Sends commands to devices over MQTT and tracks their acknowledgements.
+
+    Each command gets a command_id that the device echoes on its ack topic.
+    Pending commands live in memory until acked or until ack_timeout, after
+    which a sweeper marks them timed out; finished commands stay pollable for
+    result_ttl. Results are also pushed to the owner's WebSockets. The table
+    is per process; every process receives all acks and counts those for
+    commands sent elsewhere as unknown.
+    """
+
+    def __init__(
+        self,
+        ack_timeout: float = COMMAND_ACK_TIMEOUT,
+        max_pending: int = COMMAND_MAX_PENDING,
+        result_ttl: float = COMMAND_RESULT_TTL,
+        publish: Optional[Callable[[str, dict], bool]] = None,
+    ):
+        self.ack_timeout = ack_timeout
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._publish = publish
+        self._commands: Dict[str, CommandRecord] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.dispatched = 0
+        self.acked = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.undeliverable = 0
+        self.rejected = 0
+        self.late_acks = 0
+        self.unknown_acks = 0
+        self.rtt: Dict[str, Histogram] = {}
+
+    def _publisher(self) -> Callable[[str, dict], bool]:
+        if self._publish is None:
+            from app.services.mqtt_service import mqtt_service
+
+            self._publish = mqtt_service.publish_to_device
+        return self._publish
+
+    def dispatch(self, device_id: str, owner_id: int, command_type: str, payload=None) -> CommandRecord:
+        """Publish a command to a device and start waiting for its ack"""
+        record = CommandRecord(device_id, owner_id, command_type, payload)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise DispatcherBusyError("Too many commands waiting for an acknowledgement")
+            self._commands[record.command_id] = record
+            self._pending += 1
+
+        message = {"command_id": record.command_id, "type": command_type}
+        if payload is not None:
+            message["payload"] = payload
+        record.sent_at = time.monotonic()
+        if self._publisher()(device_id, message):
+            self.dispatched += 1
+        else:
+            self.undeliverable += 1
+            self._finish(record, "undeliverable")
+        return record
+
+    def wait(self, record: CommandRecord, timeout: float) -> CommandRecord:
+        """Block up to timeout seconds for the command to finish"""
+        if timeout > 0:
+            record.done.wait(timeout)
+        return record
+
+    def get(self, command_id: str) -> Optional[CommandRecord]:
+        return self._commands.get(command_id)
+
+    def handle_ack(self, device_id: str, raw: bytes):
+        """Apply an ack published by a device. Called on the MQTT network thread."""
+        try:
+            ack = json.loads(raw)
+            command_id = ack["command_id"]
+        except (ValueError, KeyError, TypeError):
+            self.unknown_acks += 1
+            logger.debug(f"Ignoring malformed ack from device {device_id}")
+            return
+
+        record = self._commands.get(command_id)
+        if record is None or record.device_id != device_id:
+            self.unknown_acks += 1
+            return
+
+        rtt = time.monotonic() - record.sent_at
+        ok = str(ack.get("status", "ok")).lower() in ACK_OK
+        late = record.status == "timeout"
+        # A timed-out command still records the ack: the device did run it,
+        # just too late for a waiting caller
+        if not self._finish(record, "acked" if ok else "failed", ("pending", "timeout"),
+                            rtt=rtt, result={key: value for key, value in ack.items() if key != "command_id"}):
+            return
+        self._histogram(record.type).observe(rtt)
+        if late:
+            self.late_acks += 1
+        if ok:
+            self.acked += 1
+        else:
+            self.failed += 1
+
+    def _histogram(self, command_type: str) -> Histogram:
+        # Command types come from API callers, keep the label set bounded
+        command_type = command_type if command_type in COMMAND_TYPES else "other"
+        histogram = self.rtt.get(command_type)
+        if histogram is None:
+            histogram = self.rtt.setdefault(command_type, Histogram(buckets=RTT_BUCKETS))
+        return histogram
+
+    def _finish(self, record: CommandRecord, status: str, allowed=("pending",), rtt=None, result=None) -> bool:
+        """Move a command to a final status if it is in one of the allowed states"""
+        with self._lock:
+            if record.status not in allowed:
+                return False
+            if record.status == "pending":
+                self._pending -= 1
+            record.status = status
+            record.finished_at = time.monotonic()
+            if rtt is not None:
+                record.rtt = rtt
+                record.result = result
+        record.done.set()
+        event = {**record.as_dict(), "type": "command", "command": record.type}
+        manager.publish_threadsafe([(record.device_id, event)])
+        return True
+
+    def sweep(self):
+        """Time out commands without an ack and forget old finished ones"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for command_id, record in list(self._commands.items()):
+                if record.status == "pending":
+                    if now - record.sent_at >= self.ack_timeout:
+                        expired.append(record)
+                elif now - record.finished_at >= self.result_ttl:
+                    del self._commands[command_id]
+        for record in expired:
+            if self._finish(record, "timeout"):
+                self.timeouts += 1
+
+    def start(self):
+        """Start the timeout sweeper thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="command-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sweeper thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(min(1.0, self.ack_timeout / 4)):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Command sweep failed: {e}")
+
+    def stats(self) -> dict:
+        """Return command counters and round-trip latency per command type"""
+        return {
+            "pending": self._pending,
+            "tracked": len(self._commands),
+            "max_pending": self.max_pending,
+            "ack_timeout_seconds": self.ack_timeout,
+            "dispatched": self.dispatched,
+            "acked": self.acked,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "late_acks": self.late_acks,
+            "undeliverable": self.undeliverable,
+            "rejected": self.rejected,
+            "unknown_acks": self.unknown_acks,
+            "rtt_seconds": {command_type: histogram.snapshot() for command_type, histogram in list(self.rtt.items())},
+        }
+
+# Global command dispatcher instance
+command_dispatcher = CommandDispatcher()
@@ -0,0 +1,73 @@
+import time
+import logging
+from typing import Optional
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from app.services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Checkout waits are normally sub-millisecond; the tail matters under bursts
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class PoolMonitor:
+    """Checkout wait and timeout metrics for one engine's connection pool"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine: Optional[Engine] = None
+        self.checkout_wait = Histogram(buckets=CHECKOUT_BUCKETS)
+        self.timeouts = 0
+
+    def bind(self, engine: Engine):
+        """Attach the engine whose pool gauges stats() reports"""
+        self.engine = engine
+
+    def stats(self) -> dict:
+        """Return pool gauges, saturation and checkout wait metrics"""
+        if self.engine is None:
+            return {"name": self.name, "enabled": False}
+
+        # Read through the engine: dispose() replaces the pool object
+        pool = self.engine.pool
+        size = pool.size()
+        max_overflow = getattr(pool, "_max_overflow", 0)
+        checked_out = pool.checkedout()
+        capacity = size + max(max_overflow, 0)
+        return {
+            "name": self.name,
+            "enabled": True,
+            "pool_size": size,
+            "max_overflow": max_overflow,
+            "timeout_seconds": getattr(pool, "_timeout", None),
+            "in_use": checked_out,
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "utilization": checked_out / capacity if capacity else 0.0,
+            "saturated": capacity > 0 and checked_out >= capacity,
+            "timeouts": self.timeouts,
+            "checkout_wait_seconds": self.checkout_wait.snapshot(),
+        }
+
+class _InstrumentedPoolMixin:
+    """Times every connection checkout and counts pool timeouts"""
+    monitor: PoolMonitor
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.monitor.timeouts += 1
+            logger.warning(f"{self.monitor.name} connection pool exhausted, checkout timed out")
+            raise
+        finally:
+            self.monitor.checkout_wait.observe(time.perf_counter() - started)
+
+def instrumented_pool_class(base: type, monitor: PoolMonitor) -> type:
+    """Pool class reporting to monitor; survives Pool.recreate() since it is a class attribute"""
+    return type(f"Instrumented{base.__name__}", (_InstrumentedPoolMixin, base), {"monitor": monitor})
+
+# One monitor per engine
+sync_pool_monitor = PoolMonitor("sync")
+async_pool_monitor = PoolMonitor("async")
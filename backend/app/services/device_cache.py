@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Callable, Iterable, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import models
+from app.services.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+DEVICE_CACHE_SIZE = int(os.getenv("DEVICE_CACHE_SIZE", "10000"))
+DEVICE_CACHE_TTL = float(os.getenv("DEVICE_CACHE_TTL", "30"))  # seconds
+# none: each worker only sees its own writes before the TTL expires
+# mqtt: invalidations are also broadcast to the other workers over MQTT
+DEVICE_CACHE_INVALIDATION = os.getenv("DEVICE_CACHE_INVALIDATION", "none").lower()
+DEVICE_CACHE_TOPIC = "peluprice/internal/device-cache"
+# Loads taking longer than this are not cached: invalidations older than it are forgotten
+LOAD_GRACE_SECONDS = 30.0
+
+DEVICE_COLUMNS = tuple(column.key for column in models.Device.__table__.columns)
+
+# session.info key holding device ids to invalidate once the transaction commits
+_PENDING_KEY = "device_cache_pending"
+
+def _session_info(db) -> dict:
+    # AsyncSession keeps its state on the wrapped sync session
+    return getattr(db, "sync_session", db).info
+
+def is_replica_session(db) -> bool:
+    """Whether db reads from a (possibly lagging) read replica"""
+    return "replica" in _session_info(db)
+
+class DeviceCache:
+    """
+    Read-through cache of device rows keyed by device id.
+
+    Rows are stored as detached, read-only snapshots, so they can be shared
+    between sessions and threads. Writers call invalidate_on_commit(): the ids
+    are dropped right away and again after the transaction commits. Readers
+    take a token with begin_load() before querying and pass it to put(); a
+    row loaded before an invalidation of its id is not cached, nor is a row
+    older than the cached version. Only primary sessions may fill the cache.
+    Callers that use a snapshot instead of querying count it in
+    lookups_saved. With DEVICE_CACHE_INVALIDATION=mqtt the post-commit invalidation is also
+    published for the other workers.
+    """
+
+    def __init__(self, max_size: int = DEVICE_CACHE_SIZE, ttl: float = DEVICE_CACHE_TTL,
+                 invalidation: str = DEVICE_CACHE_INVALIDATION):
+        self.cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self.broadcast_enabled = invalidation == "mqtt"
+        self.origin = uuid.uuid4().hex
+        self.publisher: Optional[Callable[[str, bytes], bool]] = None
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # device id -> (sequence, monotonic time) of its latest invalidation
+        self._invalidated: "OrderedDict[str, tuple]" = OrderedDict()
+
+        # Metrics
+        self.stale_puts = 0
+        self.replica_loads = 0
+        self.lookups_saved = 0
+        self.broadcasts = 0
+        self.broadcast_errors = 0
+        self.remote_invalidations = 0
+
+    def get(self, device_id: str) -> Optional[SimpleNamespace]:
+        """Cached snapshot, or None"""
+        return self.cache.get(device_id)
+
+    def begin_load(self) -> tuple:
+        """Token to take before loading a row that will be passed to put()"""
+        return self._sequence, time.monotonic()
+
+    @staticmethod
+    def snapshot(device) -> SimpleNamespace:
+        """Detached, read-only copy of a device row"""
+        return SimpleNamespace(**{key: getattr(device, key) for key in DEVICE_COLUMNS})
+
+    def put(self, device, token: Optional[tuple] = None) -> SimpleNamespace:
+        """
+        Cache a snapshot of a device row and return it. The snapshot is
+        returned but not cached if its id was invalidated after token was
+        taken, or if a newer version is already cached.
+        """
+        snapshot = self.snapshot(device)
+        with self._lock:
+            if token is not None and self._is_stale(snapshot.id, token):
+                self.stale_puts += 1
+                return snapshot
+            cached = self.cache.peek(snapshot.id)
+            if cached is not None and cached.version > snapshot.version:
+                self.stale_puts += 1
+                return snapshot
+            self.cache.set(snapshot.id, snapshot)
+        return snapshot
+
+    def _is_stale(self, device_id: str, token: tuple) -> bool:
+        sequence, started = token
+        if time.monotonic() - started >= LOAD_GRACE_SECONDS:
+            return True
+        invalidated = self._invalidated.get(device_id)
+        return invalidated is not None and invalidated[0] > sequence
+
+    def invalidate(self, device_ids: Iterable[str]):
+        """Drop devices from this worker's cache"""
+        with self._lock:
+            self._sequence += 1
+            now = time.monotonic()
+            for device_id in device_ids:
+                self.cache.invalidate(device_id)
+                self._invalidated.pop(device_id, None)
+                self._invalidated[device_id] = (self._sequence, now)
+            # Oldest first: forget invalidations no in-flight load can predate
+            while self._invalidated:
+                _, (_, at) = next(iter(self._invalidated.items()))
+                if now - at < LOAD_GRACE_SECONDS:
+                    break
+                self._invalidated.popitem(last=False)
+
+    def invalidate_on_commit(self, db, device_ids: Iterable[str], broadcast: bool = True):
+        """
+        Drop devices now and again once db commits. broadcast=False keeps the
+        post-commit invalidation local, for high-volume writes such as
+        heartbeats whose readers validate the row version themselves.
+        """
+        device_ids = [device_id for device_id in device_ids if device_id]
+        if not device_ids:
+            return
+        self.invalidate(device_ids)
+        pending = _session_info(db).setdefault(_PENDING_KEY, {})
+        for device_id in device_ids:
+            pending[device_id] = pending.get(device_id, False) or broadcast
+
+    def _after_commit(self, session: Session):
+        pending = session.info.pop(_PENDING_KEY, None)
+        if not pending:
+            return
+        self.invalidate(pending)
+        if self.broadcast_enabled:
+            self._broadcast([device_id for device_id, broadcast in pending.items() if broadcast])
+
+    def _after_rollback(self, session: Session):
+        # Nothing was written; the entries were already dropped up front
+        session.info.pop(_PENDING_KEY, None)
+
+    def _broadcast(self, device_ids):
+        if not device_ids or self.publisher is None:
+            return
+        payload = json.dumps({"origin": self.origin, "ids": device_ids}).encode()
+        try:
+            if self.publisher(DEVICE_CACHE_TOPIC, payload):
+                self.broadcasts += 1
+            else:
+                self.broadcast_errors += 1
+        except Exception as e:
+            self.broadcast_errors += 1
+            logger.warning(f"Failed to broadcast device cache invalidation: {e}")
+
+    def handle_message(self, payload: bytes):
+        """Apply an invalidation broadcast by another worker"""
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed device cache invalidation")
+            return
+        if message.get("origin") == self.origin:
+            return
+        device_ids = message.get("ids") or []
+        self.invalidate(device_ids)
+        self.remote_invalidations += len(device_ids)
+
+    def stats(self) -> dict:
+        """Return cache size, hit ratio and invalidation counters"""
+        return {
+            **self.cache.stats(),
+            # Snapshots used in place of a primary-key SELECT
+            "pk_lookups_saved": self.lookups_saved,
+            # Loads not cached because the row changed while they ran
+            "stale_puts": self.stale_puts,
+            "replica_loads": self.replica_loads,
+            "invalidation": "mqtt" if self.broadcast_enabled else "none",
+            "broadcasts": self.broadcasts,
+            "broadcast_errors": self.broadcast_errors,
+            "remote_invalidations": self.remote_invalidations,
+        }
+
+# Global device cache instance
+device_cache = DeviceCache()
+
+event.listen(Session, "after_commit", device_cache._after_commit)
+event.listen(Session, "after_rollback", device_cache._after_rollback)
@@ -1,11 +1,50 @@
 
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import List, Optional
 from app import models, schemas
+from app.services.device_cache import device_cache, is_replica_session
 
 def get_device(db: Session, device_id: str):
-    """Get device by ID"""
+    """
+    Get device by ID through the device cache. Returns a read-only snapshot,
+    up to a TTL old; use load_device to modify the row. Use get_owned_device
+    for ownership checks.
+    """
+    device = device_cache.get(device_id)
+    if device is not None:
+        device_cache.lookups_saved += 1
+        return device
+    return _load_and_cache(db, device_id)
+
+def get_owned_device(db: Session, device_id: str, user_id: int):
+    """
+    Get device by ID for an ownership check, through the device cache.
+    Owners are assigned once and never change, so a cached snapshot owned by
+    user_id is trusted without a query; any other answer is re-read from db.
+    Returns None for an unknown device.
+    """
+    device = device_cache.get(device_id)
+    if device is not None and device.owner_id == user_id:
+        device_cache.lookups_saved += 1
+        return device
+    return _load_and_cache(db, device_id)
+
+def _load_and_cache(db: Session, device_id: str):
+    # Rows read from a replica may lag the primary and are not cached
+    token = device_cache.begin_load()
+    device = load_device(db, device_id)
+    if device is None:
+        return None
+    if is_replica_session(db):
+        device_cache.replica_loads += 1
+        return device_cache.snapshot(device)
+    return device_cache.put(device, token)
+
+def load_device(db: Session, device_id: str):
+    """Get the device row by ID from the database, bypassing the cache"""
     return db.query(models.Device).filter(models.Device.id == device_id).first()
 
 def get_device_by_activation_key(db: Session, activation_key: str):
@@ -16,6 +55,66 @@ def get_user_devices(db: Session, user_id: int):
     """Get all devices owned by a user"""
     return db.query(models.Device).filter(models.Device.owner_id == user_id).all()
 
+def get_user_device_ids(db: Session, user_id: int) -> List[str]:
+    """Get the ids of all devices owned by a user (index-only scan)"""
+    return list(db.execute(select(models.Device.id).where(models.Device.owner_id == user_id)).scalars())
+
+def get_target_device_ids(db: Session, owner_id: Optional[int] = None, firmware_version: Optional[str] = None,
+                          statuses: Optional[List[models.DeviceStatus]] = None,
+                          device_ids: Optional[List[str]] = None) -> List[str]:
+    """Get the ids of the devices matching every given filter; no filters selects the whole fleet"""
+    query = select(models.Device.id)
+    if owner_id is not None:
+        query = query.where(models.Device.owner_id == owner_id)
+    if firmware_version is not None:
+        query = query.where(models.Device.firmware_version == firmware_version)
+    if statuses:
+        query = query.where(models.Device.status.in_(statuses))
+    if device_ids is not None:
+        query = query.where(models.Device.id.in_(device_ids))
+    return list(db.execute(query.order_by(models.Device.id)).scalars())
+
+def _user_devices_page_query(user_id: int, limit: int, after_id: Optional[str]):
+    # Served by ix_devices_owner_id_id: an index range scan, no sort
+    query = select(models.Device).where(models.Device.owner_id == user_id)
+    if after_id is not None:
+        query = query.where(models.Device.id > after_id)
+    return query.order_by(models.Device.id).limit(limit + 1)
+
+def _user_device_versions_page_query(user_id: int, limit: int, after_id: Optional[str]):
+    # Index-only scan of ix_devices_owner_id_id_version
+    query = select(models.Device.id, models.Device.version).where(models.Device.owner_id == user_id)
+    if after_id is not None:
+        query = query.where(models.Device.id > after_id)
+    return query.order_by(models.Device.id).limit(limit + 1)
+
+def get_user_device_versions_page(db: Session, user_id: int, limit: int, after_id: Optional[str] = None):
+    """Get (id, version) for the same rows get_user_devices_page would return"""
+    return db.execute(_user_device_versions_page_query(user_id, limit, after_id)).all()
+
+def get_user_devices_page(db: Session, user_id: int, limit: int, after_id: Optional[str] = None):
+    """Get up to limit + 1 devices of a user ordered by id, starting after after_id"""
+    return db.execute(_user_devices_page_query(user_id, limit, after_id)).scalars().all()
+
+async def get_device_async(db: AsyncSession, device_id: str):
+    """Get device by ID (async session)"""
+    return await db.get(models.Device, device_id)
+
+async def get_device_by_activation_key_async(db: AsyncSession, activation_key: str):
+    """Get device by activation key (async session)"""
+    result = await db.execute(select(models.Device).where(models.Device.activation_key == activation_key))
+    return result.scalars().first()
+
+async def get_user_device_versions_page_async(db: AsyncSession, user_id: int, limit: int, after_id: Optional[str] = None):
+    """Get (id, version) for a page of a user's devices (async session)"""
+    result = await db.execute(_user_device_versions_page_query(user_id, limit, after_id))
+    return result.all()
+
+async def get_user_devices_page_async(db: AsyncSession, user_id: int, limit: int, after_id: Optional[str] = None):
+    """Get up to limit + 1 devices of a user ordered by id (async session)"""
+    result = await db.execute(_user_devices_page_query(user_id, limit, after_id))
+    return result.scalars().all()
+
 def create_device(db: Session, device: schemas.DeviceCreate):
     """Create a new device"""
     db_device = models.Device(
@@ -34,7 +133,7 @@ def create_device(db: Session, device: schemas.DeviceCreate):
 
 def activate_device(db: Session, device_id: str, user_id: int):
     """Activate a device and assign it to a user"""
-    device = get_device(db, device_id)
+    device = load_device(db, device_id)
     if not device:
         return None
     
@@ -45,23 +144,105 @@ def activate_device(db: Session, device_id: str, user_id: int):
     device.status = models.DeviceStatus.ACTIVATED
     device.activated_at = datetime.utcnow()
     device.is_active = True
+    device.version = models.Device.version + 1
     
     if not device.name:
         device.name = f"Device {device.id[-6:]}"
     
+    device_cache.invalidate_on_commit(db, [device_id])
     db.commit()
     db.refresh(device)
     return device
 
+# Insert a newly registered device or refresh an existing one in a single
+# statement. xmax is 0 only for a freshly inserted row. A new id whose
+# activation key belongs to another device raises IntegrityError.
+REGISTER_DEVICE_SQL = text("""
+    INSERT INTO devices AS d (id, activation_key, status, is_active, firmware_version, hardware_version, created_at, last_seen)
+    VALUES (:id, :activation_key, 'DEPLOYED', FALSE, :firmware_version, :hardware_version, :now, :now)
+    ON CONFLICT (id) DO UPDATE SET
+        last_seen = EXCLUDED.last_seen,
+        status = CASE WHEN d.owner_id IS NOT NULL THEN 'WORKING'::devicestatus ELSE 'DEPLOYED'::devicestatus END,
+        firmware_version = EXCLUDED.firmware_version,
+        hardware_version = EXCLUDED.hardware_version,
+        version = d.version + 1
+    RETURNING (xmax = 0) AS inserted, status
+""")
+
+def _register_params(device_id: str, activation_key: str, firmware_version: Optional[str], hardware_version: Optional[str]) -> dict:
+    return {
+        "id": device_id,
+        "activation_key": activation_key,
+        "firmware_version": firmware_version,
+        "hardware_version": hardware_version,
+        "now": datetime.utcnow(),
+    }
+
+def register_device(db: Session, device_id: str, activation_key: str,
+                    firmware_version: Optional[str] = None, hardware_version: Optional[str] = None):
+    """
+    Register a device or refresh an existing registration in one round trip.
+    Returns (inserted, status). Does not commit.
+    """
+    device_cache.invalidate_on_commit(db, [device_id])
+    row = db.execute(REGISTER_DEVICE_SQL, _register_params(device_id, activation_key, firmware_version, hardware_version)).one()
+    return row.inserted, row.status
+
+async def register_device_async(db: AsyncSession, device_id: str, activation_key: str,
+                                firmware_version: Optional[str] = None, hardware_version: Optional[str] = None):
+    """Async variant of register_device. Does not commit."""
+    device_cache.invalidate_on_commit(db, [device_id])
+    result = await db.execute(REGISTER_DEVICE_SQL, _register_params(device_id, activation_key, firmware_version, hardware_version))
+    row = result.one()
+    return row.inserted, row.status
+
+# Claim an unowned device by activation key in a single statement. The UPDATE
+# only matches while owner_id IS NULL, so of two concurrent activations the
+# second re-checks the row after the first commits and matches nothing.
+# found is NULL for an unknown key, activated_id is NULL if already owned.
+ACTIVATE_DEVICE_SQL = text("""
+    WITH target AS (
+        SELECT id FROM devices WHERE activation_key = :activation_key
+    ), activated AS (
+        UPDATE devices AS d SET
+            owner_id = :user_id,
+            status = 'WORKING',
+            name = 'Device ' || left(d.id, 8),
+            last_seen = :now,
+            version = d.version + 1
+        FROM target
+        WHERE d.id = target.id AND d.owner_id IS NULL
+        RETURNING d.id, d.name, d.status
+    )
+    SELECT target.id AS found, activated.id AS activated_id, activated.name, activated.status
+    FROM target LEFT JOIN activated ON activated.id = target.id
+""")
+
+def activate_device_by_key(db: Session, activation_key: str, user_id: int):
+    """
+    Assign the device with this activation key to a user if it has no owner yet.
+    Returns None for an unknown key, otherwise a row with found, activated_id
+    (NULL when the device was already activated), name and status. Does not commit.
+    """
+    row = db.execute(ACTIVATE_DEVICE_SQL, {
+        "activation_key": activation_key,
+        "user_id": user_id,
+        "now": datetime.utcnow(),
+    }).first()
+    if row is not None and row.activated_id is not None:
+        device_cache.invalidate_on_commit(db, [row.activated_id])
+    return row
+
 def update_device_heartbeat(db: Session, device_id: str, data: dict):
     """Update device heartbeat and status"""
-    device = get_device(db, device_id)
+    device = load_device(db, device_id)
     if not device:
         return None
     
     device.last_seen = datetime.utcnow()
     device.status = models.DeviceStatus.WORKING
     device.is_active = True
+    device.version = models.Device.version + 1
     
     # Update optional fields
     if 'ip_address' in data:
@@ -73,10 +254,92 @@ def update_device_heartbeat(db: Session, device_id: str, data: dict):
     if 'firmware_version' in data:
         device.firmware_version = data['firmware_version']
     
+    device_cache.invalidate_on_commit(db, [device_id], broadcast=False)
     db.commit()
     db.refresh(device)
     return device
 
+def bulk_update_heartbeats(db: Session, heartbeats: List[dict]) -> List[str]:
+    """
+    Apply many heartbeats with a single UPDATE ... FROM (VALUES ...) statement.
+    Each heartbeat is a dict with device_id, last_seen and the optional
+    ip_address, signal_strength and battery_level fields; missing fields keep
+    their current value. Does not commit. Returns the ids of the updated
+    devices; ids without a device row are missing from it.
+    """
+    if not heartbeats:
+        return []
+
+    rows = []
+    params = {}
+    for i, heartbeat in enumerate(heartbeats):
+        rows.append(
+            f"(CAST(:id_{i} AS VARCHAR), CAST(:last_seen_{i} AS TIMESTAMP), "
+            f"CAST(:ip_{i} AS VARCHAR), CAST(:signal_{i} AS INTEGER), "
+            f"CAST(:battery_{i} AS INTEGER))"
+        )
+        params[f"id_{i}"] = heartbeat["device_id"]
+        params[f"last_seen_{i}"] = heartbeat["last_seen"]
+        params[f"ip_{i}"] = heartbeat.get("ip_address")
+        params[f"signal_{i}"] = heartbeat.get("signal_strength")
+        params[f"battery_{i}"] = heartbeat.get("battery_level")
+
+    # Heartbeat fields change constantly, so other workers are not notified;
+    # readers needing fresh values validate the row version
+    device_cache.invalidate_on_commit(db, [heartbeat["device_id"] for heartbeat in heartbeats], broadcast=False)
+    statement = text(f"""
+        UPDATE devices AS d SET
+            last_seen = GREATEST(v.last_seen, d.last_seen),
+            -- A newer status (e.g. OFFLINE) written by another consumer wins
+            status = CASE WHEN d.last_seen IS NULL OR v.last_seen >= d.last_seen
+                          THEN 'WORKING'::devicestatus ELSE d.status END,
+            is_active = CASE WHEN d.last_seen IS NULL OR v.last_seen >= d.last_seen
+                             THEN TRUE ELSE d.is_active END,
+            ip_address = COALESCE(v.ip_address, d.ip_address),
+            signal_strength = COALESCE(v.signal_strength, d.signal_strength),
+            battery_level = COALESCE(v.battery_level, d.battery_level),
+            version = d.version + 1
+        FROM (VALUES {", ".join(rows)})
+            AS v(id, last_seen, ip_address, signal_strength, battery_level)
+        WHERE d.id = v.id
+        RETURNING d.id
+    """)
+    return list(db.execute(statement, params).scalars())
+
+def bulk_update_status(db: Session, updates: List[tuple]) -> List[str]:
+    """
+    Set the status of many devices with a single UPDATE statement.
+    updates is a list of (device_id, DeviceStatus, seen_at) tuples. OFFLINE
+    devices are also marked inactive. A status older than the device's
+    last_seen is skipped: with several consumers a newer heartbeat may have
+    been written first. Applied statuses move last_seen to seen_at. Does not
+    commit. Returns the ids of the updated devices.
+    """
+    if not updates:
+        return []
+
+    rows = []
+    params = {}
+    for i, (device_id, device_status, seen_at) in enumerate(updates):
+        rows.append(f"(CAST(:id_{i} AS VARCHAR), CAST(:status_{i} AS VARCHAR), CAST(:seen_{i} AS TIMESTAMP))")
+        params[f"id_{i}"] = device_id
+        params[f"status_{i}"] = device_status.value
+        params[f"seen_{i}"] = seen_at
+
+    device_cache.invalidate_on_commit(db, [update[0] for update in updates], broadcast=False)
+    statement = text(f"""
+        UPDATE devices AS d SET
+            status = CAST(v.status AS devicestatus),
+            is_active = (v.status <> 'OFFLINE'),
+            last_seen = v.seen_at,
+            version = d.version + 1
+        FROM (VALUES {", ".join(rows)}) AS v(id, status, seen_at)
+        WHERE d.id = v.id
+            AND (d.last_seen IS NULL OR d.last_seen <= v.seen_at)
+        RETURNING d.id
+    """)
+    return list(db.execute(statement, params).scalars())
+
 def get_offline_devices(db: Session, threshold_minutes: int = 30):
     """Get devices that haven't been seen in the specified time"""
     threshold = datetime.utcnow() - timedelta(minutes=threshold_minutes)
@@ -85,12 +348,46 @@ def get_offline_devices(db: Session, threshold_minutes: int = 30):
         models.Device.is_active == True
     ).all()
 
+def get_active_device_last_seen(db: Session):
+    """Get (device_id, last_seen) for every active device, served by ix_devices_active_last_seen"""
+    return db.execute(text("SELECT id, last_seen FROM devices WHERE is_active")).all()
+
+def get_devices_last_seen(db: Session, device_ids: List[str]):
+    """Get (device_id, last_seen) for the given devices that are still active"""
+    if not device_ids:
+        return []
+    statement = text(
+        "SELECT id, last_seen FROM devices WHERE id IN :ids AND is_active"
+    ).bindparams(bindparam("ids", expanding=True))
+    return db.execute(statement, {"ids": list(device_ids)}).all()
+
+def mark_devices_offline(db: Session, device_ids: List[str], seen_before: datetime) -> List[str]:
+    """
+    Mark many devices offline with a single UPDATE. Devices whose last_seen is
+    not older than seen_before are left alone, so a heartbeat recorded in the
+    meantime (e.g. by another worker) wins. Does not commit. Returns the ids
+    that were marked offline.
+    """
+    if not device_ids:
+        return []
+    statement = text("""
+        UPDATE devices SET status = 'OFFLINE', is_active = FALSE, version = version + 1
+        WHERE id IN :ids AND is_active AND last_seen < :seen_before
+        RETURNING id
+    """).bindparams(bindparam("ids", expanding=True))
+    result = db.execute(statement, {"ids": list(device_ids), "seen_before": seen_before})
+    offline = [row[0] for row in result]
+    device_cache.invalidate_on_commit(db, offline, broadcast=False)
+    return offline
+
 def mark_device_offline(db: Session, device_id: str):
     """Mark a device as offline"""
-    device = get_device(db, device_id)
+    device = load_device(db, device_id)
     if device:
+        device_cache.invalidate_on_commit(db, [device_id], broadcast=False)
         device.status = models.DeviceStatus.OFFLINE
         device.is_active = False
+        device.version = models.Device.version + 1
         db.commit()
         db.refresh(device)
     return device
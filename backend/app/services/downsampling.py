@@ -0,0 +1,72 @@
+from typing import List, Sequence, Tuple
+
+# A series point: (timestamp in epoch seconds, average, minimum, maximum).
+# Raw samples have average == minimum == maximum.
+Point = Tuple[float, float, float, float]
+
+def lttb(points: Sequence[Point], threshold: int) -> List[Point]:
+    """
+    Largest-Triangle-Three-Buckets downsampling on the average value.
+    Keeps the first and last point and, for every bucket in between, the point
+    forming the largest triangle with the previously kept point and the
+    average of the next bucket, which preserves the visual shape of the series.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        next_points = points[next_start:next_end] or points[count - 1:]
+        avg_t = sum(point[0] for point in next_points) / len(next_points)
+        avg_v = sum(point[1] for point in next_points) / len(next_points)
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        prev_t, prev_v = points[previous][0], points[previous][1]
+
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            t, v = points[j][0], points[j][1]
+            area = abs((prev_t - avg_t) * (v - prev_v) - (prev_t - t) * (avg_v - prev_v))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        sampled.append(points[best])
+        previous = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def min_max_buckets(points: Sequence[Point], threshold: int) -> List[Point]:
+    """
+    Min/max-per-bucket downsampling. Splits the series into threshold / 2
+    buckets and keeps the points holding each bucket's minimum and maximum,
+    in time order, so spikes and drops are never averaged away.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 2:
+        return list(points)
+
+    buckets = threshold // 2
+    bucket_size = count / buckets
+    sampled: List[Point] = []
+    for i in range(buckets):
+        bucket = points[int(i * bucket_size):int((i + 1) * bucket_size)]
+        if not bucket:
+            continue
+        low = min(bucket, key=lambda point: point[2])
+        high = max(bucket, key=lambda point: point[3])
+        if low is high:
+            sampled.append(low)
+        else:
+            sampled.extend(sorted((low, high), key=lambda point: point[0]))
+    return sampled
@@ -0,0 +1,30 @@
+import hashlib
+from typing import Any
+from fastapi import Request, Response, status
+
+# Let clients keep a copy but revalidate it on every request
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag derived from the parts identifying a response's state"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers etag (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+def set_etag(response: Response, etag: str) -> Response:
+    """Attach the ETag and revalidation headers to a response"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+def not_modified(etag: str) -> Response:
+    """Empty 304 response for a matching If-None-Match"""
+    return set_etag(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag)
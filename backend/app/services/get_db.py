@@ -1,8 +1,9 @@
 
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
-from app.database import SessionLocal
-from fastapi import HTTPException
+from app.database import SessionLocal, AsyncSessionLocal
+from app.services.replica_router import replica_router, request_subject
+from fastapi import HTTPException, Request
 
 def get_db():
     try:
@@ -17,3 +18,30 @@ def get_db():
             db.close()
         except:
             pass
+
+def get_read_db(request: Request):
+    """Session for read-only routes: a read replica when configured, else the primary"""
+    try:
+        db = replica_router.read_session(request_subject(request.headers.get("authorization")))
+        yield db
+    except OperationalError:
+        raise HTTPException(status_code=503, detail="Database connection failed. Please try again later.")
+    except Exception:
+        raise HTTPException(status_code=500, detail="Database error occurred.")
+    finally:
+        try:
+            db.close()
+        except Exception:
+            pass
+
+async def get_async_db():
+    """Async session dependency, only available when DATABASE_MODE=async"""
+    if AsyncSessionLocal is None:
+        raise HTTPException(status_code=500, detail="Async database mode is not enabled.")
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    except OperationalError:
+        raise HTTPException(status_code=503, detail="Database connection failed. Please try again later.")
+    finally:
+        await db.close()
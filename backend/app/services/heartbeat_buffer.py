@@ -0,0 +1,305 @@
+import os
+import math
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.exc import DataError, IntegrityError
+from app.database import SessionLocal
+from app.services import device_service
+from app.services.cache import LRUTTLCache
+from app.services.liveness import liveness_tracker
+from app.services.metrics import Histogram
+from app.services.telemetry_service import telemetry_writer
+from app.ws.manager import heartbeat_event, manager
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "2.0"))  # seconds
+HEARTBEAT_FLUSH_MAX_BATCH = int(os.getenv("HEARTBEAT_FLUSH_MAX_BATCH", "500"))
+HEARTBEAT_BUFFER_MAX_PENDING = int(os.getenv("HEARTBEAT_BUFFER_MAX_PENDING", "50000"))
+# Failed flushes a heartbeat survives (e.g. database unreachable) before it is dropped
+HEARTBEAT_MAX_RETRIES = int(os.getenv("HEARTBEAT_MAX_RETRIES", "5"))
+# How long heartbeats for an id with no device row are answered with 404
+HEARTBEAT_UNKNOWN_TTL = float(os.getenv("HEARTBEAT_UNKNOWN_TTL", "30"))  # seconds
+
+# Range of the INTEGER columns
+INT4_MIN, INT4_MAX = -2**31, 2**31 - 1
+IP_ADDRESS_MAX_LENGTH = 64
+
+# Errors no retry can fix: the rows carry values the devices table rejects
+PERMANENT_ERRORS = (DataError, IntegrityError)
+
+class UnknownDeviceError(Exception):
+    """Raised for a heartbeat from a device id that has no device row"""
+
+def _int_field(field: str, value) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{field} must be a number")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"{field} must be finite")
+    value = int(value)
+    if not INT4_MIN <= value <= INT4_MAX:
+        raise ValueError(f"{field} is out of range")
+    return value
+
+def heartbeat_fields(data: dict) -> dict:
+    """
+    Validated device columns carried by a heartbeat, status or data payload
+    (rssi is accepted for signal_strength). Raises ValueError for a value the
+    devices table cannot store.
+    """
+    fields = {}
+    ip_address = data.get("ip_address")
+    if ip_address is not None:
+        if not isinstance(ip_address, str) or len(ip_address) > IP_ADDRESS_MAX_LENGTH:
+            raise ValueError(f"ip_address must be a string of at most {IP_ADDRESS_MAX_LENGTH} characters")
+        fields["ip_address"] = ip_address
+    signal = data.get("signal_strength", data.get("rssi"))
+    if signal is not None:
+        fields["signal_strength"] = _int_field("signal_strength", signal)
+    if data.get("battery_level") is not None:
+        fields["battery_level"] = _int_field("battery_level", data["battery_level"])
+    return fields
+
+class HeartbeatBuffer:
+    """
+    Write-behind buffer for device heartbeats.
+
+    Heartbeats are kept in memory, latest value per device id, and written
+    to the devices table by a background thread in bulk UPDATE statements,
+    either every flush_interval seconds or as soon as max_batch devices are
+    pending. stop() always performs a final flush.
+
+    Field values are validated on add(). Should the database still reject a
+    row, it is dropped and the rest of the batch written; a batch failing for
+    any other reason is retried up to max_retries times. Ids without a
+    device row are dropped at flush time, before liveness, telemetry and
+    WebSocket side effects, and answered with UnknownDeviceError for a while.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = HEARTBEAT_FLUSH_INTERVAL,
+        max_batch: int = HEARTBEAT_FLUSH_MAX_BATCH,
+        max_pending: int = HEARTBEAT_BUFFER_MAX_PENDING,
+        max_retries: int = HEARTBEAT_MAX_RETRIES,
+        unknown_ttl: float = HEARTBEAT_UNKNOWN_TTL,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._pending: Dict[str, dict] = {}
+        self._retries: Dict[str, int] = {}
+        self._unknown = LRUTTLCache(max_size=max_pending, ttl=unknown_ttl)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.accepted = 0
+        self.merged = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rows_written = 0
+        self.unmatched = 0
+        self.rejected = 0
+        self.unknown_rejected = 0
+        self.retries_exhausted = 0
+        self.batch_size = Histogram(buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+        self.flush_latency = Histogram()
+
+    def add(self, device_id: str, data: dict, seen_at: Optional[datetime] = None) -> bool:
+        """
+        Buffer a heartbeat. Returns False if the buffer is full and the
+        heartbeat was dropped. Raises ValueError for invalid field values and
+        UnknownDeviceError for an id recently found to have no device row.
+        """
+        if self._unknown.get(device_id) is not None:
+            self.unknown_rejected += 1
+            raise UnknownDeviceError(device_id)
+        heartbeat = {"device_id": device_id, "last_seen": seen_at or datetime.utcnow()}
+        heartbeat.update(heartbeat_fields(data))
+
+        with self._lock:
+            previous = self._pending.get(device_id)
+            if previous is not None:
+                # Keep optional fields from the older heartbeat unless overwritten
+                previous.update(heartbeat)
+                self.merged += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            else:
+                self._pending[device_id] = heartbeat
+            self.accepted += 1
+            pending = len(self._pending)
+
+        if pending >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    def forget_unknown(self, device_id: str):
+        """Accept heartbeats of a device id again, e.g. once it registered"""
+        self._unknown.invalidate(device_id)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flusher", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Heartbeat buffer started (interval={self.flush_interval}s, max_batch={self.max_batch})"
+        )
+
+    def stop(self):
+        """Stop the flush thread and write out everything still pending"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=max(self.flush_interval * 2, 5.0))
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Final heartbeat flush failed: {e}")
+        logger.info("Heartbeat buffer stopped")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Heartbeat flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write all pending heartbeats to the database. Returns rows updated."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = list(self._pending.values())
+                self._pending = {}
+
+            started = time.perf_counter()
+            db = self.session_factory()
+            try:
+                written, rejected = self._write(db, batch)
+                db.commit()
+            except Exception:
+                db.rollback()
+                self.flush_errors += 1
+                self._requeue(batch)
+                raise
+            finally:
+                db.close()
+
+            with self._lock:
+                for heartbeat in batch:
+                    self._retries.pop(heartbeat["device_id"], None)
+
+            known = []
+            for heartbeat in batch:
+                device_id = heartbeat["device_id"]
+                if device_id in written:
+                    known.append(heartbeat)
+                elif device_id not in rejected:
+                    self._unknown.set(device_id, True)
+                    self.unmatched += 1
+
+            for heartbeat in known:
+                liveness_tracker.touch(heartbeat["device_id"], heartbeat["last_seen"])
+                telemetry_writer.record(heartbeat["device_id"], heartbeat["last_seen"], heartbeat)
+            manager.publish_threadsafe(
+                (heartbeat["device_id"], heartbeat_event(heartbeat)) for heartbeat in known
+            )
+            self.flush_latency.observe(time.perf_counter() - started)
+            self.batch_size.observe(len(batch))
+            self.flushes += 1
+            self.rows_written += len(written)
+            self.rejected += len(rejected)
+            return len(written)
+
+    def _write(self, db, batch: List[dict]) -> Tuple[Set[str], List[str]]:
+        """
+        Apply a batch in chunks of max_batch. A chunk the database rejects is
+        retried row by row and the offending rows are dropped. Returns the
+        updated device ids and the rejected ones.
+        """
+        written: Set[str] = set()
+        rejected: List[str] = []
+        for i in range(0, len(batch), self.max_batch):
+            chunk = batch[i:i + self.max_batch]
+            try:
+                with db.begin_nested():
+                    written.update(device_service.bulk_update_heartbeats(db, chunk))
+            except PERMANENT_ERRORS:
+                for heartbeat in chunk:
+                    try:
+                        with db.begin_nested():
+                            written.update(device_service.bulk_update_heartbeats(db, [heartbeat]))
+                    except PERMANENT_ERRORS as e:
+                        rejected.append(heartbeat["device_id"])
+                        logger.warning(f"Dropping heartbeat of device {heartbeat['device_id']}: {e}")
+        return written, rejected
+
+    def _requeue(self, batch):
+        """Put a failed batch back, without overwriting newer heartbeats or retrying forever"""
+        with self._lock:
+            for heartbeat in batch:
+                device_id = heartbeat["device_id"]
+                if device_id in self._pending:
+                    continue
+                retries = self._retries.get(device_id, 0) + 1
+                if retries > self.max_retries:
+                    self._retries.pop(device_id, None)
+                    self.retries_exhausted += 1
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self._retries.pop(device_id, None)
+                    self.dropped += 1
+                    continue
+                self._retries[device_id] = retries
+                self._pending[device_id] = heartbeat
+
+    def stats(self) -> dict:
+        """Return buffer metrics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "accepted": self.accepted,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "rows_written": self.rows_written,
+            # Heartbeats for ids without a device row: at flush, and refused on arrival
+            "unmatched": self.unmatched,
+            "unknown_rejected": self.unknown_rejected,
+            "rejected": self.rejected,
+            "retries_exhausted": self.retries_exhausted,
+            "batch_size": self.batch_size.snapshot(),
+            "flush_latency_seconds": self.flush_latency.snapshot(),
+        }
+
+# Global heartbeat buffer instance
+heartbeat_buffer = HeartbeatBuffer()
+
+def get_heartbeat_buffer() -> HeartbeatBuffer:
+    """Get the global heartbeat buffer instance"""
+    return heartbeat_buffer
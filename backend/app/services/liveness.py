@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+from app.database import SessionLocal
+from app.services import device_service
+from app.services.metrics import Histogram
+from app.ws.manager import manager, status_event
+
+logger = logging.getLogger(__name__)
+
+DEVICE_OFFLINE_THRESHOLD_MINUTES = float(os.getenv("DEVICE_OFFLINE_THRESHOLD_MINUTES", "30"))
+LIVENESS_SWEEP_INTERVAL = float(os.getenv("LIVENESS_SWEEP_INTERVAL", "5.0"))  # seconds, also the wheel tick
+
+def _timestamp(value: datetime) -> float:
+    """Convert a naive UTC datetime (as stored in devices.last_seen) to epoch seconds"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+class LivenessTracker:
+    """
+    In-process device liveness tracking on a timing wheel.
+
+    Every heartbeat moves the device into the wheel slot of its deadline
+    (last seen + timeout). A sweep only visits the slots that elapsed since
+    the previous sweep, so finding expired devices costs O(expired) instead
+    of a scan over the devices table, and they are marked OFFLINE with one
+    bulk UPDATE. The wheel is rebuilt on startup from the active devices.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        timeout_seconds: float = DEVICE_OFFLINE_THRESHOLD_MINUTES * 60,
+        tick: float = LIVENESS_SWEEP_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.timeout_seconds = timeout_seconds
+        self.tick = tick
+
+        self._slots: Dict[int, Set[str]] = {}
+        self._slot_of: Dict[str, int] = {}
+        self._cursor: Optional[int] = None  # first slot not swept yet
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.rebuilt_devices = 0
+        self.sweeps = 0
+        self.sweep_errors = 0
+        self.expired_total = 0
+        self.marked_offline = 0
+        self.rearmed = 0
+        self.sweep_latency = Histogram()
+
+    def touch(self, device_id: str, seen_at: Optional[datetime] = None):
+        """Record that a device was seen, pushing its deadline forward"""
+        seen = _timestamp(seen_at) if seen_at else time.time()
+        self._arm(device_id, seen + self.timeout_seconds)
+
+    def forget(self, device_id: str):
+        """Stop tracking a device (e.g. it reported itself offline)"""
+        with self._lock:
+            slot = self._slot_of.pop(device_id, None)
+            if slot is not None:
+                self._discard(slot, device_id)
+
+    def _arm(self, device_id: str, deadline: float):
+        slot = int(deadline // self.tick)
+        with self._lock:
+            if self._cursor is not None and slot < self._cursor:
+                # Already overdue, the next sweep picks it up
+                slot = self._cursor
+            previous = self._slot_of.get(device_id)
+            if previous == slot:
+                return
+            if previous is not None:
+                self._discard(previous, device_id)
+            self._slot_of[device_id] = slot
+            self._slots.setdefault(slot, set()).add(device_id)
+
+    def _discard(self, slot: int, device_id: str):
+        devices = self._slots.get(slot)
+        if devices is not None:
+            devices.discard(device_id)
+            if not devices:
+                del self._slots[slot]
+
+    def pop_expired(self, now: Optional[float] = None) -> List[str]:
+        """Remove and return every device whose deadline has passed"""
+        now_slot = int((now if now is not None else time.time()) // self.tick)
+        expired: List[str] = []
+        with self._lock:
+            if self._cursor is None:
+                self._cursor = min(self._slots, default=now_slot)
+            if now_slot - self._cursor > len(self._slots):
+                # Long gap (startup, stalled sweeper): visit occupied slots only
+                due = [slot for slot in self._slots if slot < now_slot]
+            else:
+                due = range(self._cursor, now_slot)
+            for slot in due:
+                devices = self._slots.pop(slot, None)
+                if devices:
+                    for device_id in devices:
+                        del self._slot_of[device_id]
+                    expired.extend(devices)
+            self._cursor = max(self._cursor, now_slot)
+        return expired
+
+    def rebuild(self):
+        """Load the active devices into the wheel with one indexed query"""
+        db = self.session_factory()
+        try:
+            rows = device_service.get_active_device_last_seen(db)
+        finally:
+            db.close()
+
+        for device_id, last_seen in rows:
+            # Heartbeats received since startup are newer than the stored value
+            if last_seen is not None and device_id not in self._slot_of:
+                self.touch(device_id, last_seen)
+        self.rebuilt_devices = len(rows)
+        logger.info(f"Liveness tracker rebuilt with {len(rows)} active devices")
+
+    def sweep(self) -> List[str]:
+        """Mark every expired device offline. Returns the ids marked offline."""
+        started = time.perf_counter()
+        expired = self.pop_expired()
+        if not expired:
+            return []
+
+        seen_before = datetime.utcnow() - timedelta(seconds=self.timeout_seconds)
+        db = self.session_factory()
+        try:
+            offline = device_service.mark_devices_offline(db, expired, seen_before)
+            db.commit()
+            # Anything not marked was seen more recently than we knew (another
+            # worker took the heartbeat); re-arm those from the stored last_seen
+            remaining = set(expired) - set(offline)
+            if remaining:
+                for device_id, last_seen in device_service.get_devices_last_seen(db, list(remaining)):
+                    self.touch(device_id, last_seen)
+                    self.rearmed += 1
+        except Exception:
+            db.rollback()
+            self.sweep_errors += 1
+            # Retry on the next sweep
+            for device_id in expired:
+                self._arm(device_id, 0)
+            raise
+        finally:
+            db.close()
+
+        self.sweeps += 1
+        self.expired_total += len(expired)
+        self.marked_offline += len(offline)
+        self.sweep_latency.observe(time.perf_counter() - started)
+        if offline:
+            logger.info(f"Marked {len(offline)} devices offline")
+            manager.publish_threadsafe((device_id, status_event("OFFLINE")) for device_id in offline)
+        return offline
+
+    def start(self):
+        """Start the sweep thread; the wheel is rebuilt from the database first"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="liveness-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sweep thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self.tick * 2)
+            self._thread = None
+
+    def _run(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Liveness tracker rebuild failed, tracking new heartbeats only: {e}")
+
+        while not self._stopping.wait(self.tick):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Liveness sweep failed: {e}")
+
+    def stats(self) -> dict:
+        """Return tracker metrics"""
+        with self._lock:
+            tracked = len(self._slot_of)
+            slots = len(self._slots)
+        return {
+            "tracked": tracked,
+            "slots": slots,
+            "timeout_seconds": self.timeout_seconds,
+            "rebuilt_devices": self.rebuilt_devices,
+            "sweeps": self.sweeps,
+            "sweep_errors": self.sweep_errors,
+            "expired": self.expired_total,
+            "marked_offline": self.marked_offline,
+            "rearmed": self.rearmed,
+            "sweep_latency_seconds": self.sweep_latency.snapshot(),
+        }
+
+# Global liveness tracker instance
+liveness_tracker = LivenessTracker()
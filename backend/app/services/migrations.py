@@ -0,0 +1,103 @@
+import os
+import re
+import logging
+from pathlib import Path
+from typing import List, Optional
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+ALEMBIC_INI = BACKEND_DIR / "alembic.ini"
+
+# fail: refuse to start on drift, warn: log it, off: skip the check
+SCHEMA_DRIFT_CHECK = os.getenv("SCHEMA_DRIFT_CHECK", "fail").lower()
+
+# Telemetry partitions are created at runtime by telemetry_service
+PARTITION_TABLE = re.compile(r"^device_telemetry(_1m|_1h|_1d)?_p\d+$")
+
+class SchemaDriftError(RuntimeError):
+    """Raised when the database schema does not match the models"""
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep runtime-managed tables out of autogenerate and drift checks"""
+    if type_ == "table" and reflected and compare_to is None and name and PARTITION_TABLE.match(name):
+        return False
+    return True
+
+def _describe(diff) -> str:
+    """Short form of an autogenerate diff, e.g. "add_index ix_devices_owner_id" """
+    if isinstance(diff, list):
+        return "; ".join(_describe(item) for item in diff)
+    names = []
+    for item in diff[1:]:
+        if isinstance(item, str):
+            names.append(item)
+        elif getattr(item, "name", None):
+            names.append(item.name)
+    return f"{diff[0]} {'.'.join(names)}"
+
+def alembic_config(database_url: Optional[str] = None):
+    """Alembic configuration for the backend migrations"""
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(BACKEND_DIR / "migrations"))
+    if database_url:
+        # Escape % for the ini interpolation
+        config.set_main_option("sqlalchemy.url", database_url.replace("%", "%%"))
+    return config
+
+def upgrade_head(database_url: Optional[str] = None):
+    """Apply every pending migration"""
+    from alembic import command
+
+    config = alembic_config(database_url)
+    config.attributes["configure_logging"] = False
+    command.upgrade(config, "head")
+
+def check_schema_drift(engine: Engine) -> List[str]:
+    """Describe every difference between the database and the models; empty when in sync"""
+    from alembic.autogenerate import compare_metadata
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from app.models import Base
+
+    heads = set(ScriptDirectory.from_config(alembic_config()).get_heads())
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={"include_object": include_object})
+        problems = []
+        current = set(context.get_current_heads())
+        if not current and not inspect(connection).get_table_names():
+            # Fresh database, initialised later through /init-db or init_db.py
+            logger.warning("Database has no tables yet, run the migrations to create them")
+            return []
+        if current != heads:
+            problems.append(
+                f"database at revision {sorted(current) or 'none'}, migrations head is {sorted(heads)}"
+            )
+        problems.extend(_describe(diff) for diff in compare_metadata(context, Base.metadata))
+    return problems
+
+def verify_schema(engine: Engine, mode: str = SCHEMA_DRIFT_CHECK):
+    """Startup check that the live schema matches the models"""
+    if mode == "off":
+        return
+    try:
+        problems = check_schema_drift(engine)
+    except Exception as e:
+        # The API starts without a reachable database and connects lazily
+        logger.error(f"Schema drift check could not run: {e}")
+        return
+    if not problems:
+        logger.info("Database schema matches the models")
+        return
+
+    for problem in problems:
+        logger.error(f"Schema drift: {problem}")
+    if mode == "fail":
+        raise SchemaDriftError(
+            f"Database schema differs from the models in {len(problems)} place(s); "
+            "run scripts/migrate.py upgrade head"
+        )
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import zlib
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app import models
+from app.database import SessionLocal
+from app.services import device_service
+from app.services.heartbeat_buffer import heartbeat_fields
+from app.services.liveness import liveness_tracker
+from app.services.metrics import Histogram
+from app.services.telemetry_service import telemetry_writer
+from app.ws.manager import heartbeat_event, manager, status_event, telemetry_event
+
+logger = logging.getLogger(__name__)
+
+# Worker threads; each device always maps to the same shard
+MQTT_INGEST_SHARDS = int(os.getenv("MQTT_INGEST_SHARDS", "4"))
+# Total queue capacity, split evenly between the shards
+MQTT_INGEST_QUEUE_SIZE = int(os.getenv("MQTT_INGEST_QUEUE_SIZE", "10000"))
+MQTT_INGEST_BATCH_SIZE = int(os.getenv("MQTT_INGEST_BATCH_SIZE", "500"))
+MQTT_INGEST_BATCH_WAIT = float(os.getenv("MQTT_INGEST_BATCH_WAIT", "0.5"))  # seconds
+MQTT_INGEST_PUT_TIMEOUT = float(os.getenv("MQTT_INGEST_PUT_TIMEOUT", "0.1"))  # seconds
+
+MESSAGE_TYPES = ("heartbeat", "status", "data")
+
+# Status values reported by devices on peluprice/devices/{device_id}/status
+REPORTED_STATUS = {
+    "online": models.DeviceStatus.WORKING,
+    "working": models.DeviceStatus.WORKING,
+    "offline": models.DeviceStatus.OFFLINE,
+    "error": models.DeviceStatus.ERROR,
+}
+
+class _Shard:
+    """One worker thread with its own bounded queue"""
+
+    def __init__(self, index: int, max_queue: int):
+        self.index = index
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.thread: Optional[threading.Thread] = None
+
+        # Metrics, each only updated by one thread
+        self.received = 0
+        self.dropped = 0
+        self.batches = 0
+        self.batch_errors = 0
+        self.invalid = 0
+
+    def stats(self) -> dict:
+        return {
+            "shard": self.index,
+            "queue_depth": self.queue.qsize(),
+            "received": self.received,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "batch_errors": self.batch_errors,
+            "invalid": self.invalid,
+        }
+
+class DeviceMessageIngestor:
+    """
+    Batched ingestion of device MQTT messages.
+
+    submit() is called on the paho network thread and only enqueues the raw
+    message on one of several bounded shard queues, chosen by a hash of the
+    device id so that every device's messages stay in order on one shard.
+    When the shard queue is full it waits up to put_timeout seconds
+    (backpressure on the network loop) and then drops. Each shard has a
+    worker thread that parses messages and applies each batch to the
+    devices table in a single transaction; shards touch disjoint devices,
+    so their transactions never wait on each other's rows.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_queue: int = MQTT_INGEST_QUEUE_SIZE,
+        batch_size: int = MQTT_INGEST_BATCH_SIZE,
+        batch_wait: float = MQTT_INGEST_BATCH_WAIT,
+        put_timeout: float = MQTT_INGEST_PUT_TIMEOUT,
+        shards: int = MQTT_INGEST_SHARDS,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.put_timeout = put_timeout
+        shards = max(1, shards)
+        self._shards = [_Shard(i, max(1, max_queue // shards)) for i in range(shards)]
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+        # Metrics; invalid payloads are counted per shard
+        self.invalid_topics = 0
+        self.batch_size_histogram = Histogram(buckets=(1, 10, 50, 100, 250, 500, 1000))
+        self.batch_latency = Histogram()
+
+    def submit(self, topic: str, payload: bytes) -> bool:
+        """Enqueue a raw device message. Returns False if it was dropped."""
+        # Topic format: peluprice/devices/{device_id}/{message_type}
+        parts = topic.split("/")
+        if len(parts) != 4 or parts[3] not in MESSAGE_TYPES:
+            with self._lock:
+                self.invalid_topics += 1
+            return False
+
+        shard = self.shard_for(parts[2])
+        try:
+            shard.queue.put((parts[2], parts[3], payload, datetime.utcnow()), timeout=self.put_timeout)
+        except queue.Full:
+            shard.dropped += 1
+            return False
+        shard.received += 1
+        return True
+
+    def shard_for(self, device_id: str) -> _Shard:
+        """The shard handling a device (stable across restarts)"""
+        return self._shards[zlib.crc32(device_id.encode()) % len(self._shards)]
+
+    def start(self):
+        """Start one worker thread per shard"""
+        self._stopping.clear()
+        for shard in self._shards:
+            if shard.thread and shard.thread.is_alive():
+                continue
+            shard.thread = threading.Thread(
+                target=self._run, args=(shard,), name=f"mqtt-ingest-{shard.index}", daemon=True
+            )
+            shard.thread.start()
+        logger.info(f"MQTT ingestion started with {len(self._shards)} shards")
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the workers after each has drained its queue"""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            if shard.thread:
+                shard.thread.join(timeout=max(0.0, deadline - time.monotonic()))
+                if shard.thread.is_alive():
+                    logger.warning(
+                        f"MQTT ingestion shard {shard.index} did not drain in time, "
+                        f"{shard.queue.qsize()} messages left"
+                    )
+                shard.thread = None
+        logger.info("MQTT ingestion workers stopped")
+
+    def _run(self, shard: _Shard):
+        while True:
+            batch = self._next_batch(shard.queue)
+            if batch:
+                try:
+                    self.apply_batch(batch, shard)
+                    shard.batches += 1
+                except Exception as e:
+                    shard.batch_errors += 1
+                    logger.error(f"Failed to apply MQTT batch of {len(batch)} messages on shard {shard.index}: {e}")
+            elif self._stopping.is_set():
+                break
+
+    def _next_batch(self, source: queue.Queue) -> list:
+        """Wait for one message, then collect more until the batch is full or batch_wait elapses"""
+        try:
+            batch = [source.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(source.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def apply_batch(self, batch: list, shard: _Shard):
+        """Parse a batch of raw messages taken from shard and apply it in one transaction"""
+        heartbeats, statuses, samples = self._collect(batch, shard)
+        if not heartbeats and not statuses:
+            return
+
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            device_service.bulk_update_heartbeats(db, list(heartbeats.values()))
+            applied = set(device_service.bulk_update_status(
+                db, [(device_id, reported, seen_at) for device_id, (reported, seen_at) in statuses.items()]
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        for device_id, heartbeat in heartbeats.items():
+            liveness_tracker.touch(device_id, heartbeat["last_seen"])
+        # Statuses superseded by a newer message on another consumer had no effect
+        statuses = {device_id: reported for device_id, (reported, _) in statuses.items() if device_id in applied}
+        for device_id, reported in statuses.items():
+            if reported == models.DeviceStatus.OFFLINE:
+                liveness_tracker.forget(device_id)
+            else:
+                liveness_tracker.touch(device_id)
+
+        manager.publish_threadsafe(
+            [(device_id, heartbeat_event(heartbeat)) for device_id, heartbeat in heartbeats.items()]
+            + [(device_id, status_event(reported)) for device_id, reported in statuses.items()]
+            + [(device_id, telemetry_event(recorded_at, fields)) for device_id, recorded_at, fields in samples]
+        )
+
+        self.batch_size_histogram.observe(len(batch))
+        self.batch_latency.observe(time.perf_counter() - started)
+
+    def _collect(self, batch: list, shard: _Shard) -> Tuple[Dict[str, dict], Dict[str, tuple], List[tuple]]:
+        """
+        Reduce a batch to one heartbeat and at most one status per device,
+        preserving per-device message order. Every message counts as proof of
+        life; an offline/error status only survives if no later message for
+        the same device came after it. Statuses map to (status, received_at).
+        Also returns the (device_id, received_at, fields) samples of data
+        messages for live subscribers.
+        """
+        heartbeats: Dict[str, dict] = {}
+        statuses: Dict[str, tuple] = {}
+        samples: List[tuple] = []
+
+        for device_id, message_type, raw, received_at in batch:
+            try:
+                payload = json.loads(raw)
+                if not isinstance(payload, dict):
+                    raise ValueError("payload is not a JSON object")
+                # NaN, infinities and out-of-range numbers would fail the
+                # whole batch's transaction, reject just this message
+                fields = heartbeat_fields(payload)
+            except ValueError as e:
+                shard.invalid += 1
+                logger.debug(f"Invalid {message_type} payload from device {device_id}: {e}")
+                continue
+
+            if fields:
+                telemetry_writer.record(device_id, received_at, fields)
+                if message_type == "data":
+                    samples.append((device_id, received_at, fields))
+            reported = REPORTED_STATUS.get(str(payload.get("status", "")).lower())
+
+            if message_type == "status" and reported and reported != models.DeviceStatus.WORKING:
+                statuses[device_id] = (reported, received_at)
+                continue
+
+            heartbeat = heartbeats.setdefault(device_id, {"device_id": device_id})
+            heartbeat.update(fields)
+            heartbeat["last_seen"] = received_at
+            statuses.pop(device_id, None)
+
+        return heartbeats, statuses, samples
+
+    def stats(self) -> dict:
+        """Return ingestion metrics"""
+        shards = [shard.stats() for shard in self._shards]
+        return {
+            "queue_depth": sum(shard["queue_depth"] for shard in shards),
+            "queue_capacity": sum(shard.queue.maxsize for shard in self._shards),
+            "received": sum(shard["received"] for shard in shards),
+            "dropped": sum(shard["dropped"] for shard in shards),
+            "invalid": self.invalid_topics + sum(shard["invalid"] for shard in shards),
+            "invalid_topics": self.invalid_topics,
+            "batches": sum(shard["batches"] for shard in shards),
+            "batch_errors": sum(shard["batch_errors"] for shard in shards),
+            "shards": shards,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "batch_latency_seconds": self.batch_latency.snapshot(),
+        }
+
+# Global device message ingestor instance
+device_ingestor = DeviceMessageIngestor()
@@ -1,25 +1,62 @@
 import os
-import json
+import socket
 import logging
 from typing import Optional
 import paho.mqtt.client as mqtt
 from datetime import datetime
+from app.services.broadcast_service import broadcast_service
+from app.services.command_service import command_dispatcher
+from app.services.device_cache import DEVICE_CACHE_TOPIC, device_cache
+from app.services.mqtt_ingest import device_ingestor
+from app.services.serialization import dumps
 
 logger = logging.getLogger(__name__)
 
+# Device topics whose messages only need to be handled by one backend process
+DEVICE_TOPICS = ("status", "heartbeat", "data")
+
 class MQTTService:
+    """
+    Backend connection to the broker.
+
+    By default every process subscribes to all device topics, which suits a
+    single worker. With MQTT_SHARED_GROUP set, device topics are subscribed
+    as $share/<group>/... (MQTT v5) and the broker hands each message to one
+    member of the group, spreading device traffic over all replicas and
+    workers. A device's messages may then be applied out of order across
+    replicas; status writes are guarded by the receive time against the
+    device's last_seen, so a late offline status cannot undo a newer
+    heartbeat. Command acks and internal topics stay plain subscriptions:
+    every process needs to see them. Client ids get a host and process
+    suffix so replicas never take over each other's connection.
+    """
+
     def __init__(self):
         self.client: Optional[mqtt.Client] = None
         self.host = os.getenv("MQTT_HOST", "localhost")
         self.port = int(os.getenv("MQTT_PORT", "1883"))
         self.username = os.getenv("MQTT_USERNAME", "peluprice")
         self.password = os.getenv("MQTT_PASSWORD", "peluprice123")
-        self.client_id = os.getenv("MQTT_CLIENT_ID", "peluprice-backend")
+        self.client_id = f"{os.getenv('MQTT_CLIENT_ID', 'peluprice-backend')}-{socket.gethostname()}-{os.getpid()}"
+        self.shared_group = os.getenv("MQTT_SHARED_GROUP", "").strip()
+        # Shared subscriptions are an MQTT v5 feature
+        self.protocol = os.getenv("MQTT_PROTOCOL", "5" if self.shared_group else "3.1.1")
+        self.ingestor = device_ingestor
         
+    def device_subscriptions(self) -> list:
+        """Topic filters for device traffic, shared between replicas when a group is set"""
+        prefix = f"$share/{self.shared_group}/" if self.shared_group else ""
+        return [f"{prefix}peluprice/devices/+/{message_type}" for message_type in DEVICE_TOPICS]
+    
     def connect(self):
         """Connect to MQTT broker"""
         try:
-            self.client = mqtt.Client(client_id=self.client_id)
+            protocol = mqtt.MQTTv5 if self.protocol == "5" else mqtt.MQTTv311
+            if hasattr(mqtt, "CallbackAPIVersion"):
+                # paho-mqtt >= 2.0 requires choosing the callback signature version
+                self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=self.client_id, protocol=protocol)
+            else:
+                self.client = mqtt.Client(client_id=self.client_id, protocol=protocol)
             
             # Set username and password if provided
             if self.username and self.password:
@@ -35,7 +72,11 @@ class MQTTService:
             self.client.connect(self.host, self.port, 60)
             self.client.loop_start()
             
-            logger.info(f"Connecting to MQTT broker at {self.host}:{self.port}")
+            if device_cache.broadcast_enabled:
+                device_cache.publisher = self.publish_internal
+            
+            mode = f"shared group {self.shared_group}" if self.shared_group else "single consumer"
+            logger.info(f"Connecting to MQTT broker at {self.host}:{self.port} as {self.client_id} ({mode})")
             
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {e}")
@@ -47,18 +88,21 @@ class MQTTService:
             self.client.disconnect()
             logger.info("Disconnected from MQTT broker")
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when the client receives a CONNACK response from the server"""
         if rc == 0:
             logger.info("Connected to MQTT broker successfully")
             # Subscribe to device topics
-            self.client.subscribe("peluprice/devices/+/status")
-            self.client.subscribe("peluprice/devices/+/heartbeat")
-            self.client.subscribe("peluprice/devices/+/data")
+            for topic in self.device_subscriptions():
+                self.client.subscribe(topic)
+            # Acks go to every process: only the one that sent the command tracks it
+            self.client.subscribe("peluprice/devices/+/ack")
+            if device_cache.broadcast_enabled:
+                self.client.subscribe(DEVICE_CACHE_TOPIC)
         else:
             logger.error(f"Failed to connect to MQTT broker, return code {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """Callback for when the client disconnects from the server"""
         if rc != 0:
             logger.warning("Unexpected disconnection from MQTT broker")
@@ -66,15 +110,25 @@ class MQTTService:
             logger.info("Disconnected from MQTT broker")
     
     def _on_message(self, client, userdata, msg):
-        """Callback for when a PUBLISH message is received from the server"""
+        """
+        Callback for when a PUBLISH message is received from the server.
+        Runs on the paho network thread, so payloads are only handed off here
+        and parsed by the ingestion workers.
+        """
         try:
             topic = msg.topic
-            payload = json.loads(msg.payload.decode())
-            logger.info(f"Received message on topic {topic}: {payload}")
+            logger.debug(f"Received message on topic {topic}")
             
             # Handle device messages
-            if topic.startswith("peluprice/devices/"):
-                self._handle_device_message(topic, payload)
+            if topic.startswith("peluprice/devices/") and topic.endswith("/ack"):
+                # Command acks are cheap and latency sensitive, handle them here
+                device_id = topic.split("/")[2]
+                if not broadcast_service.handle_ack(device_id, msg.payload):
+                    command_dispatcher.handle_ack(device_id, msg.payload)
+            elif topic.startswith("peluprice/devices/"):
+                self._handle_device_message(topic, msg.payload)
+            elif topic == DEVICE_CACHE_TOPIC:
+                device_cache.handle_message(msg.payload)
                 
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
@@ -83,19 +137,10 @@ class MQTTService:
         """Callback for when a message is published"""
         logger.debug(f"Message {mid} published successfully")
     
-    def _handle_device_message(self, topic: str, payload: dict):
-        """Handle messages from devices"""
-        # Extract device ID from topic: peluprice/devices/{device_id}/status
-        parts = topic.split("/")
-        if len(parts) >= 3:
-            device_id = parts[2]
-            message_type = parts[3] if len(parts) > 3 else "unknown"
-            
-            logger.info(f"Device {device_id} sent {message_type}: {payload}")
-            
-            # TODO: Update device status in database
-            # TODO: Trigger alerts if needed
-            # TODO: Store device data
+    def _handle_device_message(self, topic: str, payload: bytes):
+        """Queue heartbeat, status and data messages from devices for batched ingestion"""
+        if not self.ingestor.submit(topic, payload):
+            logger.debug(f"Device message on {topic} was not queued")
     
     def publish_to_device(self, device_id: str, command: dict):
         """Publish a command to a specific device"""
@@ -104,7 +149,7 @@ class MQTTService:
             return False
             
         topic = f"peluprice/devices/{device_id}/commands"
-        payload = json.dumps({
+        payload = dumps({
             **command,
             "timestamp": datetime.utcnow().isoformat(),
             "source": "backend"
@@ -122,13 +167,24 @@ class MQTTService:
             logger.error(f"Error publishing command to device {device_id}: {e}")
             return False
     
+    def publish_internal(self, topic: str, payload: bytes) -> bool:
+        """Publish a backend-to-backend message, e.g. cache invalidations"""
+        return self.publish_raw(topic, payload)
+    
+    def publish_raw(self, topic: str, payload: bytes, qos: int = 1) -> bool:
+        """Publish an already serialized payload; used to send one payload to many topics"""
+        if not self.client:
+            return False
+        result = self.client.publish(topic, payload, qos=qos)
+        return result.rc == mqtt.MQTT_ERR_SUCCESS
+    
     def publish_notification(self, topic: str, message: dict):
         """Publish a notification message"""
         if not self.client:
             logger.error("MQTT client not connected")
             return False
             
-        payload = json.dumps({
+        payload = dumps({
             **message,
             "timestamp": datetime.utcnow().isoformat()
         })
@@ -0,0 +1,62 @@
+import os
+import json
+import base64
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from fastapi import Request, Response
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+MAX_PAGE_SIZE = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+class InvalidCursorError(ValueError):
+    """Raised for a cursor that was not issued by the same listing"""
+
+def page_size(limit: Optional[int]) -> int:
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE"""
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(kind: str, key: Any) -> str:
+    """Opaque cursor holding the sort key of the last row on a page"""
+    raw = json.dumps({"k": kind, "v": key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(kind: str, cursor: Optional[str], key_type: type) -> Optional[Any]:
+    """Sort key of type key_type (int or str) from a cursor, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursorError("Invalid cursor")
+    if not isinstance(data, dict) or data.get("k") != kind:
+        raise InvalidCursorError("Invalid cursor")
+    key = data.get("v")
+    # bool is an int; NUL cannot be sent to Postgres in a string
+    if not isinstance(key, key_type) or isinstance(key, bool) or (isinstance(key, str) and "\x00" in key):
+        raise InvalidCursorError("Invalid cursor")
+    return key
+
+def paginate(rows: Sequence, limit: int, kind: str, key: Callable[[Any], Any]) -> Tuple[List, Optional[str]]:
+    """
+    Split rows fetched with LIMIT limit + 1 into the page and the cursor for
+    the next one (None on the last page).
+    """
+    if len(rows) <= limit:
+        return list(rows), None
+    page = list(rows[:limit])
+    return page, encode_cursor(kind, key(page[-1]))
+
+def set_next_cursor(request: Request, response: Response, cursor: Optional[str]):
+    """
+    Advertise the next page in headers so list responses keep their plain
+    array body: X-Next-Cursor plus an RFC 8288 Link header.
+    """
+    if cursor is None:
+        return
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    next_url = request.url.include_query_params(cursor=cursor)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from app.services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hash operations running or waiting before new ones are rejected with 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(PASSWORD_HASH_WORKERS * 4)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))  # seconds
+
+# Hashes with a different cost factor verify fine but are reported as needing an update
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+class HasherBusyError(Exception):
+    """Raised when too many password hash operations are already queued"""
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated process pool so hashing neither holds the GIL
+    nor monopolises the request threadpool. At most max_queue operations may
+    be running or waiting; beyond that callers fail fast with HasherBusyError.
+    A caller waiting longer than timeout also gets HasherBusyError, while
+    its operation keeps its slot until the pool has finished it.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+        timeout: float = PASSWORD_HASH_TIMEOUT,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._depth_lock = threading.Lock()
+
+        # Metrics
+        self.depth = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self.hash_latency = Histogram()
+        self.verify_latency = Histogram()
+
+    def start(self):
+        """Create the worker pool (otherwise created on first use)"""
+        self._get_executor()
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        with self._executor_lock:
+            if self._executor:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn, not fork: the API process runs background threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"Password hasher pool started with {self.workers} workers")
+            return self._executor
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusyError("Password hashing queue is full")
+        with self._depth_lock:
+            self.depth += 1
+
+    def _release(self):
+        with self._depth_lock:
+            self.depth -= 1
+        self._slots.release()
+
+    def _run(self, histogram: Histogram, fn, *args):
+        self._acquire()
+        started = time.perf_counter()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        # Released when the pool is done with it, not when the caller gives up
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            # Not started yet: drop it so the slot frees up right away
+            future.cancel()
+            raise HasherBusyError("Password hashing timed out")
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    def hash(self, password: str) -> str:
+        """Hash a password with the configured cost factor"""
+        return self._run(self.hash_latency, _hash, password)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password. Returns (valid, new_hash) where new_hash is set when
+        the stored hash uses an outdated cost factor and should be replaced.
+        """
+        return self._run(self.verify_latency, _verify_and_update, password, hashed)
+
+    def stats(self) -> dict:
+        """Return queue depth and latency metrics"""
+        return {
+            "workers": self.workers,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "queue_depth": self.depth,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rehashed": self.rehashed,
+            "hash_latency_seconds": self.hash_latency.snapshot(),
+            "verify_latency_seconds": self.verify_latency.snapshot(),
+        }
+
+# Global password hasher instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,211 @@
+import os
+import csv
+import json
+import time
+import hmac
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app import models
+
+# Shared secret for factory provisioning; provisioning is disabled when unset
+PROVISIONING_TOKEN = os.getenv("PROVISIONING_TOKEN", "")
+PROVISIONING_BATCH_SIZE = int(os.getenv("PROVISIONING_BATCH_SIZE", "1000"))
+# Per-row problems listed in a report; further ones are only counted
+PROVISIONING_MAX_REPORTED = int(os.getenv("PROVISIONING_MAX_REPORTED", "10000"))
+
+PROVISIONING_FIELDS = ("device_id", "activation_key", "firmware_version", "hardware_version", "name")
+
+def check_provisioning_token(token: Optional[str]) -> bool:
+    """Constant-time check of a provisioning token"""
+    return bool(PROVISIONING_TOKEN) and token is not None and hmac.compare_digest(token, PROVISIONING_TOKEN)
+
+class RecordParser:
+    """
+    Parses an upload line by line, either CSV with a header row or NDJSON
+    (one JSON object per line). CSV fields may not contain line breaks.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported format {fmt}")
+        self.fmt = fmt
+        self._header: Optional[List[str]] = None
+
+    def feed(self, line: str) -> Tuple[Optional[dict], Optional[str]]:
+        """Returns (record, None), (None, error), or (None, None) for lines without data"""
+        line = line.strip()
+        if not line:
+            return None, None
+
+        if self.fmt == "ndjson":
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                return None, f"invalid JSON: {e}"
+            if not isinstance(record, dict):
+                return None, "invalid JSON: expected an object"
+        else:
+            values = next(csv.reader([line]))
+            if self._header is None:
+                self._header = [value.strip() for value in values]
+                missing = {"device_id", "activation_key"} - set(self._header)
+                if missing:
+                    raise ValueError(f"CSV header is missing {', '.join(sorted(missing))}")
+                return None, None
+            if len(values) != len(self._header):
+                return None, f"expected {len(self._header)} columns, got {len(values)}"
+            record = dict(zip(self._header, values))
+
+        device_id = str(record.get("device_id") or "").strip()
+        activation_key = str(record.get("activation_key") or "").strip()
+        if not device_id or not activation_key:
+            return None, "device_id and activation_key are required"
+
+        parsed = {"device_id": device_id, "activation_key": activation_key}
+        for field in PROVISIONING_FIELDS[2:]:
+            value = record.get(field)
+            parsed[field] = (str(value).strip() or None) if value is not None else None
+        return parsed, None
+
+class ProvisioningReport:
+    """Outcome of a provisioning run: counts, per-row problems and throughput"""
+
+    def __init__(self, max_reported: int = PROVISIONING_MAX_REPORTED):
+        self.max_reported = max_reported
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.received = 0
+        self.inserted = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self.batches = 0
+        self.problems: List[dict] = []
+        self.truncated = False
+
+    def problem(self, line: int, reason: str, device_id: Optional[str] = None):
+        if len(self.problems) < self.max_reported:
+            self.problems.append({"line": line, "device_id": device_id, "reason": reason})
+        else:
+            self.truncated = True
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "conflicts": self.conflicts,
+            "invalid": self.invalid,
+            "batches": self.batches,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.received / elapsed, 1) if elapsed > 0 else None,
+            "problems": sorted(self.problems, key=lambda problem: problem["line"]),
+            "problems_truncated": self.truncated,
+        }
+
+class DeviceProvisioner:
+    """
+    Loads provisioning records in batches with one multi-row
+    INSERT ... ON CONFLICT DO NOTHING RETURNING id per batch, committed per
+    batch. Rows that were not inserted are reported with the reason: the
+    device id or activation key already exists, or it repeats an earlier row
+    of the same upload.
+    """
+
+    def __init__(self, db: Session, batch_size: int = PROVISIONING_BATCH_SIZE, report: Optional[ProvisioningReport] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.report = report or ProvisioningReport()
+        self._batch: List[Tuple[int, dict]] = []
+        self._seen_ids: Set[str] = set()
+        self._seen_keys: Set[str] = set()
+
+    @property
+    def full(self) -> bool:
+        """True when the queued batch should be flushed"""
+        return len(self._batch) >= self.batch_size
+
+    def add(self, line: int, record: Optional[dict], error: Optional[str] = None):
+        """Queue one parsed line; call flush() once the batch is full"""
+        if record is None and error is None:
+            return
+        self.report.received += 1
+        if error is not None:
+            self.report.invalid += 1
+            self.report.problem(line, f"invalid: {error}")
+            return
+
+        device_id, activation_key = record["device_id"], record["activation_key"]
+        if device_id in self._seen_ids or activation_key in self._seen_keys:
+            self.report.conflicts += 1
+            self.report.problem(line, "duplicate_in_upload", device_id)
+            return
+        self._seen_ids.add(device_id)
+        self._seen_keys.add(activation_key)
+
+        self._batch.append((line, record))
+
+    def flush(self):
+        """Insert the queued batch"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": record["device_id"],
+                "activation_key": record["activation_key"],
+                "name": record["name"],
+                "firmware_version": record["firmware_version"],
+                "hardware_version": record["hardware_version"],
+                "status": models.DeviceStatus.DEPLOYED,
+                "is_active": False,
+                "created_at": now,
+                "last_seen": now,
+            }
+            for _, record in batch
+        ]
+        stmt = pg_insert(models.Device).values(rows).on_conflict_do_nothing().returning(models.Device.id)
+        try:
+            inserted = set(self.db.execute(stmt).scalars().all())
+            rejected = [(line, record) for line, record in batch if record["device_id"] not in inserted]
+            existing_ids: Set[str] = set()
+            if rejected:
+                # Which constraint rejected them: id first, otherwise the activation key
+                ids = [record["device_id"] for _, record in rejected]
+                existing_ids = set(self.db.execute(
+                    select(models.Device.id).where(models.Device.id.in_(ids))
+                ).scalars().all())
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        self.report.batches += 1
+        self.report.inserted += len(inserted)
+        self.report.conflicts += len(rejected)
+        for line, record in rejected:
+            reason = "device_id_exists" if record["device_id"] in existing_ids else "activation_key_exists"
+            self.report.problem(line, reason, record["device_id"])
+
+    def finish(self) -> ProvisioningReport:
+        """Flush the last batch and close the report"""
+        self.flush()
+        self.report.finish()
+        return self.report
+
+def provision_lines(db: Session, lines: Iterable[str], fmt: str, batch_size: int = PROVISIONING_BATCH_SIZE) -> ProvisioningReport:
+    """Provision every record of a CSV or NDJSON upload"""
+    parser = RecordParser(fmt)
+    provisioner = DeviceProvisioner(db, batch_size=batch_size)
+    for line_no, line in enumerate(lines, start=1):
+        record, error = parser.feed(line)
+        provisioner.add(line_no, record, error)
+        if provisioner.full:
+            provisioner.flush()
+    return provisioner.finish()
@@ -0,0 +1,192 @@
+import os
+import logging
+import threading
+from itertools import count
+from typing import List, Optional
+from jose import JWTError, jwt
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.database import SessionLocal, replica_engines
+from app.services.cache import LRUTTLCache
+
+logger = logging.getLogger(__name__)
+
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "5.0"))  # seconds
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+# How long a user's reads go to the primary after they wrote something
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_STICKY_MAX_USERS = int(os.getenv("REPLICA_STICKY_MAX_USERS", "100000"))
+
+# Zero when the replica has replayed everything it received, so an idle
+# primary does not look like replication lag
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class Replica:
+    """A read replica engine with its health state and counters"""
+
+    def __init__(self, index: int, engine: Engine):
+        self.index = index
+        self.engine = engine
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Unhealthy until the first health check passes
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.reads = 0
+        self.errors = 0
+
+        # A connection failure in any request takes the replica out of rotation
+        # right away instead of waiting for the next health check
+        @event.listens_for(engine, "handle_error")
+        def _on_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_unhealthy(context.original_exception)
+
+    def mark_unhealthy(self, reason):
+        if self.healthy:
+            logger.warning(f"Read replica {self.index} marked unhealthy: {reason}")
+        self.healthy = False
+        self.errors += 1
+
+class ReplicaRouter:
+    """
+    Routes read-only sessions to the read replicas, round-robin over the
+    healthy ones, and falls back to the primary when none are available.
+
+    Replicas are checked periodically and dropped from rotation when they are
+    unreachable or lag more than max_lag seconds. Users who wrote something
+    in the last sticky_seconds read from the primary so they see their own
+    changes. Stickiness is tracked per worker process; the window should
+    cover the replication lag tolerated by max_lag.
+    """
+
+    def __init__(
+        self,
+        engines: List[Engine] = replica_engines,
+        primary_factory=SessionLocal,
+        check_interval: float = REPLICA_HEALTH_CHECK_INTERVAL,
+        max_lag: float = REPLICA_MAX_LAG_SECONDS,
+        sticky_seconds: float = REPLICA_STICKY_SECONDS,
+    ):
+        self.replicas = [Replica(index, engine) for index, engine in enumerate(engines)]
+        self.primary_factory = primary_factory
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._sticky = LRUTTLCache(max_size=REPLICA_STICKY_MAX_USERS, ttl=sticky_seconds)
+        self._next = count()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def mark_write(self, subject: Optional[str]):
+        """Pin a user's reads to the primary for the sticky window"""
+        if subject and self.enabled:
+            self._sticky.set(subject, True)
+
+    def read_session(self, subject: Optional[str] = None) -> Session:
+        """Open a session for read-only work"""
+        if not self.enabled:
+            self.primary_reads += 1
+            return self.primary_factory()
+
+        if subject and self._sticky.get(subject):
+            self.sticky_reads += 1
+            return self.primary_factory()
+
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            self.fallbacks += 1
+            return self.primary_factory()
+
+        replica = healthy[next(self._next) % len(healthy)]
+        replica.reads += 1
+        db = replica.session_factory()
+        db.info["replica"] = replica.index
+        return db
+
+    def check(self):
+        """Probe every replica for reachability and replication lag"""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    lag = float(connection.execute(REPLICA_LAG_QUERY).scalar() or 0)
+            except Exception as e:
+                replica.lag_seconds = None
+                replica.mark_unhealthy(e)
+                continue
+
+            replica.lag_seconds = lag
+            if lag > self.max_lag:
+                replica.mark_unhealthy(f"replication lag {lag:.1f}s")
+            elif not replica.healthy:
+                logger.info(f"Read replica {replica.index} is healthy (lag {lag:.1f}s)")
+                replica.healthy = True
+
+    def start(self):
+        """Start the health check thread (no-op without replicas)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the health check thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self.check_interval * 2)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Replica health check failed: {e}")
+            if self._stopping.wait(self.check_interval):
+                break
+
+    def stats(self) -> dict:
+        """Return per-replica health and routing counters"""
+        return {
+            "replicas": [
+                {
+                    "index": replica.index,
+                    "healthy": replica.healthy,
+                    "lag_seconds": replica.lag_seconds,
+                    "reads": replica.reads,
+                    "errors": replica.errors,
+                }
+                for replica in self.replicas
+            ],
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "fallbacks": self.fallbacks,
+            "sticky_users": self._sticky.stats()["size"],
+        }
+
+def request_subject(authorization: Optional[str]) -> Optional[str]:
+    """
+    Token subject from an Authorization header, for routing only. The
+    signature is not checked here; authentication still happens in the route.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.get_unverified_claims(authorization[7:]).get("sub")
+    except JWTError:
+        return None
+
+# Global replica router instance
+replica_router = ReplicaRouter()
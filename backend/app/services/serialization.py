@@ -0,0 +1,106 @@
+import os
+import json
+import logging
+from datetime import date, datetime
+from enum import Enum
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Optional
+from uuid import UUID
+from fastapi.responses import JSONResponse, Response
+from app import schemas
+
+logger = logging.getLogger(__name__)
+
+# auto picks orjson, then msgspec, then the standard library
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+
+def _default(value: Any):
+    """Types the standard library encoder does not know about"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _stdlib_dumps(content: Any) -> bytes:
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+def _load_backend(name: str):
+    """Return (backend name, dumps function), falling back to the standard library"""
+    candidates = ("orjson", "msgspec") if name == "auto" else (name,)
+    for candidate in candidates:
+        if candidate == "stdlib":
+            break
+        try:
+            if candidate == "orjson":
+                import orjson
+
+                options = orjson.OPT_NON_STR_KEYS
+
+                def dumps(content: Any) -> bytes:
+                    return orjson.dumps(content, default=_default, option=options)
+
+                return "orjson", dumps
+            if candidate == "msgspec":
+                import msgspec
+
+                # One reusable encoder instead of a new one per call
+                encoder = msgspec.json.Encoder(enc_hook=_default)
+                return "msgspec", encoder.encode
+        except ImportError:
+            if name != "auto":
+                logger.warning(f"JSON_BACKEND={name} is not installed, using the standard library")
+    return "stdlib", _stdlib_dumps
+
+json_backend, dumps = _load_backend(JSON_BACKEND)
+
+class FastJSONResponse(JSONResponse):
+    """Default response class, rendering with the configured JSON backend"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class ModelSerializer:
+    """
+    Precompiled serializer for a response schema. Reads the schema's fields
+    straight off ORM rows (or pydantic instances) with a single attrgetter and
+    encodes them with the JSON backend, skipping pydantic validation and
+    jsonable_encoder. Only for rows that already satisfy the schema.
+    """
+
+    def __init__(self, schema: type, defaults: Optional[Dict[str, Any]] = None):
+        self.schema = schema
+        self.fields = tuple(schema.model_fields)
+        self._getter: Callable[[Any], tuple] = attrgetter(*self.fields)
+        # Replacements for NULL columns the schema does not allow
+        self._defaults = [(i, defaults[field]) for i, field in enumerate(self.fields) if field in (defaults or {})]
+
+    def to_dict(self, obj: Any) -> dict:
+        values = self._getter(obj)
+        if self._defaults:
+            values = list(values)
+            for i, default in self._defaults:
+                if values[i] is None:
+                    values[i] = default
+        return dict(zip(self.fields, values))
+
+    def dumps(self, obj: Any) -> bytes:
+        return dumps(self.to_dict(obj))
+
+    def dumps_many(self, objs: Iterable[Any]) -> bytes:
+        return dumps([self.to_dict(obj) for obj in objs])
+
+    def response(self, obj: Any, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+        """A ready JSON response for one object"""
+        return Response(self.dumps(obj), status_code=status_code, headers=headers, media_type="application/json")
+
+    def response_many(self, objs: Iterable[Any], headers: Optional[dict] = None) -> Response:
+        """A ready JSON response for a list of objects"""
+        return Response(self.dumps_many(objs), headers=headers, media_type="application/json")
+
+device_serializer = ModelSerializer(schemas.Device, defaults={"status": "DEPLOYED", "is_active": False})
+user_serializer = ModelSerializer(schemas.User)
@@ -0,0 +1,433 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app import models
+from app.database import SessionLocal
+from app.services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "5.0"))  # seconds
+TELEMETRY_FLUSH_MAX_BATCH = int(os.getenv("TELEMETRY_FLUSH_MAX_BATCH", "2000"))
+TELEMETRY_MAX_PENDING = int(os.getenv("TELEMETRY_MAX_PENDING", "100000"))
+TELEMETRY_MAINTENANCE_INTERVAL = float(os.getenv("TELEMETRY_MAINTENANCE_INTERVAL", "3600"))  # seconds
+
+TELEMETRY_FIELDS = ("signal_strength", "battery_level", "ip_address")
+TELEMETRY_METRICS = {"battery_level": "battery", "signal_strength": "signal"}
+
+# Expected spacing of raw samples (firmware HEARTBEAT_INTERVAL)
+TELEMETRY_RAW_SAMPLE_SECONDS = int(os.getenv("TELEMETRY_RAW_SAMPLE_SECONDS", "30"))
+
+class TelemetryTable:
+    """A time-partitioned telemetry table and its partition/retention policy"""
+
+    def __init__(self, model, time_column: str, span: str, retention_days: int, bucket_seconds: Optional[int] = None):
+        self.model = model
+        self.table = model.__table__
+        self.name = model.__tablename__
+        self.time_column = time_column
+        self.span = span  # "day", "month" or "year"
+        self.retention_days = retention_days
+        self.bucket_seconds = bucket_seconds  # None for the raw table
+
+    def partition_start(self, when: datetime) -> datetime:
+        if self.span == "day":
+            return datetime(when.year, when.month, when.day)
+        if self.span == "month":
+            return datetime(when.year, when.month, 1)
+        return datetime(when.year, 1, 1)
+
+    def partition_end(self, start: datetime) -> datetime:
+        if self.span == "day":
+            return start + timedelta(days=1)
+        if self.span == "month":
+            return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return datetime(start.year + 1, 1, 1)
+
+    def partition_name(self, start: datetime) -> str:
+        fmt = {"day": "%Y%m%d", "month": "%Y%m", "year": "%Y"}[self.span]
+        return f"{self.name}_p{start.strftime(fmt)}"
+
+    def parse_partition_name(self, partition: str) -> Optional[datetime]:
+        prefix = f"{self.name}_p"
+        if not partition.startswith(prefix):
+            return None
+        fmt = {"day": "%Y%m%d", "month": "%Y%m", "year": "%Y"}[self.span]
+        try:
+            return datetime.strptime(partition[len(prefix):], fmt)
+        except ValueError:
+            return None
+
+    def bucket(self, when: datetime) -> datetime:
+        seconds = int((when - datetime(1970, 1, 1)).total_seconds())
+        return datetime(1970, 1, 1) + timedelta(seconds=seconds - seconds % self.bucket_seconds)
+
+RAW_TABLE = TelemetryTable(
+    models.DeviceTelemetry, "recorded_at", "day",
+    int(os.getenv("TELEMETRY_RAW_RETENTION_DAYS", "7")),
+)
+ROLLUP_TABLES = {
+    "1m": TelemetryTable(
+        models.DeviceTelemetry1m, "bucket_start", "day",
+        int(os.getenv("TELEMETRY_1M_RETENTION_DAYS", "30")), bucket_seconds=60,
+    ),
+    "1h": TelemetryTable(
+        models.DeviceTelemetry1h, "bucket_start", "month",
+        int(os.getenv("TELEMETRY_1H_RETENTION_DAYS", "400")), bucket_seconds=3600,
+    ),
+    "1d": TelemetryTable(
+        models.DeviceTelemetry1d, "bucket_start", "year",
+        int(os.getenv("TELEMETRY_1D_RETENTION_DAYS", "1830")), bucket_seconds=86400,
+    ),
+}
+TELEMETRY_TABLES = [RAW_TABLE] + list(ROLLUP_TABLES.values())
+
+_known_partitions: Set[str] = set()
+
+def ensure_partitions(db: Session, start: datetime, end: datetime):
+    """Create the partitions of every telemetry table covering [start, end]"""
+    for spec in TELEMETRY_TABLES:
+        partition_start = spec.partition_start(start)
+        while partition_start <= end:
+            partition_end = spec.partition_end(partition_start)
+            name = spec.partition_name(partition_start)
+            if name not in _known_partitions:
+                db.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {spec.name} "
+                    f"FOR VALUES FROM ('{partition_start.isoformat()}') TO ('{partition_end.isoformat()}')"
+                ))
+                _known_partitions.add(name)
+            partition_start = partition_end
+
+def drop_expired_partitions(db: Session, now: Optional[datetime] = None) -> List[str]:
+    """
+    Enforce retention by dropping whole partitions that ended before the
+    retention window, instead of deleting rows. Returns the dropped names.
+    """
+    now = now or datetime.utcnow()
+    dropped = []
+    for spec in TELEMETRY_TABLES:
+        cutoff = now - timedelta(days=spec.retention_days)
+        partitions = db.execute(text("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+        """), {"table": spec.name}).scalars().all()
+        for partition in partitions:
+            start = spec.parse_partition_name(partition)
+            if start is not None and spec.partition_end(start) <= cutoff:
+                db.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+                _known_partitions.discard(partition)
+                dropped.append(partition)
+    return dropped
+
+def insert_samples(db: Session, samples: List[dict]) -> List[dict]:
+    """
+    Append raw samples with a multi-row INSERT. Returns the rows actually
+    inserted, so redelivered samples are left out. Does not commit.
+    """
+    if not samples:
+        return []
+    table = RAW_TABLE.table
+    statement = pg_insert(table).values(samples).on_conflict_do_nothing().returning(*table.c)
+    return [dict(row._mapping) for row in db.execute(statement)]
+
+def aggregate_samples(spec: TelemetryTable, samples: List[dict]) -> List[dict]:
+    """Pre-aggregate samples into one rollup row per (device, bucket)"""
+    rollups: Dict[Tuple[str, datetime], dict] = {}
+    for sample in samples:
+        key = (sample["device_id"], spec.bucket(sample["recorded_at"]))
+        row = rollups.get(key)
+        if row is None:
+            row = rollups[key] = {
+                "device_id": key[0], "bucket_start": key[1], "samples": 0,
+                "battery_count": 0, "battery_sum": 0, "battery_min": None, "battery_max": None,
+                "signal_count": 0, "signal_sum": 0, "signal_min": None, "signal_max": None,
+            }
+        row["samples"] += 1
+        for prefix, field in (("battery", "battery_level"), ("signal", "signal_strength")):
+            value = sample.get(field)
+            if value is None:
+                continue
+            row[f"{prefix}_count"] += 1
+            row[f"{prefix}_sum"] += value
+            current_min = row[f"{prefix}_min"]
+            current_max = row[f"{prefix}_max"]
+            row[f"{prefix}_min"] = value if current_min is None else min(current_min, value)
+            row[f"{prefix}_max"] = value if current_max is None else max(current_max, value)
+    return list(rollups.values())
+
+def upsert_rollups(db: Session, samples: List[dict]) -> int:
+    """
+    Fold samples into the 1m/1h/1d rollups with one upsert per resolution.
+    Only pass rows insert_samples() returned, or duplicates are counted twice.
+    Does not commit.
+    """
+    written = 0
+    for spec in ROLLUP_TABLES.values():
+        rows = aggregate_samples(spec, samples)
+        if not rows:
+            continue
+        table = spec.table
+        statement = pg_insert(table).values(rows)
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.device_id, table.c.bucket_start],
+            set_={
+                "samples": table.c.samples + excluded.samples,
+                "battery_count": table.c.battery_count + excluded.battery_count,
+                "battery_sum": table.c.battery_sum + excluded.battery_sum,
+                "battery_min": func.least(table.c.battery_min, excluded.battery_min),
+                "battery_max": func.greatest(table.c.battery_max, excluded.battery_max),
+                "signal_count": table.c.signal_count + excluded.signal_count,
+                "signal_sum": table.c.signal_sum + excluded.signal_sum,
+                "signal_min": func.least(table.c.signal_min, excluded.signal_min),
+                "signal_max": func.greatest(table.c.signal_max, excluded.signal_max),
+            },
+        )
+        db.execute(statement)
+        written += len(rows)
+    return written
+
+def _as_int(value) -> Optional[int]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return int(value)
+
+def choose_resolution(start: datetime, end: datetime, max_points: int, now: Optional[datetime] = None) -> str:
+    """
+    Pick the coarsest resolution ("raw", "1m", "1h" or "1d") that still yields
+    at least max_points rows for the range, so downsampling has enough detail
+    to work with while reading as few rows as possible. Resolutions whose
+    retention no longer covers start are skipped.
+    """
+    now = now or datetime.utcnow()
+    span = max((end - start).total_seconds(), 1)
+    candidates = [("raw", RAW_TABLE, TELEMETRY_RAW_SAMPLE_SECONDS)] + [
+        (name, spec, spec.bucket_seconds) for name, spec in ROLLUP_TABLES.items()
+    ]
+    available = [
+        (name, step) for name, spec, step in candidates
+        if start >= now - timedelta(days=spec.retention_days)
+    ]
+    if not available:
+        return "1d"
+
+    chosen = available[0][0]
+    for name, step in available:
+        if span / step >= max_points:
+            chosen = name
+    return chosen
+
+def query_series(db: Session, device_id: str, metric: str, resolution: str, start: datetime, end: datetime):
+    """
+    Read a metric series for one device at the given resolution.
+    Returns (bucket_or_sample_time, avg, min, max) rows in time order.
+    """
+    prefix = TELEMETRY_METRICS[metric]
+    spec = RAW_TABLE if resolution == "raw" else ROLLUP_TABLES[resolution]
+    column = spec.time_column
+    if resolution == "raw":
+        values = f"{metric}, {metric}, {metric}"
+        has_value = f"{metric} IS NOT NULL"
+    else:
+        values = f"{prefix}_sum::float / {prefix}_count, {prefix}_min, {prefix}_max"
+        has_value = f"{prefix}_count > 0"
+    statement = text(f"""
+        SELECT {column}, {values}
+        FROM {spec.name}
+        WHERE device_id = :device_id AND {column} >= :start AND {column} < :end AND {has_value}
+        ORDER BY {column}
+    """)
+    return db.execute(statement, {"device_id": device_id, "start": start, "end": end}).all()
+
+class TelemetryWriter:
+    """
+    Buffered writer for the device telemetry store.
+
+    Samples are collected in memory and written by a background thread:
+    raw samples as multi-row INSERTs into the partitioned device_telemetry
+    table, plus incremental upserts of the 1m/1h/1d rollups, all in one
+    transaction. The same thread periodically creates upcoming partitions
+    and drops partitions that fell out of the retention window. Telemetry is
+    best effort: a batch that fails to write is counted as dropped.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = TELEMETRY_FLUSH_INTERVAL,
+        max_batch: int = TELEMETRY_FLUSH_MAX_BATCH,
+        max_pending: int = TELEMETRY_MAX_PENDING,
+        maintenance_interval: float = TELEMETRY_MAINTENANCE_INTERVAL,
+        enabled: bool = TELEMETRY_ENABLED,
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.maintenance_interval = maintenance_interval
+
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_maintenance = 0.0
+
+        # Metrics
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rows_written = 0
+        self.rollup_rows_written = 0
+        self.partitions_dropped = 0
+        self.flush_latency = Histogram()
+
+    def record(self, device_id: str, recorded_at: datetime, data: dict) -> bool:
+        """Queue one sample. Returns False if it carried no telemetry or was dropped."""
+        if not self.enabled:
+            return False
+        sample = {
+            "device_id": device_id,
+            "recorded_at": recorded_at,
+            "signal_strength": _as_int(data.get("signal_strength")),
+            "battery_level": _as_int(data.get("battery_level")),
+            "ip_address": data.get("ip_address"),
+        }
+        if all(sample[field] is None for field in TELEMETRY_FIELDS):
+            return False
+
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(sample)
+            self.recorded += 1
+            pending = len(self._pending)
+
+        if pending >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        """Start the background flush and maintenance thread"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and write out everything still pending"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=max(self.flush_interval * 2, 5.0))
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Final telemetry flush failed: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if time.monotonic() - self._last_maintenance >= self.maintenance_interval:
+                try:
+                    self.run_maintenance()
+                except Exception as e:
+                    logger.error(f"Telemetry maintenance failed: {e}")
+                self._last_maintenance = time.monotonic()
+
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Telemetry flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write pending samples and rollups. Returns the number of raw rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = []
+
+            started = time.perf_counter()
+            written = 0
+            db = self.session_factory()
+            try:
+                for i in range(0, len(batch), self.max_batch):
+                    chunk = batch[i:i + self.max_batch]
+                    times = [sample["recorded_at"] for sample in chunk]
+                    ensure_partitions(db, min(times), max(times))
+                    inserted = insert_samples(db, chunk)
+                    written += len(inserted)
+                    self.rollup_rows_written += upsert_rollups(db, inserted)
+                db.commit()
+            except Exception:
+                db.rollback()
+                self.flush_errors += 1
+                self.dropped += len(batch)
+                _known_partitions.clear()
+                raise
+            finally:
+                db.close()
+
+            self.flushes += 1
+            self.rows_written += written
+            self.flush_latency.observe(time.perf_counter() - started)
+            return written
+
+    def run_maintenance(self):
+        """Create today's and tomorrow's partitions and drop expired ones"""
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            ensure_partitions(db, now, now + timedelta(days=1))
+            dropped = drop_expired_partitions(db, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            _known_partitions.clear()
+            raise
+        finally:
+            db.close()
+
+        self.partitions_dropped += len(dropped)
+        if dropped:
+            logger.info(f"Dropped expired telemetry partitions: {', '.join(dropped)}")
+
+    def stats(self) -> dict:
+        """Return writer metrics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "rows_written": self.rows_written,
+            "rollup_rows_written": self.rollup_rows_written,
+            "partitions_dropped": self.partitions_dropped,
+            "flush_latency_seconds": self.flush_latency.snapshot(),
+        }
+
+# Global telemetry writer instance
+telemetry_writer = TelemetryWriter()
@@ -1,26 +1,48 @@
 
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app import models, schemas
-from passlib.context import CryptContext
+from app.auth.principal_cache import invalidate_principal
+from app.services.password_hasher import password_hasher
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+def verify_password_and_update(db: Session, user: models.User, plain_password: str) -> bool:
+    """
+    Verify a user's password and transparently rehash it when the stored
+    hash was made with a different bcrypt cost factor.
+    """
+    valid, new_hash = password_hasher.verify_and_update(plain_password, user.password_hash)
+    if valid and new_hash:
+        user.password_hash = new_hash
+        db.commit()
+        password_hasher.rehashed += 1
+    return valid
 
 def get_password_hash(password):
-    """Hash a password"""
-    return pwd_context.hash(password)
+    """Hash a password (runs in the password hasher pool)"""
+    return password_hasher.hash(password)
 
 def get_user(db: Session, user_id: int):
     """Get user by ID"""
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+def get_users_page(db: Session, limit: int, after_id: Optional[int] = None):
+    """Get up to limit + 1 users ordered by id, starting after after_id (primary key scan)"""
+    query = select(models.User)
+    if after_id is not None:
+        query = query.where(models.User.id > after_id)
+    return db.execute(query.order_by(models.User.id).limit(limit + 1)).scalars().all()
+
 def get_user_by_email(db: Session, email: str):
     """Get user by email"""
     return db.query(models.User).filter(models.User.email == email).first()
 
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    """Get user by email (async session)"""
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
 def create_user(db: Session, user: schemas.UserCreate):
     """Create a new user"""
     hashed_password = get_password_hash(user.password)
@@ -49,4 +71,5 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     
     db.commit()
     db.refresh(db_user)
+    invalidate_principal(db_user.email)
     return db_user
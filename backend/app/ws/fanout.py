@@ -0,0 +1,378 @@
+import os
+import json
+import uuid
+import queue
+import time
+import select
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from app.services.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# local: single process; mqtt: relay through the Mosquitto broker;
+# postgres: relay with LISTEN/NOTIFY on the primary database
+WS_FANOUT = os.getenv("WS_FANOUT", "local").lower()
+WS_FANOUT_TOPIC = os.getenv("WS_FANOUT_TOPIC", "peluprice/internal/device-events")
+WS_FANOUT_CHANNEL = os.getenv("WS_FANOUT_CHANNEL", "device_events")
+# LISTEN needs a session-pooled or direct connection, not PgBouncer transaction pooling
+WS_FANOUT_DATABASE_URL = os.getenv("WS_FANOUT_DATABASE_URL")
+WS_FANOUT_QUEUE_SIZE = int(os.getenv("WS_FANOUT_QUEUE_SIZE", "1000"))
+# How often each worker re-announces the devices it has subscribers for;
+# other workers stop relaying a device after three missed announcements
+WS_FANOUT_INTEREST_INTERVAL = float(os.getenv("WS_FANOUT_INTEREST_INTERVAL", "10"))  # seconds
+
+# NOTIFY payloads must stay below 8000 bytes
+NOTIFY_MAX_PAYLOAD = 7900
+RECONNECT_DELAY = 2.0  # seconds
+
+DeviceEvent = Tuple[str, dict]
+Deliver = Callable[[List[DeviceEvent]], None]
+Interest = Callable[[], List[str]]
+
+class LocalFanout:
+    """
+    Fan-out backend for a single worker: nothing to relay.
+
+    Relaying backends only send a worker's events for devices that another
+    worker has subscribers for, so the relayed volume follows the watched
+    devices rather than the whole fleet. Each worker announces the device
+    ids it watches when a socket connects and every interest_interval
+    seconds; a new worker asks the others to announce theirs. Activation
+    events, which carry an owner_id, are always relayed.
+    """
+
+    name = "local"
+    relays = False
+
+    def __init__(self, interest_interval: float = WS_FANOUT_INTEREST_INTERVAL):
+        self.origin = uuid.uuid4().hex
+        self.interest_interval = interest_interval
+        self._deliver: Optional[Deliver] = None
+        self._interest: Optional[Interest] = None
+        # device id -> monotonic time until which another worker watches it
+        self._remote: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._announcing = threading.Event()
+        self._announcer: Optional[threading.Thread] = None
+
+        # Metrics
+        self.sent = 0
+        self.received = 0
+        self.filtered = 0
+        self.announced = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self, deliver: Deliver, interest: Optional[Interest] = None):
+        """
+        Start relaying; deliver receives event batches published by other
+        workers and interest() lists the devices watched on this worker.
+        """
+        self._deliver = deliver
+        self._interest = interest
+        if self.relays:
+            self._announcing.clear()
+            self._announcer = threading.Thread(target=self._announce_loop, name="ws-fanout-interest", daemon=True)
+            self._announcer.start()
+
+    def stop(self):
+        self._announcing.set()
+        if self._announcer:
+            self._announcer.join(timeout=5.0)
+            self._announcer = None
+        self._deliver = None
+
+    def publish(self, events: List[DeviceEvent]):
+        """Relay the events another worker has subscribers for"""
+        if not self.relays or not events:
+            return
+        now = time.monotonic()
+        with self._lock:
+            relayed = [
+                (device_id, event) for device_id, event in events
+                if event.get("owner_id") is not None or self._remote.get(device_id, 0) > now
+            ]
+        self.filtered += len(events) - len(relayed)
+        if relayed:
+            self._relay("events", relayed)
+
+    def announce(self, device_ids: List[str]):
+        """Tell the other workers this worker has subscribers for these devices"""
+        if not self.relays or not device_ids:
+            return
+        self._relay("interest", list(device_ids))
+        self.announced += len(device_ids)
+
+    def _on_ready(self):
+        # Ask the other workers for their interest and announce ours
+        self._relay("hello", [])
+        self.announce(self._local_interest())
+
+    def _local_interest(self) -> List[str]:
+        return self._interest() if self._interest is not None else []
+
+    def _announce_loop(self):
+        while not self._announcing.wait(self.interest_interval):
+            now = time.monotonic()
+            with self._lock:
+                for device_id in [device_id for device_id, until in self._remote.items() if until <= now]:
+                    del self._remote[device_id]
+            try:
+                self.announce(self._local_interest())
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Failed to announce WebSocket interest: {e}")
+
+    def _relay(self, kind: str, items: list):
+        """Send one message to the other workers; implemented by relaying backends"""
+
+    def encode(self, kind: str, items: list) -> bytes:
+        return dumps({"origin": self.origin, kind: items})
+
+    def receive(self, payload) -> int:
+        """Handle a message from another worker. Returns the number of events delivered."""
+        try:
+            message = json.loads(payload)
+            if message.get("origin") == self.origin:
+                return 0
+            if "interest" in message:
+                until = time.monotonic() + 3 * self.interest_interval
+                with self._lock:
+                    for device_id in message["interest"]:
+                        self._remote[str(device_id)] = until
+                return 0
+            if "hello" in message:
+                self.announce(self._local_interest())
+                return 0
+            events = [(device_id, event) for device_id, event in message["events"]]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.errors += 1
+            logger.warning("Ignoring malformed fan-out message")
+            return 0
+        if self._deliver is None:
+            return 0
+        self.received += len(events)
+        self._deliver(events)
+        return len(events)
+
+    def stats(self) -> dict:
+        with self._lock:
+            remote = len(self._remote)
+        return {
+            "backend": self.name,
+            "sent": self.sent,
+            "received": self.received,
+            # Events not relayed because no other worker watches the device
+            "filtered": self.filtered,
+            "announced": self.announced,
+            "remote_devices": remote,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+class MQTTFanout(LocalFanout):
+    """
+    Relays event batches over the Mosquitto broker on a non-retained QoS 0
+    topic. Uses its own client connection with a per-process client id.
+    client_factory(client_id) may return any paho-compatible client.
+    """
+
+    name = "mqtt"
+    relays = True
+
+    def __init__(self, topic: str = WS_FANOUT_TOPIC, client_factory: Optional[Callable] = None):
+        super().__init__()
+        self.topic = topic
+        self.client_factory = client_factory or self._paho_client
+        self.client = None
+
+    @staticmethod
+    def _paho_client(client_id: str):
+        import paho.mqtt.client as mqtt
+
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id)
+        else:
+            client = mqtt.Client(client_id=client_id)
+        username = os.getenv("MQTT_USERNAME", "peluprice")
+        password = os.getenv("MQTT_PASSWORD", "peluprice123")
+        if username and password:
+            client.username_pw_set(username, password)
+        return client
+
+    def start(self, deliver: Deliver, interest: Optional[Interest] = None):
+        super().start(deliver, interest)
+        client_id = f"{os.getenv('MQTT_CLIENT_ID', 'peluprice-backend')}-fanout-{self.origin[:8]}"
+        self.client = self.client_factory(client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        try:
+            self.client.connect_async(os.getenv("MQTT_HOST", "localhost"), int(os.getenv("MQTT_PORT", "1883")), 60)
+            self.client.loop_start()
+            logger.info(f"WebSocket fan-out relaying over MQTT topic {self.topic}")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to start MQTT WebSocket fan-out: {e}")
+
+    def stop(self):
+        super().stop()
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+
+    def _on_connect(self, client, userdata, flags, rc):
+        # (Re)subscribe on every connect
+        if rc == 0:
+            client.subscribe(self.topic, qos=0)
+            self._on_ready()
+
+    def _on_message(self, client, userdata, msg):
+        self.receive(msg.payload)
+
+    def _relay(self, kind: str, items: list):
+        if self.client is None:
+            return
+        try:
+            self.client.publish(self.topic, self.encode(kind, items), qos=0)
+            if kind == "events":
+                self.sent += len(items)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to relay {kind} over MQTT: {e}")
+
+class PostgresFanout(LocalFanout):
+    """
+    Relays event batches with Postgres NOTIFY on a channel every worker
+    LISTENs on. Batches are split to fit the NOTIFY payload limit and sent
+    from a background thread, so publishers never wait on the database.
+    connect(dsn) may return any DB-API connection with psycopg2's notifies.
+    """
+
+    name = "postgres"
+    relays = True
+
+    def __init__(self, dsn: Optional[str] = None, channel: str = WS_FANOUT_CHANNEL,
+                 connect: Optional[Callable] = None, max_queue: int = WS_FANOUT_QUEUE_SIZE):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.connect = connect
+        self._outbox: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _connection(self):
+        if self.connect is None:
+            import psycopg2
+
+            self.connect = psycopg2.connect
+        if self.dsn is None:
+            from app.database import engine
+
+            self.dsn = WS_FANOUT_DATABASE_URL or engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        conn = self.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def start(self, deliver: Deliver, interest: Optional[Interest] = None):
+        super().start(deliver, interest)
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._listen, name="ws-fanout-listen", daemon=True),
+            threading.Thread(target=self._send, name="ws-fanout-notify", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        # Queued until the notify connection is up
+        self._on_ready()
+        logger.info(f"WebSocket fan-out relaying over Postgres channel {self.channel}")
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=5.0)
+        self._threads = []
+        super().stop()
+
+    def _relay(self, kind: str, items: list):
+        for payload in self._chunks(kind, items):
+            try:
+                self._outbox.put_nowait(payload)
+            except queue.Full:
+                self.dropped += 1
+
+    def _chunks(self, kind: str, items: list) -> List[str]:
+        """Encode items into as few NOTIFY payloads as fit the size limit"""
+        payload = self.encode(kind, items)
+        if len(payload) <= NOTIFY_MAX_PAYLOAD:
+            return [payload.decode()]
+        if len(items) == 1:
+            self.dropped += 1
+            logger.warning(f"Fan-out {kind} message exceeds the NOTIFY payload limit")
+            return []
+        middle = len(items) // 2
+        return self._chunks(kind, items[:middle]) + self._chunks(kind, items[middle:])
+
+    def _send(self):
+        conn = None
+        while not self._stopping.is_set():
+            try:
+                payload = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if conn is None:
+                    conn = self._connection()
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Failed to relay device events over NOTIFY: {e}")
+                conn = self._close(conn)
+        self._close(conn)
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._connection()
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.receive(conn.notifies.pop(0).payload)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"WebSocket fan-out listener failed, reconnecting: {e}")
+                self._stopping.wait(RECONNECT_DELAY)
+            finally:
+                self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "queue_depth": self._outbox.qsize()}
+
+def create_fanout(backend: str = WS_FANOUT) -> LocalFanout:
+    """Fan-out backend for a WS_FANOUT value"""
+    if backend == "mqtt":
+        return MQTTFanout()
+    if backend == "postgres":
+        return PostgresFanout()
+    if backend != "local":
+        logger.warning(f"Unknown WS_FANOUT={backend}, using local")
+    return LocalFanout()
@@ -0,0 +1,349 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from fastapi import WebSocket
+from app.auth.revocation import revocation_list
+from app.services.serialization import dumps
+from app.ws.fanout import LocalFanout, create_fanout
+
+logger = logging.getLogger(__name__)
+
+# Distinct (device, event type) updates a socket may have waiting; a socket
+# that falls this far behind is closed as a slow consumer
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "1024"))
+# A single frame taking longer than this to send also closes the socket
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))  # seconds
+# How often sockets are checked for an expired or revoked access token
+WS_AUTH_CHECK_INTERVAL = float(os.getenv("WS_AUTH_CHECK_INTERVAL", "5"))  # seconds
+
+# Close code for slow consumers: "try again later"; the client reconnects
+# and reloads the current state over the REST API
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code once the socket's access token expires or is revoked: "policy
+# violation"; the client reconnects with a fresh token
+AUTH_CLOSE_CODE = 1008
+
+# (device_id, event) pairs as produced by the ingestion paths
+DeviceEvent = Tuple[str, dict]
+
+def heartbeat_event(heartbeat: dict) -> dict:
+    """Event for a heartbeat written to the devices table"""
+    event = {"type": "heartbeat", "status": "WORKING"}
+    event.update((key, value) for key, value in heartbeat.items() if key != "device_id")
+    return event
+
+def status_event(status, owner_id: Optional[int] = None) -> dict:
+    """
+    Event for a status change (a DeviceStatus or its value). owner_id is set
+    on activation so that every worker starts routing the device.
+    """
+    event = {"type": "status", "status": getattr(status, "value", status)}
+    if owner_id is not None:
+        event["owner_id"] = owner_id
+    return event
+
+def telemetry_event(recorded_at, fields: dict) -> dict:
+    """Event for a telemetry sample reported on the data topic"""
+    return {"type": "telemetry", "recorded_at": recorded_at, **fields}
+
+class SocketSender:
+    """
+    Outbound queue and writer task of one socket.
+
+    Pending frames are keyed by (device_id, event type): a newer update for
+    the same key replaces the queued one in place, so a burst of heartbeats
+    costs one frame per device. The queue holds at most max_pending keys.
+    expires_at (epoch seconds) and jti come from the socket's access token.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, max_pending: int = WS_SEND_QUEUE_SIZE,
+                 send_timeout: float = WS_SEND_TIMEOUT, expires_at: Optional[float] = None,
+                 jti: Optional[str] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.jti = jti
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self._pending: "OrderedDict[tuple, str]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Metrics
+        self.sent = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def start(self, on_failure):
+        """Start the writer task; on_failure(sender, reason) is called if it gives up"""
+        self._task = asyncio.create_task(self._run(on_failure))
+
+    def enqueue(self, key: tuple, message: str) -> bool:
+        """Queue a frame, replacing a pending one with the same key. False if the queue is full."""
+        if key in self._pending:
+            self._pending[key] = message
+            self.coalesced += 1
+            return True
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[key] = message
+        self._wakeup.set()
+        return True
+
+    async def _run(self, on_failure):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._pending:
+                    _, message = self._pending.popitem(last=False)
+                    await asyncio.wait_for(self.websocket.send_text(message), timeout=self.send_timeout)
+                    self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            on_failure(self, "send_timeout")
+        except Exception as e:
+            logger.debug(f"WebSocket send failed: {e}")
+            on_failure(self, "send_error")
+
+    async def close(self, code: int):
+        """Stop the writer and close the socket"""
+        self.stop()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self._pending.clear()
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+class ConnectionManager:
+    """
+    Live device event fan-out to WebSocket subscribers.
+
+    Sockets are grouped by owner (a user may have several tabs open) and a
+    device -> owner map makes finding a device's subscribers O(1). Devices
+    are only mapped while their owner has at least one socket, so events
+    for everyone else are discarded on the publishing thread without
+    touching the event loop.
+
+    With several workers, published events are also relayed by the fan-out
+    backend to the workers that announced subscribers for the device, and
+    each worker delivers them to its own sockets.
+
+    Publishing never awaits a socket: frames go to each socket's
+    SocketSender. Slow consumer policy: a socket whose queue is full, or
+    whose frame send exceeds WS_SEND_TIMEOUT, is closed with code 1013 and
+    the frames for it are dropped. Other sockets are unaffected. Every
+    WS_AUTH_CHECK_INTERVAL seconds, sockets whose access token has expired
+    or been revoked are closed with code 1008.
+    """
+
+    def __init__(self, fanout: Optional[LocalFanout] = None):
+        self.fanout = fanout or LocalFanout()
+        self._sockets: Dict[int, Dict[WebSocket, SocketSender]] = {}
+        self._owner_of: Dict[str, int] = {}
+        self._devices_of: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._auth_task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.send_errors = 0
+        self.dropped_frames = 0
+        self.slow_disconnects = 0
+        self.send_timeouts = 0
+        self.auth_disconnects = 0
+        self._sent_closed = 0
+        self._coalesced_closed = 0
+
+    def start(self):
+        """Bind to the running event loop and start the fan-out; call from the app lifespan"""
+        self._loop = asyncio.get_running_loop()
+        self._auth_task = self._loop.create_task(self._check_auth_loop())
+        self.fanout.start(self.deliver_threadsafe, self.watched_devices)
+
+    def stop(self):
+        """Stop relaying events between workers and checking socket tokens"""
+        if self._auth_task is not None:
+            self._auth_task.cancel()
+            self._auth_task = None
+        self.fanout.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: int, device_ids: Iterable[str],
+                      expires_at: Optional[float] = None, jti: Optional[str] = None):
+        """Register an accepted socket, the devices its user owns and its token's exp and jti"""
+        device_ids = list(device_ids)
+        sender = SocketSender(websocket, user_id, expires_at=expires_at, jti=jti)
+        sender.start(self._on_sender_failure)
+        with self._lock:
+            self._sockets.setdefault(user_id, {})[websocket] = sender
+            owned = self._devices_of.setdefault(user_id, set())
+            for device_id in device_ids:
+                owned.add(device_id)
+                self._owner_of[device_id] = user_id
+        self.connections += 1
+        self.fanout.announce(device_ids)
+
+    def disconnect(self, websocket: WebSocket, user_id: int):
+        """Forget a socket; the user's devices are unmapped with their last socket"""
+        with self._lock:
+            sockets = self._sockets.get(user_id)
+            if sockets is None:
+                return
+            sender = sockets.pop(websocket, None)
+            if sender is not None:
+                sender.stop()
+                self._sent_closed += sender.sent
+                self._coalesced_closed += sender.coalesced
+            if not sockets:
+                del self._sockets[user_id]
+                for device_id in self._devices_of.pop(user_id, ()):
+                    if self._owner_of.get(device_id) == user_id:
+                        del self._owner_of[device_id]
+
+    def track_device(self, device_id: str, user_id: int):
+        """Start routing a newly activated device to its owner's sockets"""
+        with self._lock:
+            if user_id not in self._sockets or self._owner_of.get(device_id) == user_id:
+                return
+            self._devices_of[user_id].add(device_id)
+            self._owner_of[device_id] = user_id
+        self.fanout.announce([device_id])
+
+    def is_subscribed(self, device_id: str) -> bool:
+        return device_id in self._owner_of
+
+    def watched_devices(self) -> List[str]:
+        """Ids of the devices with subscribers on this worker"""
+        with self._lock:
+            return list(self._owner_of)
+
+    def publish_threadsafe(self, events: Iterable[DeviceEvent]):
+        """Deliver device events to local sockets and relay them to the other workers"""
+        events = list(events)
+        if not events:
+            return
+        self.deliver_threadsafe(events)
+        self.fanout.publish(events)
+
+    def deliver_threadsafe(self, events: List[DeviceEvent]):
+        """
+        Hand device events from any thread to the event loop. Events for
+        devices nobody is watching here are dropped.
+        """
+        for device_id, event in events:
+            if event.get("owner_id") is not None:
+                self.track_device(device_id, event["owner_id"])
+        wanted = [(device_id, event) for device_id, event in events if device_id in self._owner_of]
+        if not wanted or self._loop is None or self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.publish(wanted), self._loop)
+
+    async def publish(self, events: List[DeviceEvent]):
+        """Queue each event on every socket of the device's owner"""
+        for device_id, event in events:
+            owner = self._owner_of.get(device_id)
+            senders = list(self._sockets.get(owner, {}).values()) if owner is not None else []
+            if not senders:
+                continue
+            self.published += 1
+            message = dumps({"device_id": device_id, **event}).decode()
+            # Command results are never coalesced, each one is reported
+            key = (device_id, event.get("type"), event.get("command_id"))
+            for sender in senders:
+                if sender.closed:
+                    continue
+                if sender.enqueue(key, message):
+                    self.delivered += 1
+                else:
+                    self.dropped_frames += 1
+                    self._on_sender_failure(sender, "queue_full")
+            # Let writer tasks drain between events of a large batch, so only
+            # sockets that really fall behind hit their queue limit
+            await asyncio.sleep(0)
+
+    async def _check_auth_loop(self):
+        while True:
+            await asyncio.sleep(WS_AUTH_CHECK_INTERVAL)
+            try:
+                self.check_auth()
+            except Exception as e:
+                logger.error(f"WebSocket token check failed: {e}")
+
+    def check_auth(self, now: Optional[float] = None) -> int:
+        """Close sockets whose access token has expired or been revoked. Returns how many."""
+        now = time.time() if now is None else now
+        with self._lock:
+            senders = [sender for sockets in self._sockets.values() for sender in sockets.values()]
+        closed = 0
+        for sender in senders:
+            expired = sender.expires_at is not None and sender.expires_at <= now
+            if not expired and (sender.jti is None or not revocation_list.is_revoked(sender.jti)):
+                continue
+            self.auth_disconnects += 1
+            closed += 1
+            self.disconnect(sender.websocket, sender.user_id)
+            asyncio.ensure_future(sender.close(AUTH_CLOSE_CODE))
+        return closed
+
+    def _on_sender_failure(self, sender: SocketSender, reason: str):
+        """Apply the slow consumer policy to a socket"""
+        if sender.closed:
+            return
+        if reason == "send_error":
+            self.send_errors += 1
+        else:
+            self.slow_disconnects += 1
+            if reason == "send_timeout":
+                self.send_timeouts += 1
+            logger.info(f"Closing slow WebSocket of user {sender.user_id} ({reason})")
+        self.dropped_frames += sender.depth
+        self.disconnect(sender.websocket, sender.user_id)
+        asyncio.ensure_future(sender.close(SLOW_CONSUMER_CLOSE_CODE))
+
+    def stats(self) -> dict:
+        """Return connection, queue depth and delivery counters"""
+        with self._lock:
+            users = len(self._sockets)
+            senders = [sender for sockets in self._sockets.values() for sender in sockets.values()]
+            devices = len(self._owner_of)
+        depths = [sender.depth for sender in senders]
+        return {
+            "users": users,
+            "sockets": len(senders),
+            "tracked_devices": devices,
+            "connections": self.connections,
+            "published": self.published,
+            # Frames accepted into socket queues, including coalesced ones
+            "delivered": self.delivered,
+            "sent": self._sent_closed + sum(sender.sent for sender in senders),
+            "coalesced": self._coalesced_closed + sum(sender.coalesced for sender in senders),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_capacity": WS_SEND_QUEUE_SIZE,
+            "dropped_frames": self.dropped_frames,
+            "slow_disconnects": self.slow_disconnects,
+            "send_timeouts": self.send_timeouts,
+            "send_errors": self.send_errors,
+            "auth_disconnects": self.auth_disconnects,
+            "fanout": self.fanout.stats(),
+        }
+
+# Global WebSocket connection manager
+manager = ConnectionManager(create_fanout())
@@ -1,30 +1,55 @@
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from jose import jwt
+from app.auth.auth import AUTH_MODE, get_current_user, get_current_user_from_claims
+from app.database import SessionLocal
+from app.services import device_service
+from app.ws.manager import manager
 
 router = APIRouter()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
-        del self.active_connections[client_id]
-
-    async def send_personal_message(self, message: str, client_id: str):
-        await self.active_connections[client_id].send_text(message)
-
-manager = ConnectionManager()
-
-@router.websocket("/ws/devices/{uuid}")
-async def websocket_endpoint(websocket: WebSocket, uuid: str):
-    await manager.connect(websocket, uuid)
+def _load_subscriber(token: str):
+    """
+    Authenticate a socket's access token. Returns (user_id, owned device ids,
+    token claims) or None.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            if AUTH_MODE == "claims":
+                user = get_current_user_from_claims(token)
+            else:
+                user = get_current_user(token, db)
+        except HTTPException:
+            return None
+        # Verified above; exp and jti are re-checked while the socket is open
+        claims = jwt.get_unverified_claims(token)
+        return user.id, device_service.get_user_device_ids(db, user.id), claims
+    finally:
+        db.close()
+
+@router.websocket("/ws")
+async def device_events(websocket: WebSocket, token: Optional[str] = None):
+    """
+    Live status, heartbeat and telemetry events for all devices of the user.
+    Browsers cannot set headers on WebSocket requests, so the access token is
+    passed as the token query parameter. The socket is closed with 1008 once
+    the token expires or is revoked. Messages from the client are ignored.
+    """
+    subscriber = await run_in_threadpool(_load_subscriber, token) if token else None
+    if subscriber is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    user_id, device_ids, claims = subscriber
+    await websocket.accept()
+    await manager.connect(websocket, user_id, device_ids, expires_at=claims.get("exp"), jti=claims.get("jti"))
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.send_personal_message(f"You wrote: {data}", uuid)
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(uuid)
+        pass
+    finally:
+        manager.disconnect(websocket, user_id)
@@ -1,13 +1,66 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from app.services.get_db import get_db
+from app.services.heartbeat_buffer import heartbeat_buffer
+from app.services.liveness import liveness_tracker
+from app.services.telemetry_service import telemetry_writer
+from app.services.mqtt_ingest import device_ingestor
+from app.services.mqtt_service import mqtt_service
+from app.services.password_hasher import password_hasher
+from app.services.command_service import command_dispatcher
+from app.services.broadcast_service import broadcast_service
+from app.auth.revocation import revocation_list
+from app.services.replica_router import replica_router, request_subject
+from app.services.migrations import upgrade_head, verify_schema
+from app.services.serialization import FastJSONResponse
+from app.database import engine
+from app.ws.manager import manager as ws_manager
+
+MQTT_ENABLED = os.getenv("MQTT_ENABLED", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services on startup and drain them on shutdown"""
+    verify_schema(engine)
+    ws_manager.start()
+    password_hasher.start()
+    revocation_list.start()
+    replica_router.start()
+    heartbeat_buffer.start()
+    telemetry_writer.start()
+    liveness_tracker.start()
+    command_dispatcher.start()
+    broadcast_service.start()
+    if MQTT_ENABLED:
+        device_ingestor.start()
+        mqtt_service.connect()
+    try:
+        yield
+    finally:
+        broadcast_service.stop()
+        if MQTT_ENABLED:
+            # Stop receiving first, then drain what is already queued
+            mqtt_service.disconnect()
+            device_ingestor.stop()
+        # Final flush so buffered heartbeats are not lost on shutdown
+        heartbeat_buffer.stop()
+        telemetry_writer.stop()
+        liveness_tracker.stop()
+        command_dispatcher.stop()
+        revocation_list.stop()
+        replica_router.stop()
+        ws_manager.stop()
+        password_hasher.shutdown()
 
 app = FastAPI(
     title="PeluPrice API",
     description="API for PeluPrice project",
     version=os.getenv("API_VERSION", "v1"),
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # CORS middleware configuration
@@ -24,8 +77,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # Pagination cursor for list endpoints
+    expose_headers=["X-Next-Cursor", "Link", "ETag"],
 )
 
+READ_ONLY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """After a successful write, route that user's reads to the primary for a short window"""
+    response = await call_next(request)
+    if (
+        replica_router.enabled
+        and request.method not in READ_ONLY_METHODS
+        and response.status_code < 400
+    ):
+        replica_router.mark_write(request_subject(request.headers.get("authorization")))
+    return response
+
 @app.get("/health", summary="Health Check", tags=["Health"])
 def health_check():
     """
@@ -36,22 +105,24 @@ def health_check():
 @app.post("/init-db", summary="Initialize Database", tags=["Admin"])
 def init_database():
     """
-    Initialize database tables. Call this endpoint after deployment.
+    Initialize database tables by applying pending migrations. Call this endpoint after deployment.
     """
     try:
-        from app.models import Base
-        from app.database import engine
-        Base.metadata.create_all(bind=engine)
-        return {"status": "success", "message": "Database tables created successfully"}
+        upgrade_head()
+        return {"status": "success", "message": "Database migrated to the latest revision"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database initialization failed: {str(e)}")
 
 # Include routers
-from app.api import users, devices, auth
+from app.api import users, devices, auth, admin
+from app.ws import websocket
 
 app.include_router(users.router, prefix="/api/v1", tags=["Users"])
 app.include_router(devices.router, prefix="/api/v1", tags=["Devices"])
 app.include_router(auth.router, prefix="/api/v1", tags=["Auth"])
+app.include_router(admin.router, prefix="/api/v1", tags=["Admin"])
+# Served at /ws, next to the API (NEXT_PUBLIC_WS_URL)
+app.include_router(websocket.router, tags=["WebSocket"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,122 @@
+"""Baseline schema
+
+Creates the tables as they existed before migrations were introduced. Tables
+already created by Base.metadata.create_all are left alone, so existing
+databases can be upgraded in place.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+DEVICE_STATUS = sa.Enum(
+    "CREATED", "DEPLOYED", "DELIVERED", "ACTIVATED", "WORKING", "OFFLINE", "ERROR",
+    name="devicestatus",
+)
+
+def _rollup_table(name: str):
+    op.create_table(
+        name,
+        sa.Column("device_id", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("samples", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("battery_count", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("battery_sum", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.Column("battery_min", sa.Integer(), nullable=True),
+        sa.Column("battery_max", sa.Integer(), nullable=True),
+        sa.Column("signal_count", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("signal_sum", sa.BigInteger(), server_default=sa.text("0"), nullable=False),
+        sa.Column("signal_min", sa.Integer(), nullable=True),
+        sa.Column("signal_max", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("device_id", "bucket_start"),
+        postgresql_partition_by="RANGE (bucket_start)",
+    )
+
+def upgrade():
+    # Offline (--sql) mode cannot inspect, emit the full schema
+    existing = set() if context.is_offline_mode() else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("email", sa.String(), nullable=True),
+            sa.Column("password_hash", sa.String(), nullable=True),
+            sa.Column("first_name", sa.String(), nullable=True),
+            sa.Column("last_name", sa.String(), nullable=True),
+            sa.Column("phone_number", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "devices" not in existing:
+        op.create_table(
+            "devices",
+            sa.Column("id", sa.String(), nullable=False),
+            sa.Column("name", sa.String(), nullable=True),
+            sa.Column("activation_key", sa.String(), nullable=False),
+            sa.Column("owner_id", sa.Integer(), nullable=True),
+            sa.Column("status", DEVICE_STATUS, nullable=True),
+            sa.Column("is_active", sa.Boolean(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("activated_at", sa.DateTime(), nullable=True),
+            sa.Column("last_seen", sa.DateTime(), nullable=True),
+            sa.Column("firmware_version", sa.String(), nullable=True),
+            sa.Column("hardware_version", sa.String(), nullable=True),
+            sa.Column("ip_address", sa.String(), nullable=True),
+            sa.Column("signal_strength", sa.Integer(), nullable=True),
+            sa.Column("battery_level", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["owner_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("activation_key"),
+        )
+        op.create_index("ix_devices_id", "devices", ["id"])
+
+    if "device_telemetry" not in existing:
+        op.create_table(
+            "device_telemetry",
+            sa.Column("device_id", sa.String(), nullable=False),
+            sa.Column("recorded_at", sa.DateTime(), nullable=False),
+            sa.Column("signal_strength", sa.Integer(), nullable=True),
+            sa.Column("battery_level", sa.Integer(), nullable=True),
+            sa.Column("ip_address", sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint("device_id", "recorded_at"),
+            postgresql_partition_by="RANGE (recorded_at)",
+        )
+    for name in ("device_telemetry_1m", "device_telemetry_1h", "device_telemetry_1d"):
+        if name not in existing:
+            _rollup_table(name)
+
+    if "revoked_tokens" not in existing:
+        op.create_table(
+            "revoked_tokens",
+            sa.Column("id", sa.BigInteger(), nullable=False),
+            sa.Column("jti", sa.String(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+            sa.Column(
+                "revoked_at", sa.DateTime(),
+                server_default=sa.text("(now() at time zone 'utc')"), nullable=False,
+            ),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("jti"),
+        )
+        op.create_index("ix_revoked_tokens_expires_at", "revoked_tokens", ["expires_at"])
+        op.create_index("ix_revoked_tokens_revoked_at", "revoked_tokens", ["revoked_at"])
+
+def downgrade():
+    op.drop_table("revoked_tokens")
+    for name in ("device_telemetry_1d", "device_telemetry_1h", "device_telemetry_1m", "device_telemetry"):
+        op.drop_table(name)
+    op.drop_table("devices")
+    DEVICE_STATUS.drop(op.get_bind(), checkfirst=True)
+    op.drop_table("users")
@@ -0,0 +1,42 @@
+"""Performance indexes for device listing and offline sweeps
+
+Built CONCURRENTLY so writes to devices are not blocked. A failed concurrent
+build leaves an INVALID index behind; drop it and run the upgrade again.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # list_user_devices filters by owner
+        op.create_index(
+            "ix_devices_owner_id", "devices", ["owner_id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # Liveness rebuild and offline sweeps only look at active devices
+        op.create_index(
+            "ix_devices_active_last_seen", "devices", ["last_seen"],
+            postgresql_where=sa.text("is_active"),
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_devices_active_last_seen", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            "ix_devices_owner_id", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
@@ -0,0 +1,37 @@
+"""Composite owner/id index for keyset pagination of device listings
+
+Replaces ix_devices_owner_id: (owner_id, id) serves the same owner lookups
+and also returns a user's devices already ordered by id.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_owner_id_id", "devices", ["owner_id", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_devices_owner_id", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_owner_id", "devices", ["owner_id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_devices_owner_id_id", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
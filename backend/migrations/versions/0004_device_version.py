@@ -0,0 +1,42 @@
+"""Device row version for ETags
+
+Adds devices.version, bumped by every device write, and replaces
+ix_devices_owner_id_id with an (owner_id, id) index that includes version so
+the ETag of a user's device page comes from an index-only scan.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # A constant default is a catalog-only change, existing rows are not rewritten
+    op.add_column("devices", sa.Column("version", sa.Integer(), server_default=sa.text("1"), nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_owner_id_id_version", "devices", ["owner_id", "id"],
+            postgresql_include=["version"], postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_devices_owner_id_id", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devices_owner_id_id", "devices", ["owner_id", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            "ix_devices_owner_id_id_version", table_name="devices",
+            postgresql_concurrently=True, if_exists=True,
+        )
+    op.drop_column("devices", "version")
@@ -19,6 +19,7 @@ const char* SERVER_URL = "https://peluprice.com/api/v1/device/register";
 const char* HEARTBEAT_URL = "https://peluprice.com/api/v1/devices/%s/heartbeat";
 const char* MQTT_SERVER = "peluprice.com";
 const int MQTT_PORT = 1883;
+const char* FIRMWARE_VERSION = "1.0.0";
 
 // Device states
 enum DeviceState {
@@ -53,7 +54,7 @@ void sendDeviceRegistration();
 void connectMQTT();
 void mqttCallback(char* topic, byte* message, unsigned int length);
 void sendHeartbeat();
-void executeCommand(String command, String payload);
+bool executeCommand(String command, String payload);
 void updateStatusLED();
 
 void setup() {
@@ -323,7 +324,7 @@ void sendDeviceRegistration() {
     StaticJsonDocument<300> doc;
     doc["device_id"] = deviceId;
     doc["activation_key"] = activationKey;
-    doc["firmware_version"] = "1.0.0";
+    doc["firmware_version"] = FIRMWARE_VERSION;
     doc["hardware_version"] = "ESP32-v1";
 
     String requestBody;
@@ -361,6 +362,11 @@ void connectMQTT() {
         mqttClient.subscribe(commandTopic.c_str());
         Serial.printf("Subscribed to: %s\n", commandTopic.c_str());
         
+        // Fleet and per-firmware broadcasts; acks still go to our own ack topic
+        mqttClient.subscribe("peluprice/broadcast/all/commands");
+        String firmwareTopic = String("peluprice/broadcast/firmware/") + FIRMWARE_VERSION + "/commands";
+        mqttClient.subscribe(firmwareTopic.c_str());
+        
         // Publish device status
         String statusTopic = mqttTopic + "/status";
         StaticJsonDocument<200> statusDoc;
@@ -389,16 +395,29 @@ void mqttCallback(char* topic, byte* message, unsigned int length) {
     Serial.printf("MQTT message [%s]: %s\n", topic, messageStr.c_str());
     
     // Parse command
-    StaticJsonDocument<200> doc;
+    StaticJsonDocument<384> doc;
     deserializeJson(doc, messageStr);
     
     String command = doc["type"];
     String payload = doc["payload"];
+    String commandId = doc["command_id"] | "";
+    
+    bool ok = executeCommand(command, payload);
     
-    executeCommand(command, payload);
+    // Acknowledge so the backend can report the result
+    if (commandId.length() > 0) {
+        StaticJsonDocument<200> ackDoc;
+        ackDoc["command_id"] = commandId;
+        ackDoc["status"] = ok ? "ok" : "unknown_command";
+        
+        String ackPayload;
+        serializeJson(ackDoc, ackPayload);
+        String ackTopic = mqttTopic + "/ack";
+        mqttClient.publish(ackTopic.c_str(), ackPayload.c_str());
+    }
 }
 
-void executeCommand(String command, String payload) {
+bool executeCommand(String command, String payload) {
     Serial.printf("Executing command: %s with payload: %s\n", command.c_str(), payload.c_str());
     
     if (command == "alarm") {
@@ -439,7 +458,9 @@ void executeCommand(String command, String payload) {
         
     } else {
         Serial.printf("Unknown command: %s\n", command.c_str());
+        return false;
     }
+    return true;
 }
 
 void sendHeartbeat() {
@@ -454,7 +475,7 @@ void sendHeartbeat() {
     doc["signal_strength"] = WiFi.RSSI();
     doc["free_heap"] = ESP.getFreeHeap();
     doc["uptime"] = millis() / 1000;
-    doc["firmware_version"] = "1.0.0";
+    doc["firmware_version"] = FIRMWARE_VERSION;
     
     String payload;
     serializeJson(doc, payload);
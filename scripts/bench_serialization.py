@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for device list serialization.
+
+Compares the previous response path (row -> dict -> response_model validation
+-> jsonable dump -> json.dumps) with the precompiled device serializer, per
+item, for 1k and 10k devices.
+
+Usage:
+    python scripts/bench_serialization.py
+    JSON_BACKEND=stdlib python scripts/bench_serialization.py --sizes 1000 10000 --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+# Add the backend directory to the Python path
+for candidate in (os.path.join(os.path.dirname(__file__), '..', 'backend'), os.path.join(os.path.dirname(__file__), '..')):
+    if os.path.exists(os.path.join(candidate, 'app')):
+        sys.path.insert(0, os.path.abspath(candidate))
+        break
+
+from pydantic import TypeAdapter
+from app import schemas
+from app.models.device import DeviceStatus
+from app.services.serialization import device_serializer, json_backend
+
+def fake_devices(count):
+    now = datetime.now()
+    return [
+        SimpleNamespace(
+            id=f"PLP{i:08d}",
+            name=f"Device {i}",
+            activation_key=f"KEY{i:013d}",
+            owner_id=1,
+            status=DeviceStatus.WORKING,
+            is_active=True,
+            created_at=now - timedelta(days=30),
+            activated_at=now - timedelta(days=29),
+            last_seen=now - timedelta(seconds=i % 300),
+            firmware_version="1.4.2",
+            hardware_version="rev-b",
+            ip_address=f"10.0.{i // 256 % 256}.{i % 256}",
+            signal_strength=-60 - i % 30,
+            battery_level=i % 100,
+        )
+        for i in range(count)
+    ]
+
+def device_to_dict(device):
+    """The per-row conversion the list endpoint used before"""
+    return {
+        "id": device.id,
+        "name": device.name,
+        "activation_key": device.activation_key,
+        "owner_id": device.owner_id,
+        "status": device.status.value if device.status else "DEPLOYED",
+        "is_active": device.is_active or False,
+        "created_at": device.created_at,
+        "activated_at": device.activated_at,
+        "last_seen": device.last_seen,
+        "firmware_version": device.firmware_version,
+        "hardware_version": device.hardware_version,
+        "ip_address": device.ip_address,
+        "signal_strength": device.signal_strength,
+        "battery_level": device.battery_level,
+    }
+
+adapter = TypeAdapter(List[schemas.Device])
+
+def baseline(devices):
+    # What FastAPI did with response_model: validate, dump to JSON types, encode
+    content = adapter.dump_python(adapter.validate_python([device_to_dict(d) for d in devices]), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def serializer(devices):
+    return device_serializer.dumps_many(devices)
+
+def best_of(fn, devices, repeat):
+    fn(devices)  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(devices)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark device list serialization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {json_backend}")
+    print(f"{'devices':>8} {'baseline us/item':>17} {'serializer us/item':>19} {'speedup':>8}")
+    for size in args.sizes:
+        devices = fake_devices(size)
+        if json.loads(baseline(devices)) != json.loads(serializer(devices)):
+            print("Output mismatch between baseline and serializer")
+            return 1
+        old = best_of(baseline, devices, args.repeat) / size * 1e6
+        new = best_of(serializer, devices, args.repeat) / size * 1e6
+        print(f"{size:>8} {old:>17.2f} {new:>19.2f} {old / new:>7.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
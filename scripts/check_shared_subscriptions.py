@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Check that the broker load-balances a shared subscription.
+
+Starts several MQTT v5 consumers in one $share group, publishes messages on
+a scratch topic and reports how many each consumer received. Every message
+should be delivered exactly once across the group. Note that the broker
+balances per message, not per device: consecutive messages of one device
+can reach different consumers, so the backend orders status updates by
+receive time rather than relying on delivery order.
+
+Usage:
+    python scripts/check_shared_subscriptions.py
+    python scripts/check_shared_subscriptions.py --host localhost --consumers 3 --messages 300
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+
+import paho.mqtt.client as mqtt
+
+def make_client(client_id, username, password):
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, protocol=mqtt.MQTTv5)
+    else:
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+    if username and password:
+        client.username_pw_set(username, password)
+    return client
+
+def main():
+    parser = argparse.ArgumentParser(description="Check MQTT shared subscription load balancing")
+    parser.add_argument("--host", default=os.getenv("MQTT_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    parser.add_argument("--group", default="sharecheck")
+    parser.add_argument("--consumers", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for delivery")
+    args = parser.parse_args()
+
+    username = os.getenv("MQTT_USERNAME", "peluprice")
+    password = os.getenv("MQTT_PASSWORD", "peluprice123")
+    run_id = uuid.uuid4().hex[:8]
+    # Scratch topic, so running backends do not ingest the test messages
+    topic = f"peluprice/sharecheck/{run_id}"
+
+    received = [[] for _ in range(args.consumers)]
+    lock = threading.Lock()
+    subscribed = threading.Semaphore(0)
+    consumers = []
+
+    for index in range(args.consumers):
+        def on_message(client, userdata, msg, index=index):
+            with lock:
+                received[index].append(msg.payload.decode())
+
+        client = make_client(f"sharecheck-{run_id}-{index}", username, password)
+        client.on_message = on_message
+        client.on_subscribe = lambda *callback_args: subscribed.release()
+        client.connect(args.host, args.port, 60)
+        client.loop_start()
+        client.subscribe(f"$share/{args.group}/{topic}", qos=1)
+        consumers.append(client)
+
+    for _ in consumers:
+        if not subscribed.acquire(timeout=args.timeout):
+            print("Timed out waiting for subscriptions")
+            return 1
+
+    publisher = make_client(f"sharecheck-{run_id}-pub", username, password)
+    publisher.connect(args.host, args.port, 60)
+    publisher.loop_start()
+    for number in range(args.messages):
+        publisher.publish(topic, str(number), qos=1).wait_for_publish()
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        with lock:
+            if sum(len(messages) for messages in received) >= args.messages:
+                break
+        time.sleep(0.1)
+    # Give duplicates a moment to show up
+    time.sleep(0.5)
+
+    for client in consumers + [publisher]:
+        client.loop_stop()
+        client.disconnect()
+
+    delivered = [message for messages in received for message in messages]
+    for index, messages in enumerate(received):
+        print(f"consumer {index}: {len(messages)} messages")
+    missing = args.messages - len(set(delivered))
+    duplicates = len(delivered) - len(set(delivered))
+    print(f"published {args.messages}, delivered {len(delivered)}, missing {missing}, duplicates {duplicates}")
+
+    balanced = all(received) or args.consumers > args.messages
+    if missing or duplicates or not balanced:
+        print("FAIL: messages were not delivered exactly once across the group")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,13 +40,12 @@ def initialize_database():
         # Wait for database
         engine = wait_for_db()
         
-        # Import models to register them
-        from app.models import Base, User, Device
+        from app.services.migrations import upgrade_head
         
-        # Create all tables
-        logger.info("Creating database tables...")
-        Base.metadata.create_all(bind=engine)
-        logger.info("✅ Database tables created successfully")
+        # Create or upgrade tables
+        logger.info("Applying database migrations...")
+        upgrade_head(os.getenv("DATABASE_URL", "postgresql://peluprice:peluprice123@db:5432/peluprice"))
+        logger.info("✅ Database migrated to the latest revision")
         
         # Check and create initial data
         with engine.connect() as conn:
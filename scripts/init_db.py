@@ -11,6 +11,7 @@ try:
     from app.models import Base  # Import all models
     from app.models.user import User  # Ensure user model is loaded
     from app.models.device import Device  # Ensure device model is loaded
+    from app.services.migrations import upgrade_head
 except ImportError as e:
     print(f"ERROR: Could not import models: {e}")
     sys.exit(1)
@@ -37,16 +38,17 @@ def get_db_engine():
     sys.exit(1)
 
 def initialize_database():
-    """Initializes the database by creating all tables."""
+    """Initializes the database by applying all pending migrations."""
     print("Initializing database...")
     engine = get_db_engine()
+    engine.dispose()
     
     try:
-        print("Creating tables...")
-        Base.metadata.create_all(bind=engine)
-        print("Tables created successfully.")
+        print("Applying migrations...")
+        upgrade_head(os.getenv("DATABASE_URL"))
+        print("Database is at the latest revision.")
     except Exception as e:
-        print(f"An error occurred during table creation: {e}")
+        print(f"An error occurred during migration: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Run database migrations (Alembic) for the backend.
+
+Usage:
+    python scripts/migrate.py upgrade head
+    python scripts/migrate.py current
+    python scripts/migrate.py revision --autogenerate -m "describe change"
+    python scripts/migrate.py check
+
+Any Alembic command works; the database URL comes from DATABASE_URL.
+"""
+
+import os
+import sys
+
+def find_backend_dir():
+    """The backend lives next to scripts/ in the repository and above it in the image"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for candidate in (os.path.join(here, '..', 'backend'), os.path.join(here, '..')):
+        if os.path.exists(os.path.join(candidate, 'alembic.ini')):
+            return os.path.abspath(candidate)
+    print("ERROR: Could not find alembic.ini")
+    sys.exit(1)
+
+BACKEND_DIR = find_backend_dir()
+sys.path.insert(0, BACKEND_DIR)
+
+if __name__ == "__main__":
+    from alembic.config import main
+
+    main(argv=["-c", os.path.join(BACKEND_DIR, "alembic.ini")] + (sys.argv[1:] or ["upgrade", "head"]))
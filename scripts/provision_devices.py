@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Bulk-provision a factory batch of devices.
+
+The input is CSV with a header row (device_id,activation_key,firmware_version,
+hardware_version,name) or NDJSON with the same keys, one object per line.
+
+Usage:
+    python scripts/provision_devices.py batch.csv
+    python scripts/provision_devices.py batch.ndjson --batch-size 5000
+    python scripts/provision_devices.py batch.csv --api-url https://api.peluprice.com/api/v1
+
+Without --api-url the rows are loaded straight into DATABASE_URL. With it they
+are streamed to POST /device/provision using PROVISIONING_TOKEN.
+"""
+
+import os
+import sys
+import json
+import argparse
+import urllib.request
+import urllib.error
+
+# Add the backend directory to the Python path
+for candidate in (os.path.join(os.path.dirname(__file__), '..', 'backend'), os.path.join(os.path.dirname(__file__), '..')):
+    if os.path.exists(os.path.join(candidate, 'app')):
+        sys.path.insert(0, os.path.abspath(candidate))
+        break
+
+def detect_format(path, explicit):
+    if explicit:
+        return explicit
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+def provision_direct(path, fmt, batch_size):
+    """Load the file into the database with the provisioning service"""
+    from app.database import SessionLocal
+    from app.services.provisioning_service import provision_lines
+
+    db = SessionLocal()
+    try:
+        with open(path, encoding="utf-8-sig") as lines:
+            return provision_lines(db, lines, fmt, batch_size=batch_size).as_dict()
+    finally:
+        db.close()
+
+def provision_api(path, fmt, api_url):
+    """Stream the file to the provisioning endpoint"""
+    token = os.getenv("PROVISIONING_TOKEN")
+    if not token:
+        print("ERROR: PROVISIONING_TOKEN environment variable not set.")
+        sys.exit(1)
+
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    with open(path, "rb") as body:
+        request = urllib.request.Request(
+            f"{api_url.rstrip('/')}/device/provision?format={fmt}",
+            data=body,
+            method="POST",
+            headers={
+                "Content-Type": content_type,
+                "Content-Length": str(os.path.getsize(path)),
+                "X-Provisioning-Token": token,
+            },
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            print(f"ERROR: provisioning failed with HTTP {e.code}: {e.read().decode(errors='replace')}")
+            sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-provision devices from CSV or NDJSON")
+    parser.add_argument("file", help="CSV or NDJSON file")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per INSERT (direct mode)")
+    parser.add_argument("--api-url", help="API base URL, e.g. http://localhost:8000/api/v1")
+    parser.add_argument("--report", help="write the full JSON report to this file")
+    args = parser.parse_args()
+
+    fmt = detect_format(args.file, args.format)
+    if args.api_url:
+        report = provision_api(args.file, fmt, args.api_url)
+    else:
+        report = provision_direct(args.file, fmt, args.batch_size)
+
+    print(
+        f"Received {report['received']} rows: {report['inserted']} inserted, "
+        f"{report['conflicts']} conflicts, {report['invalid']} invalid "
+        f"in {report['elapsed_seconds']}s ({report['rows_per_second']} rows/s)"
+    )
+    for problem in report["problems"][:20]:
+        print(f"  line {problem['line']}: {problem['reason']} {problem['device_id'] or ''}".rstrip())
+    if len(report["problems"]) > 20 or report["problems_truncated"]:
+        print("  ... more problems in the full report")
+
+    if args.report:
+        with open(args.report, "w") as output:
+            json.dump(report, output, indent=2)
+
+    sys.exit(1 if report["invalid"] else 0)
+
+if __name__ == "__main__":
+    main()